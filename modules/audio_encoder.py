@@ -0,0 +1,187 @@
+import math
+import queue
+import threading
+import numpy as np
+import soundfile as sf
+
+# libsndfile format and subtype used for each output file extension
+AUDIO_FORMATS = {
+    ".wav": ("WAV", "PCM_16"),
+    ".flac": ("FLAC", "PCM_16"),
+    ".opus": ("OGG", "OPUS"),
+    ".mp3": ("MP3", "MPEG_LAYER_III")
+}
+
+# Sample rates the Opus encoder accepts
+OPUS_SAMPLE_RATES = [8000, 12000, 16000, 24000, 48000]
+
+# Number of pieces of audio that can wait for the encoder before the producer has to wait for it to catch up
+DEFAULT_QUEUE_SIZE = 8
+
+# Marks the end of the audio in an encoder's queue
+END_OF_AUDIO = None
+
+
+# Return (format, subtype) for an output file extension such as ".flac"
+def get_audio_format(file_extension):
+    file_extension = file_extension.lower()
+
+    if file_extension not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio file type: {file_extension}. Options: {', '.join(AUDIO_FORMATS)}")
+
+    return AUDIO_FORMATS[file_extension]
+
+
+# Check the sample rate can be written in the given file type, returning the sample rate to use
+def get_output_sample_rate_for_format(file_extension, input_sample_rate, output_sample_rate=None):
+    sample_rate = output_sample_rate or input_sample_rate
+
+    if get_audio_format(file_extension)[1] == "OPUS" and sample_rate not in OPUS_SAMPLE_RATES:
+        raise ValueError(f"Opus only supports sample rates {OPUS_SAMPLE_RATES}, not {sample_rate}")
+
+    return sample_rate
+
+
+# Convert float samples in the range -1 to 1 into 16-bit PCM bytes, peak normalized the same way the Coqui synthesizer saves WAV files
+def float_to_pcm16(wav):
+    wav = np.asarray(wav, dtype=np.float32)
+
+    if len(wav) == 0:
+        return b""
+
+    wav_norm = wav * (32767 / max(0.01, np.max(np.abs(wav))))
+    return wav_norm.astype(np.int16).tobytes()
+
+
+# Number of channels in samples, which are shaped (frames,) for mono and (frames, channels) otherwise
+def get_channel_count(samples):
+    return samples.shape[1] if samples.ndim > 1 else 1
+
+
+# Resample float samples, and downmix them to mono unless downmix is False, then convert them to peak normalized 16-bit samples.
+# Samples shaped (frames, channels) that are kept as they are come back in the same shape
+def prepare_samples(wav, input_sample_rate, output_sample_rate, downmix=True):
+    wav = np.asarray(wav, dtype=np.float32)
+
+    # Samples shaped (frames, channels) are averaged into one channel
+    if wav.ndim > 1 and downmix:
+        wav = wav.mean(axis=1)
+
+    if output_sample_rate != input_sample_rate and len(wav) > 0:
+        # SciPy takes a while to import, so it is only loaded once audio actually needs resampling
+        from scipy.signal import resample_poly
+
+        divisor = math.gcd(input_sample_rate, output_sample_rate)
+        wav = resample_poly(wav, output_sample_rate // divisor, input_sample_rate // divisor, axis=0).astype(np.float32)
+
+    return np.frombuffer(float_to_pcm16(wav), dtype=np.int16).reshape(wav.shape)
+
+
+class AudioEncoder:
+    """
+    Encodes audio to a WAV, FLAC, Opus or MP3 file on a background thread, so encoding overlaps with synthesis.
+    With the default of one channel, audio with more channels is downmixed to mono. With more, audio must have that many.
+    Audio passed to write() goes into a bounded queue. If the encoder falls behind, write() waits for space
+    rather than holding more and more audio in memory. The file type is taken from file_extension, or from output_path.
+    Each piece of audio is peak normalized separately, the same way the WAV files have always been written.
+    """
+
+    def __init__(self, output_path, input_sample_rate, output_sample_rate=None, file_extension=None, queue_size=DEFAULT_QUEUE_SIZE, channels=1):
+        output_path = str(output_path)
+        file_extension = file_extension or output_path[output_path.rfind("."):]
+        audio_format, subtype = get_audio_format(file_extension)
+
+        self._input_sample_rate = input_sample_rate
+        self._output_sample_rate = get_output_sample_rate_for_format(file_extension, input_sample_rate, output_sample_rate)
+        self._output_path = output_path
+        self._channels = channels
+        self._frames_written = 0
+        self._error = None
+
+        self._file = sf.SoundFile(output_path, "w", samplerate=self._output_sample_rate, channels=channels, format=audio_format, subtype=subtype)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._encode, name=f"AudioEncoder({output_path})", daemon=True)
+        self._thread.start()
+
+    def write(self, wav):
+        """
+        Queue float samples to be encoded. Waits if the queue is full.
+        """
+        if self._error is not None:
+            raise self._error
+
+        self._queue.put(wav)
+
+    def close(self):
+        """
+        Encode any queued audio and finish the file. Raises any error the encoder thread ran into.
+        """
+        if self._thread.is_alive():
+            self._queue.put(END_OF_AUDIO)
+            self._thread.join()
+
+        if not self._file.closed:
+            self._file.close()
+
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def frames_written(self):
+        return self._frames_written
+
+    @property
+    def output_path(self):
+        return self._output_path
+
+    @property
+    def sample_rate(self):
+        return self._output_sample_rate
+
+    @property
+    def channels(self):
+        return self._channels
+
+    def _encode(self):
+        while True:
+            wav = self._queue.get()
+
+            if wav is END_OF_AUDIO:
+                break
+
+            # After an error keep emptying the queue so the producer is never left waiting, the error is raised to it on its next call
+            if self._error is not None:
+                continue
+
+            try:
+                samples = prepare_samples(wav, self._input_sample_rate, self._output_sample_rate, downmix=self._channels == 1)
+
+                if get_channel_count(samples) != self._channels:
+                    raise ValueError(f"Audio has {get_channel_count(samples)} channels, but {self._output_path} has {self._channels}")
+
+                self._file.write(samples)
+                self._frames_written += len(samples)
+            except Exception as e:
+                self._error = e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Write samples to an audio file in the format of its extension, downmixed to mono unless downmix is False
+def write_audio_file(output_path, wav, input_sample_rate, output_sample_rate=None, downmix=True):
+    output_path = str(output_path)
+    file_extension = output_path[output_path.rfind("."):]
+    audio_format, subtype = get_audio_format(file_extension)
+    sample_rate = get_output_sample_rate_for_format(file_extension, input_sample_rate, output_sample_rate)
+
+    samples = prepare_samples(wav, input_sample_rate, sample_rate, downmix)
+    sf.write(output_path, samples, sample_rate, format=audio_format, subtype=subtype)
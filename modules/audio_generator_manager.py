@@ -1,39 +1,75 @@
 import os
 import json
-import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from file_reader import read_file
-from tts_model_loader import load_tts_model
-from tts_audio_generator import generate_audio
+from tts_model_registry import TtsModelRegistry
+from tts_model_loader import set_torch_threads
+from tts_audio_generator import get_segment_plan, synthesize_segment_plan, get_output_sample_rate, get_synthesis_cache_stats, print_segment_plan_stats
+from audio_stream_writer import ChapterAudioWriter
+from audio_encoder import get_audio_format, write_audio_file
+from synthesis_pipeline import SynthesisPipeline
+from progress_manifest import ProgressManifest, get_lines_hash
+from job_scheduler import JobCancelled
 from utils import count_files_in_directory
 from pathlib import Path
-from pydub import AudioSegment
 
 # Define the directory where output audio files will be stored
 script_dir = Path(__file__).resolve().parent
 DEFAULT_OUTPUT_FILE_FOLDER = (script_dir / ".." / "single_speaker_outputs").resolve()
 DEFAULT_AUDIO_FILE_EXTENSION = ".wav"
 
+# Seconds between checks for a cancelled job while chapters are generated by worker processes
+JOB_CHECK_INTERVAL = 1.0
 
-# Generate audio using a TTS model for either a single block of text or multiple sections/chapters
-def tts_generate_audio(user_input, voice, is_file, output_folder, is_multi_speaker, output_file_type=DEFAULT_AUDIO_FILE_EXTENSION, tts_model_type="coqui"):
+# Consecutive lines of a chapter synthesized together. Their segments are batched by voice, so more lines give fuller
+# batches, while the lines of one item are only written once all of them are synthesized
+CHAPTER_LINES_PER_ITEM = 16
+
+
+# Generate audio using a TTS model for either a single block of text or multiple sections/chapters.
+# output_file_type selects the format (.wav, .flac, .opus or .mp3), and output_sample_rate resamples the audio if set.
+# If run as a job, progress is reported to it after each section is written, which is also where a cancelled job stops
+def tts_generate_audio(user_input, voice, is_file, output_folder, output_file_type=DEFAULT_AUDIO_FILE_EXTENSION, tts_model_type="coqui", tts_model_registry=None, output_sample_rate=None, job=None):
+    
+    # Fail on an unsupported format before spending any time on synthesis
+    get_audio_format(output_file_type)
     
     # If a file path is passed, read the file content
-    if is_file and not is_multi_speaker:
+    if is_file:
         text = read_file(user_input)
     else:
         text = user_input
     
-    # Load the specified TTS model
-    tts = load_tts_model(tts_model_type)
+    # Get the specified TTS model, only loading it if it is not already loaded
+    if tts_model_registry is None:
+        tts_model_registry = TtsModelRegistry()
+    tts = tts_model_registry.get_model(tts_model_type)
+    input_sample_rate = get_output_sample_rate(tts, tts_model_type)
+    
+    sections_written = 0
+    
+    # Write each section's audio to its own file. Nothing is written if a section has no audio
+    def write_section_audio(output_file_path, wav):
+        nonlocal sections_written
+        
+        if len(wav) > 0:
+            write_audio_file(output_file_path, wav, input_sample_rate, output_sample_rate)
+        
+        sections_written += 1
+        
+        if job is not None:
+            job.report_progress(sections_written, section_count, f"Section {sections_written} of {section_count}")
     
     # If the input is not a file, use the current timestamp as a name
     if is_file == False:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
         output_file_path = DEFAULT_OUTPUT_FILE_FOLDER / f"{timestamp}{output_file_type}"
-        return generate_audio(text, voice, tts, output_file_path, tts_model_type)
+        section_count = 1
+        run_synthesis_pipeline([([output_file_path], [voice], [text])], tts, tts_model_type, write_section_audio, "Single-speaker audio")
+        return output_file_path
     
-    chapter_paths = []  # Stores paths to generated chapter audio files
     using_existing_folder = False
 
     # Set the output folder path
@@ -61,51 +97,284 @@ def tts_generate_audio(user_input, voice, is_file, output_folder, is_multi_speak
     print("\n\n\nTYPE str:", isinstance(text, str))
         
         
-    if not is_multi_speaker:
-        if isinstance(text, str):
-            text = [text]
-            
-        for i in range(0, len(text)):
-            output_file_path = (Path(output_folder_path) / f"{i}{output_file_type}").resolve()
-            generate_audio(text[i], voice, tts, output_file_path, tts_model_type)
-            
-        return "Complete"
+    if isinstance(text, str):
+        text = [text]
         
-    start_index = 0
-    print("\n\n\nTYPE str:", isinstance(text, str))
+    # Each section is one work item, so the next section is prepared and the last one encoded while the model works
+    work_items = [([(Path(output_folder_path) / f"{i}{output_file_type}").resolve()], [voice], [text[i]]) for i in range(0, len(text))]
+    section_count = len(work_items)
+    run_synthesis_pipeline(work_items, tts, tts_model_type, write_section_audio, "Single-speaker audio")
+        
+    print_synthesis_cache_stats()
+        
+    return "Complete"
+
+
+# Split a chapter's lines from start_index onwards into work items of (line indices, voices, texts) for the synthesis pipeline.
+# Each item is a run of consecutive lines, so lines are still written in reading order
+def plan_chapter_work(lines, voices, start_index=0, lines_per_item=CHAPTER_LINES_PER_ITEM):
+    
+    # Clean non-ASCII characters before generating audio
+    lines = [line.encode('ascii', 'ignore').decode() for line in lines]
+    
+    return [
+        (list(range(i, min(i + lines_per_item, len(lines)))), voices[i:i + lines_per_item], lines[i:i + lines_per_item])
+        for i in range(start_index, len(lines), lines_per_item)
+    ]
+
+
+# Run work items of (keys, voices, texts), with a voice for each text, through the synthesis pipeline. Text preparation, synthesis and writing
+# each run on their own thread, so the next item is being prepared and the last one written while the model works.
+# write_audio(key, samples) is called for every text, in the order of the work items, as every stage has a single worker
+def run_synthesis_pipeline(work_items, tts, tts_model_type, write_audio, description):
+    
+    # Segments of every text, so the plan of the whole run is reported once it finishes
+    planned_segments = []
+    
+    def prepare_item(item):
+        keys, voices, texts = item
+        segment_plan = get_segment_plan(texts, tts, tts_model_type)
+        planned_segments.extend(segment_plan)
+        return keys, voices, segment_plan
+    
+    def synthesize_item(item):
+        keys, voices, segment_plan = item
+        return keys, synthesize_segment_plan(segment_plan, voices, tts, tts_model_type)
+    
+    def write_item(item):
+        for key, wav in zip(*item):
+            write_audio(key, wav)
     
-    # Generate audio for each section of text
-    for i in range(start_index, len(text)):
-        output_file_path = (Path(output_folder_path) / f"{i}{output_file_type}").resolve()
-        # Clean non-ASCII characters before generating audio
-        cleaned_text = text[i].encode('ascii', 'ignore').decode()
-        chapter_paths.append(generate_audio(cleaned_text, voice[i], tts, output_file_path, tts_model_type))
+    # The model can't run two syntheses at once, so synthesis has a single worker. Use more TTS workers to synthesize in parallel
+    pipeline = SynthesisPipeline()
+    pipeline.add_stage("text preparation", prepare_item)
+    pipeline.add_stage("synthesis", synthesize_item)
+    pipeline.add_stage("writing", write_item)
     
-    return chapter_paths  # Return paths of all generated audio chapters
+    pipeline.run(work_items)
+    
+    print_segment_plan_stats(planned_segments, tts, tts_model_type, f"{description} segment plan")
+    print(f"{description} pipeline stages:\n{pipeline.format_stats()}")
 
 
-# Generate audio for a multi-speaker audiobook using character voice and line data
-def tts_generate_multi_speaker_audio(folder_path):
+# Generate audio for a multi-speaker audiobook using character voice and line data.
+# With resume, chapters and lines recorded as finished by a previous run are skipped.
+# If run as a job, progress is reported to it as lines are written, which is also where a cancelled job stops
+def tts_generate_multi_speaker_audio(folder_path, tts_model_registry=None, workers=1, threads_per_worker=None, resume=False, output_file_type=DEFAULT_AUDIO_FILE_EXTENSION, output_sample_rate=None, job=None):
+    get_audio_format(output_file_type)
+    
     folder_path = folder_path.replace("\\", "/")
     number_of_chapters = count_files_in_directory(folder_path + "/chapter_lines")
+    progress_manifest = ProgressManifest(folder_path)
+    
+    # Work out which chapters still need to be generated
+    chapters_to_generate = []
     
-    # Iterate through each chapter and generate audio
     for i in range(0, number_of_chapters):
-        lines, voices = extract_lines_and_voices(
-            folder_path + "/chapter_lines/chapter_" + str(i) + "_lines.json",
-            folder_path + "/merged_book_characters.json"
+        if resume and is_multi_speaker_chapter_complete(folder_path, i, progress_manifest, output_file_type):
+            continue
+        
+        # Starting from scratch, so forget any progress from previous runs
+        if not resume:
+            progress_manifest.reset_chapter(i)
+            
+        chapters_to_generate.append(i)
+    
+    chapters_skipped = number_of_chapters - len(chapters_to_generate)
+    
+    # Spread the chapters across several processes, each with its own copy of the model
+    if workers > 1:
+        performance_profile = tts_model_registry.performance_profile if tts_model_registry is not None else None
+        lines_skipped = tts_generate_multi_speaker_audio_parallel(
+            folder_path, chapters_to_generate, workers, threads_per_worker, performance_profile, output_file_type, output_sample_rate, job
         )
+    else:
+        # Share one registry across all chapters so the TTS model is only loaded once per book
+        if tts_model_registry is None:
+            tts_model_registry = TtsModelRegistry()
+        
+        lines_skipped = 0
         
-        temp_files_path = folder_path + "/temp_audio_" + str(i)
-        os.makedirs(temp_files_path, exist_ok=True)
+        # Iterate through each chapter and generate audio
+        for chapters_completed, i in enumerate(chapters_to_generate):
+            lines_skipped += generate_multi_speaker_chapter(
+                folder_path, i, tts_model_registry, output_file_type=output_file_type, output_sample_rate=output_sample_rate,
+                line_progress_callback=get_chapter_progress_callback(job, chapters_completed, len(chapters_to_generate), i)
+            )
+    
+    if resume:
+        print(f"Resumed audio generation: skipped {chapters_skipped} of {number_of_chapters} completed chapters and {lines_skipped} completed lines in partly generated chapters")
         
-        # Generate audio for each chapter and then stitch the files together
-        tts_generate_audio(lines, voices, True, temp_files_path + "/", True)
-        stitch_wav_files(folder_path + "/temp_audio_" + str(i), i)
+    open_final_outputs_folder(folder_path)
         
     return "Audio generation complete"
 
 
+# Report a chapter's written lines to the job as a fraction of a chapter, so progress and ETA move while a chapter is generated
+def get_chapter_progress_callback(job, chapters_completed, chapter_count, chapter_index):
+    if job is None:
+        return None
+    
+    def report_line_progress(lines_written, line_count):
+        job.report_progress(
+            chapters_completed + lines_written / max(1, line_count),
+            chapter_count,
+            f"Chapter {chapter_index}: line {lines_written} of {line_count}"
+        )
+    
+    return report_line_progress
+
+
+# Check whether a chapter's audio has already been fully generated
+def is_multi_speaker_chapter_complete(folder_path, chapter_index, progress_manifest, output_file_type=DEFAULT_AUDIO_FILE_EXTENSION):
+    output_path = os.path.join(folder_path, "final_outputs", f"{chapter_index}{output_file_type}")
+    
+    if not os.path.exists(output_path):
+        return False
+    
+    # Chapters generated before progress was recorded only have their final file to go on
+    if progress_manifest.get_chapter_progress(chapter_index) is None:
+        return True
+    
+    lines, voices = extract_lines_and_voices(
+        folder_path + "/chapter_lines/chapter_" + str(chapter_index) + "_lines.json",
+        folder_path + "/merged_book_characters.json"
+    )
+    
+    return progress_manifest.is_chapter_complete(chapter_index, get_lines_hash(lines, voices))
+
+
+# Generate the audio for a single chapter, streaming each line straight into final_outputs/{chapter_index}{output_file_type}.
+# Continues from the last recorded line if the chapter was partly generated as a WAV. Returns the number of lines skipped.
+# line_progress_callback(lines_written, line_count) is called whenever lines are added to the chapter file
+def generate_multi_speaker_chapter(folder_path, chapter_index, tts_model_registry, tts_model_type="coqui", output_file_type=DEFAULT_AUDIO_FILE_EXTENSION, output_sample_rate=None, line_progress_callback=None):
+    lines, voices = extract_lines_and_voices(
+        folder_path + "/chapter_lines/chapter_" + str(chapter_index) + "_lines.json",
+        folder_path + "/merged_book_characters.json"
+    )
+    
+    tts = tts_model_registry.get_model(tts_model_type)
+    
+    # Create output folder if not already present
+    output_dir = os.path.join(folder_path, "final_outputs")
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{chapter_index}{output_file_type}")
+    
+    # Find where a previous run of this chapter got to
+    progress_manifest = ProgressManifest(folder_path)
+    lines_hash = get_lines_hash(lines, voices)
+    lines_completed, data_size = progress_manifest.get_lines_completed(chapter_index, lines_hash)
+    
+    # Record each line as soon as it is safely written
+    def record_progress(lines_written, written_data_size):
+        progress_manifest.mark_lines_completed(chapter_index, lines_hash, lines_written, len(lines), written_data_size)
+    
+    # Each line is appended to the chapter file as soon as it is synthesized, so no temp files are needed
+    with ChapterAudioWriter(
+        output_path,
+        get_output_sample_rate(tts, tts_model_type),
+        first_index=lines_completed,
+        resume_data_size=data_size,
+        progress_callback=record_progress,
+        output_sample_rate=output_sample_rate
+    ) as chapter_writer:
+        start_index = chapter_writer.lines_written
+        
+        if start_index > 0:
+            print(f"Chapter {chapter_index}: continuing from line {start_index} of {len(lines)}")
+            
+        def write_line(index, wav):
+            chapter_writer.add_line(index, wav)
+            
+            if line_progress_callback is not None:
+                line_progress_callback(chapter_writer.lines_written, len(lines))
+            
+        if line_progress_callback is not None:
+            line_progress_callback(start_index, len(lines))
+            
+        work_items = plan_chapter_work(lines, voices, start_index)
+        run_synthesis_pipeline(work_items, tts, tts_model_type, write_line, f"Chapter {chapter_index}")
+    
+    progress_manifest.mark_chapter_complete(chapter_index, lines_hash, len(lines))
+            
+    print(f"Chapter {chapter_index} audio saved as: {output_path}")
+    print_synthesis_cache_stats()
+    
+    return start_index
+
+
+# Generate the given chapters of a multi-speaker audiobook in a pool of worker processes. Returns the number of lines skipped.
+# Progress is reported to the job as each chapter finishes. If the job is cancelled, chapters already running are finished and the rest dropped
+def tts_generate_multi_speaker_audio_parallel(folder_path, chapters_to_generate, workers, threads_per_worker=None, performance_profile=None, output_file_type=DEFAULT_AUDIO_FILE_EXTENSION, output_sample_rate=None, job=None):
+    
+    # Split the CPU cores between the workers by default so they do not compete for the same cores
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    
+    print(f"Generating {len(chapters_to_generate)} chapters with {workers} workers and {threads_per_worker} threads per worker")
+    
+    lines_skipped = 0
+    
+    # Use spawn so each worker starts clean rather than inheriting the parent's torch and CUDA state
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_tts_worker,
+        initargs=(threads_per_worker, performance_profile)
+    ) as executor:
+        futures = {
+            executor.submit(generate_multi_speaker_chapter_in_worker, folder_path, i, output_file_type, output_sample_rate): i
+            for i in chapters_to_generate
+        }
+        
+        completed_chapters = 0
+        pending_futures = set(futures)
+        
+        try:
+            while pending_futures:
+                # Wake up regularly, even while every worker is busy, to notice a cancelled job
+                done_futures, pending_futures = wait(pending_futures, timeout=JOB_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+                
+                for future in done_futures:
+                    lines_skipped += future.result()  # Re-raises any error from the worker
+                    completed_chapters += 1
+                    print(f"Chapter {futures[future]} complete ({completed_chapters} of {len(chapters_to_generate)})")
+                
+                if job is not None:
+                    job.report_progress(completed_chapters, len(chapters_to_generate), f"{completed_chapters} of {len(chapters_to_generate)} chapters complete")
+                    
+        except JobCancelled:
+            # Drop the chapters no worker has started yet, rather than waiting for the whole book
+            executor.shutdown(cancel_futures=True)
+            raise
+        
+    return lines_skipped
+
+
+# TTS model registry of the current worker process
+worker_tts_model_registry = None
+
+
+# Runs once in each worker process before it takes any chapters
+def init_tts_worker(threads_per_worker, performance_profile=None):
+    global worker_tts_model_registry
+    
+    set_torch_threads(threads_per_worker)
+    
+    # Each worker gets its share of the cores, whatever thread count the profile was set up with
+    if performance_profile is not None:
+        performance_profile = dict(performance_profile, intra_op_threads=threads_per_worker)
+        
+    worker_tts_model_registry = TtsModelRegistry(performance_profile=performance_profile)
+
+
+# Runs in a worker process. The worker's model is loaded on its first chapter and reused for the rest
+def generate_multi_speaker_chapter_in_worker(folder_path, chapter_index, output_file_type=DEFAULT_AUDIO_FILE_EXTENSION, output_sample_rate=None):
+    return generate_multi_speaker_chapter(
+        folder_path, chapter_index, worker_tts_model_registry, output_file_type=output_file_type, output_sample_rate=output_sample_rate
+    )
+
+
 # Extract dialogue lines and assign the appropriate voice for each speaker
 def extract_lines_and_voices(line_file, voice_file):
     with open(line_file, 'r') as f1, open(voice_file, 'r') as f2:
@@ -140,39 +409,16 @@ def extract_lines_and_voices(line_file, voice_file):
     return lines, voices
 
 
-# Combine multiple .wav files into one and optionally delete the original temp files
-def stitch_wav_files(folder_path, index, delete_originals=True):
-    # Get list of .wav files sorted by their numeric filename (0.wav, 1.wav, etc.)
-    audio_files = sorted(
-        [f for f in os.listdir(folder_path) if f.endswith('.wav')],
-        key=lambda x: int(os.path.splitext(x)[0])
+# Print how often synthesis was skipped because the audio was already cached
+def print_synthesis_cache_stats():
+    stats = get_synthesis_cache_stats()
+    print(
+        f"Synthesis cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+        f"{stats['entries']} segments, {stats['size_bytes'] / (1024 ** 2):.1f}MB on disk"
     )
 
-    combined_audio = AudioSegment.empty()
 
-    # Merge audio files in order
-    for file_name in audio_files:
-        file_path = os.path.join(folder_path, file_name)
-        audio = AudioSegment.from_wav(file_path)
-        combined_audio += audio
-
-    # Create output folder if not already present
-    output_dir = os.path.join(folder_path, "..", "final_outputs")
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Export the combined audio as a single .wav file
-    output_path = os.path.join(output_dir, f"{index}.wav")
-    combined_audio.export(output_path, format="wav")
-
-    print(f"Audio files stitched successfully! Saved as: {output_path}")
-    
-    output_dir = os.path.realpath(output_dir)
+# Open the folder holding the finished chapter audio files
+def open_final_outputs_folder(folder_path):
+    output_dir = os.path.realpath(os.path.join(folder_path, "final_outputs"))
     os.startfile(output_dir)
-
-    # Optionally remove temporary folder and files
-    if delete_originals:
-        try:
-            shutil.rmtree(folder_path)
-            print(f"Deleted temp folder and original audio files: {folder_path}")
-        except Exception as e:
-            print(f"Error deleting folder: {e}")
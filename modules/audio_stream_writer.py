@@ -0,0 +1,206 @@
+import os
+import struct
+from audio_encoder import AudioEncoder, float_to_pcm16, prepare_samples, get_channel_count
+
+# Size in bytes of a standard PCM WAV header
+WAV_HEADER_SIZE = 44
+
+# Bytes per sample of the 16-bit PCM audio that is written
+SAMPLE_WIDTH = 2
+
+# Extension added to a chapter file while it is still being written
+PARTIAL_FILE_EXTENSION = ".partial"
+
+
+class WavStreamWriter:
+    """
+    Writes a 16-bit PCM WAV file incrementally. Samples are appended as they arrive and
+    the header sizes are filled in when the file is closed, so nothing is held in memory.
+    If resume_data_size is given, an existing file is reopened and cut back to that many bytes of audio before appending.
+    """
+
+    def __init__(self, output_path, sample_rate, channels=1, resume_data_size=None):
+        self._output_path = output_path
+        self._sample_rate = sample_rate
+        self._channels = channels
+        self._data_size = 0
+
+        if resume_data_size is not None:
+            # Drop anything written after the last recorded point, then continue from the end
+            self._file = open(output_path, "r+b")
+            self._file.truncate(WAV_HEADER_SIZE + resume_data_size)
+            self._data_size = resume_data_size
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(output_path, "wb")
+            self._write_header()
+
+    def write(self, wav):
+        """
+        Append float samples to the file.
+        """
+        self.write_pcm(float_to_pcm16(wav))
+
+    def write_pcm(self, pcm_bytes):
+        """
+        Append raw 16-bit PCM bytes to the file.
+        """
+        self._file.write(pcm_bytes)
+        self._data_size += len(pcm_bytes)
+
+    def flush(self):
+        """
+        Make sure everything written so far is on disk.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        # Fill in the final sizes now that all the audio has been written
+        self._write_header()
+        self._file.close()
+
+    @property
+    def data_size(self):
+        return self._data_size
+
+    @property
+    def frames_written(self):
+        return self._data_size // (SAMPLE_WIDTH * self._channels)
+
+    @property
+    def output_path(self):
+        return self._output_path
+
+    def _write_header(self):
+        byte_rate = self._sample_rate * self._channels * SAMPLE_WIDTH
+        block_align = self._channels * SAMPLE_WIDTH
+
+        header = struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + self._data_size, b"WAVE",
+            b"fmt ", 16, 1, self._channels, self._sample_rate, byte_rate, block_align, SAMPLE_WIDTH * 8,
+            b"data", self._data_size
+        )
+
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(header)
+
+        if position > WAV_HEADER_SIZE:
+            self._file.seek(position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ChapterAudioWriter:
+    """
+    Streams the audio of a chapter's lines into a single audio file in line order, in the format of output_path's extension.
+    Lines must be added in order, and each is written as soon as it is added, so no line is kept in memory.
+    The file is written under a temporary name and only moved to output_path once the chapter is complete.
+    To resume a partly written chapter, pass the index of the first line still to be written and the audio bytes already written.
+    progress_callback(lines_written, data_size) is called once the written lines are safely on disk.
+    WAV files are written directly. Other formats are encoded on a background thread, and can't be resumed.
+    With the default of one channel, lines with more channels are downmixed to mono. With more, lines must have that many.
+    """
+
+    def __init__(self, output_path, sample_rate, first_index=0, resume_data_size=None, progress_callback=None, output_sample_rate=None, channels=1):
+        self._output_path = str(output_path)
+        self._partial_path = self._output_path + PARTIAL_FILE_EXTENSION
+        self._next_index = first_index
+        self._progress_callback = progress_callback
+        self._sample_rate = sample_rate
+        self._output_sample_rate = output_sample_rate or sample_rate
+        self._channels = channels
+        self._writer = None
+        self._encoder = None
+
+        file_extension = os.path.splitext(self._output_path)[1].lower()
+
+        if file_extension == ".wav":
+            # Only resume if the partial file still holds at least the recorded amount of audio
+            if not can_resume_partial_file(self._partial_path, resume_data_size):
+                resume_data_size = None
+                self._next_index = 0
+
+            self._writer = WavStreamWriter(self._partial_path, self._output_sample_rate, channels=channels, resume_data_size=resume_data_size)
+        else:
+            # A compressed file can't be cut back to a line and continued, so the chapter is encoded from the start.
+            # The lines already synthesized are read back from the synthesis cache, so little work is repeated
+            self._next_index = 0
+            self._progress_callback = None
+            self._encoder = AudioEncoder(self._partial_path, sample_rate, output_sample_rate, file_extension=file_extension, channels=channels)
+
+    def add_line(self, index, wav):
+        """
+        Write the audio for a line. index must be the next line of the chapter.
+        """
+        if index != self._next_index:
+            raise ValueError(f"Expected audio for line {self._next_index} of {self._output_path}, got line {index}")
+
+        if self._encoder is not None:
+            self._encoder.write(wav)
+        else:
+            self._writer.write_pcm(self._prepare_wav_samples(wav).tobytes())
+
+        self._next_index += 1
+
+        # Report progress only after the audio has been flushed, so recorded progress never runs ahead of the file
+        if self._progress_callback is not None:
+            self._writer.flush()
+            self._progress_callback(self._next_index, self._writer.data_size)
+
+    def close(self, complete=True):
+        """
+        Finish the file. If complete, the temporary file is moved to the output path.
+        """
+        if self._encoder is not None:
+            self._encoder.close()
+        else:
+            self._writer.close()
+
+        if complete:
+            os.replace(self._partial_path, self._output_path)
+
+    def _prepare_wav_samples(self, wav):
+        samples = prepare_samples(wav, self._sample_rate, self._output_sample_rate, downmix=self._channels == 1)
+
+        if get_channel_count(samples) != self._channels:
+            raise ValueError(f"Line has {get_channel_count(samples)} channels, but {self._output_path} has {self._channels}")
+
+        return samples
+
+    @property
+    def lines_written(self):
+        return self._next_index
+
+    @property
+    def data_size(self):
+        # Bytes of audio written to a WAV file. Not known for encoded formats until the file is finished
+        return self._writer.data_size if self._writer is not None else None
+
+    @property
+    def output_path(self):
+        return self._output_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only publish the chapter if it finished without an error
+        self.close(complete=exc_type is None)
+
+
+# Check that a partial chapter file exists and holds at least resume_data_size bytes of audio
+def can_resume_partial_file(partial_path, resume_data_size):
+    if not resume_data_size:
+        return False
+
+    return os.path.exists(partial_path) and os.path.getsize(partial_path) >= WAV_HEADER_SIZE + resume_data_size
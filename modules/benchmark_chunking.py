@@ -0,0 +1,57 @@
+import time
+from llm import Llm
+from text_generator import Model_Type
+from file_reader import read_file
+from llm_line_identifier import split_text_into_chunks
+from line_output_format import USER_QUERY
+from llm_chunk_budget import ChunkTokenBudget, format_chunk_report
+
+
+# Load only the model's tokenizer, which takes a fraction of a second and almost no memory
+def load_tokenizer_llm(llm_model_path, context_length):
+    from llama_cpp import Llama
+
+    model_config = {'model_path': llm_model_path, 'context_length': context_length, 'model_type': Model_Type.LOCAL_FILE}
+    return Llm(model_config, model=Llama(model_path=llm_model_path, n_ctx=context_length, vocab_only=True, verbose=False))
+
+
+# Combine the reports of several sections into one
+def combine_chunk_reports(chunk_reports):
+    chunk_count = sum(chunk_report["chunks"] for chunk_report in chunk_reports)
+
+    return {
+        "chunks": chunk_count,
+        "mean_fill": sum(chunk_report["mean_fill"] * chunk_report["chunks"] for chunk_report in chunk_reports) / max(1, chunk_count),
+        "max_fill": max((chunk_report["max_fill"] for chunk_report in chunk_reports), default=0.0),
+        "expected_overflows": sum(chunk_report["expected_overflows"] for chunk_report in chunk_reports)
+    }
+
+
+def run_chunking_benchmark(input_file, llm_model_path, context_length=4096):
+    """
+    Compare the previous chunking, which used the context length as a character budget, with chunks sized in tokens.
+    Reports chunk count, how full each request's context is expected to be and how many chunks are expected to overflow it.
+    Tokens are counted with the model's tokenizer, which is all that is loaded.
+    Returns True unless the token chunks are expected to overflow.
+    """
+    llm = load_tokenizer_llm(llm_model_path, context_length)
+    text = read_file(input_file)
+    sections = [text] if isinstance(text, str) else text
+
+    chunk_budget = ChunkTokenBudget(llm, USER_QUERY)
+    print(f"Context {context_length} tokens, prompt {chunk_budget.prompt_tokens} tokens, chunks of up to {chunk_budget.chunk_tokens} tokens\n")
+
+    results = {}
+
+    for name, split_section in (
+        ("Characters (previous)", lambda section: split_text_into_chunks(section, context_length)),
+        ("Tokens", lambda section: chunk_budget.split(section, split_text_into_chunks))
+    ):
+        start_time = time.perf_counter()
+        chunk_reports = [chunk_budget.get_chunk_report(split_section(section)) for section in sections if section.strip()]
+        elapsed_time = time.perf_counter() - start_time
+
+        results[name] = combine_chunk_reports(chunk_reports)
+        print(f"{name}: {format_chunk_report(results[name])} ({elapsed_time:.2f}s to split)\n")
+
+    return results["Tokens"]["expected_overflows"] == 0
@@ -0,0 +1,70 @@
+import time
+from collections import Counter
+from llm import Llm
+from text_generator import Model_Type
+from file_reader import read_file
+from line_alignment import get_comparable_text
+from line_output_format import LINE_OUTPUT_FORMATS
+from llm_line_identifier import identify_lines_in_chapter
+
+
+# The speaker of every letter and digit of the identified text, so two outputs can be compared letter by letter
+def get_character_speakers(lines):
+    character_speakers = []
+
+    for line in lines:
+        comparable_line, _ = get_comparable_text(line["line"])
+        character_speakers += [line["speaker"].strip().lower()] * len(comparable_line)
+
+    return character_speakers
+
+
+def run_line_format_benchmark(input_file, llm_model_path, sections=1, context_length=4096, gpu_layers=0, seed=0):
+    """
+    Identify the lines of the first sections of a book with each LLM output format, with the response cache off,
+    and report the tokens generated per section, the time taken and how often each format needed repairs.
+    The speakers each format gives are compared letter by letter with the text format's.
+    """
+    llm = Llm({
+        'model_path': llm_model_path,
+        'context_length': context_length,
+        'gpu_layers': gpu_layers,
+        'temperature': 0.0,
+        'seed': seed,
+        'model_type': Model_Type.LOCAL_FILE,
+        'use_response_cache': False
+    })
+
+    text = read_file(input_file)
+    chapters = [text] if isinstance(text, str) else text
+    chapters = [chapter for chapter in chapters if chapter.strip()][:sections]
+
+    results = {}
+
+    for line_output_format in LINE_OUTPUT_FORMATS:
+        stats = Counter()
+        character_speakers = []
+
+        start_time = time.perf_counter()
+
+        for chapter in chapters:
+            lines = identify_lines_in_chapter(chapter, llm, 0, line_output_format=line_output_format, stats=stats)["lines"]
+            character_speakers += get_character_speakers(lines)
+
+        results[line_output_format] = (stats, time.perf_counter() - start_time, character_speakers)
+
+    print(f"\n{len(chapters)} sections of {input_file}:")
+    text_speakers = results["text"][2]
+
+    for line_output_format, (stats, elapsed_time, character_speakers) in results.items():
+        compared = min(len(text_speakers), len(character_speakers))
+        agreement = sum(1 for a, b in zip(text_speakers, character_speakers) if a == b) / max(1, compared)
+
+        print(
+            f"  {line_output_format}: {stats['completion_tokens'] / len(chapters):.0f} tokens generated per section, "
+            f"{stats['prompt_tokens'] / len(chapters):.0f} prompt tokens, {elapsed_time / len(chapters):.1f}s per section, "
+            f"{stats['repairs']} span repairs, {stats['invalid_lines']} invalid lines, {stats['narrator_fallbacks']} Narrator fallbacks, "
+            f"{agreement:.1%} of letters with the same speaker as the text format"
+        )
+
+    return {line_output_format: result[0]["completion_tokens"] for line_output_format, result in results.items()}
@@ -0,0 +1,108 @@
+import gc
+import time
+import numpy as np
+from llm import Llm
+from text_generator import Model_Type
+from llm_runtime_profile import get_runtime_profile, get_cpu_counts, save_runtime_profile, DEFAULT_RUNTIME_PROFILE_PATH
+
+# Text repeated to make the benchmark prompt, close to the books line identification reads
+PROMPT_PASSAGE = (
+    '"Are you coming?" asked Mary, pulling on her coat. Tom looked up from the fire and shook his head. '
+    '"Not tonight," he said. "The snow is too deep, and the road will be dark long before we reach the village." '
+    'She sighed and sat down beside him, and for a while neither of them spoke. '
+)
+
+
+# Time processing the prompt and generating tokens greedily after it, from an empty context
+def measure_speed(model, prompt_ids, generate_tokens):
+    model.reset()
+
+    start_time = time.perf_counter()
+    model.eval(prompt_ids)
+    prompt_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(generate_tokens):
+        model.eval([int(np.argmax(model.scores[model.n_tokens - 1]))])
+    generate_seconds = time.perf_counter() - start_time
+
+    return len(prompt_ids) / prompt_seconds, generate_tokens / generate_seconds
+
+
+# Load the model with the runtime profile and return its best prompt and generation tokens/second over the runs
+def benchmark_runtime_profile(llm_model_path, context_length, gpu_layers, profile, prompt_tokens, generate_tokens, runs):
+    llm = Llm({
+        'model_path': llm_model_path,
+        'context_length': context_length,
+        'gpu_layers': gpu_layers,
+        'temperature': 0.0,
+        'seed': 0,
+        'model_type': Model_Type.LOCAL_FILE,
+        **profile
+    })
+
+    passage_ids = llm.model.tokenize(PROMPT_PASSAGE.encode("utf-8"), add_bos=False)
+    prompt_ids = [llm.model.token_bos()] + (passage_ids * (prompt_tokens // len(passage_ids) + 1))[:prompt_tokens - 1]
+
+    # A short warm-up run, so the first timed run doesn't include reading the weights in
+    measure_speed(llm.model, prompt_ids[:32], 1)
+    speeds = [measure_speed(llm.model, prompt_ids, generate_tokens) for _ in range(runs)]
+
+    # Release the model before the next is loaded, so only one is in memory
+    del llm
+    gc.collect()
+
+    return max(speed[0] for speed in speeds), max(speed[1] for speed in speeds)
+
+
+def run_llm_autotune(llm_model_path, context_length=4096, gpu_layers=0, base_preset="default", thread_counts=None, batch_sizes=(256, 512, 1024),
+                     ubatch_sizes=(128, 256, 512), prompt_tokens=1024, generate_tokens=64, runs=2, output_path=DEFAULT_RUNTIME_PROFILE_PATH):
+    """
+    Find the fastest llama.cpp threads and batch sizes for the model on this machine, and save them as the autotuned runtime profile.
+    Generation and prompt processing use separate thread counts, so each thread count is measured once for both, and
+    the batch sizes are then measured with the best thread counts. The other settings are kept from the base preset.
+    Returns the saved profile.
+    """
+    logical_cpus, physical_cores = get_cpu_counts()
+
+    if thread_counts is None:
+        thread_counts = sorted({max(1, physical_cores // 2), physical_cores, logical_cpus})
+
+    if prompt_tokens + generate_tokens > context_length:
+        raise ValueError(f"The benchmark needs {prompt_tokens + generate_tokens} tokens of context, but the context length is {context_length}")
+
+    base_profile = get_runtime_profile(base_preset)
+    results = []
+
+    def benchmark(**settings):
+        profile = get_runtime_profile(base_preset, **settings)
+        prompt_speed, generate_speed = benchmark_runtime_profile(llm_model_path, context_length, gpu_layers, profile, prompt_tokens, generate_tokens, runs)
+
+        results.append(dict(settings, prompt_tokens_per_second=prompt_speed, generated_tokens_per_second=generate_speed))
+        print(", ".join(f"{key}={value}" for key, value in settings.items()) + f": prompt {prompt_speed:.1f} tokens/s, generation {generate_speed:.1f} tokens/s")
+
+        return prompt_speed, generate_speed
+
+    print(f"Threads ({logical_cpus} CPUs):")
+    thread_speeds = {threads: benchmark(n_threads=threads, n_threads_batch=threads) for threads in thread_counts}
+    n_threads = max(thread_counts, key=lambda threads: thread_speeds[threads][1])
+    n_threads_batch = max(thread_counts, key=lambda threads: thread_speeds[threads][0])
+
+    # Batch sizes only change prompt processing
+    print(f"\nBatch sizes (generation threads {n_threads}, prompt processing threads {n_threads_batch}):")
+    batch_speeds = {}
+
+    for n_batch in batch_sizes:
+        for n_ubatch in ubatch_sizes:
+            if n_ubatch <= n_batch:
+                batch_speeds[(n_batch, n_ubatch)] = benchmark(n_threads=n_threads, n_threads_batch=n_threads_batch, n_batch=n_batch, n_ubatch=n_ubatch)[0]
+
+    n_batch, n_ubatch = max(batch_speeds, key=batch_speeds.get) if batch_speeds else (base_profile['n_batch'], base_profile['n_ubatch'])
+
+    profile = get_runtime_profile(base_preset, n_threads=n_threads, n_threads_batch=n_threads_batch, n_batch=n_batch, n_ubatch=n_ubatch)
+    save_runtime_profile(profile, output_path, results)
+
+    print(f"\nBest profile: {profile}")
+    print(f"Saved to {output_path}. Use it with --llm_runtime_preset autotuned, or the autotuned preset on the model page.")
+
+    return profile
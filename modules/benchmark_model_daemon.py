@@ -0,0 +1,103 @@
+import sys
+import time
+import statistics
+import subprocess
+from pathlib import Path
+from model_daemon import DaemonClient
+
+script_dir = Path(__file__).resolve().parent
+cli_path = script_dir / "run_cli.py"
+
+# Fixed text synthesized by each benchmark job, short enough that startup dominates a cold run
+BENCHMARK_TEXT = "The lighthouse keeper climbed the stairs one last time."
+
+# Seconds to wait for the daemon to load its models before giving up
+DAEMON_START_TIMEOUT = 900
+
+
+# Run the CLI with the given arguments, returning the seconds it took
+def time_cli_run(cli_args):
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, str(cli_path), *cli_args], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+
+# Wait until the daemon answers, returning False if its process exits first or it doesn't answer in time
+def wait_for_daemon(daemon_process, port):
+    client = DaemonClient(port)
+    start_time = time.perf_counter()
+
+    while time.perf_counter() - start_time < DAEMON_START_TIMEOUT:
+        if daemon_process.poll() is not None:
+            return False
+
+        try:
+            client.ping()
+            return True
+        except Exception:
+            time.sleep(0.5)
+
+    return False
+
+
+def run_model_daemon_benchmark(voice, text=BENCHMARK_TEXT, jobs=5, port=7862, llm_model_path=None):
+    """
+    Compare the latency of CLI jobs run cold, where each run loads the models, with the same jobs sent to a model daemon.
+    Each job synthesizes the text, and also identifies its lines if an LLM is given. Returns the median seconds per job of each.
+    """
+    job_args = ["--generate_audio_input_text", text, "--generate_audio_voice", voice]
+
+    if llm_model_path is not None:
+        job_args += ["--llm_model_path", llm_model_path, "--identify_lines_input_text", text]
+
+    print(f"Running {jobs} cold CLI jobs")
+    cold_times = []
+
+    for i in range(jobs):
+        cold_times.append(time_cli_run(job_args))
+        print(f"  Cold job {i + 1}: {cold_times[-1]:.2f}s")
+
+    # The daemon loads the models once, then every job is a client run
+    print("Starting the model daemon")
+    daemon_args = ["--daemon", "--daemon_port", str(port)]
+
+    if llm_model_path is not None:
+        daemon_args += ["--llm_model_path", llm_model_path]
+
+    start_time = time.perf_counter()
+    daemon_process = subprocess.Popen([sys.executable, str(cli_path), *daemon_args], stdout=subprocess.DEVNULL)
+
+    try:
+        if not wait_for_daemon(daemon_process, port):
+            raise Exception("The model daemon did not start")
+
+        daemon_start_time = time.perf_counter() - start_time
+        print(f"  Daemon ready in {daemon_start_time:.2f}s")
+
+        print(f"Running {jobs} jobs through the daemon")
+        daemon_times = []
+
+        for i in range(jobs):
+            daemon_times.append(time_cli_run(["--use_daemon", "--daemon_port", str(port), *job_args]))
+            print(f"  Daemon job {i + 1}: {daemon_times[-1]:.2f}s")
+
+    finally:
+        try:
+            DaemonClient(port).shutdown()
+        except Exception:
+            daemon_process.terminate()
+
+        daemon_process.wait()
+
+    cold_median = statistics.median(cold_times)
+    daemon_median = statistics.median(daemon_times)
+
+    print(f"\nSeconds per job, median of {jobs}:")
+    print(f"  Cold CLI: {cold_median:.2f}  (mean {statistics.mean(cold_times):.2f})")
+    print(f"  Daemon:   {daemon_median:.2f}  (mean {statistics.mean(daemon_times):.2f}, {cold_median / daemon_median:.1f}x faster)")
+
+    # How many jobs it takes for starting the daemon to pay for itself
+    if cold_median > daemon_median:
+        print(f"  Daemon startup of {daemon_start_time:.2f}s is paid back after {daemon_start_time / (cold_median - daemon_median):.1f} jobs")
+
+    return {"cold": cold_median, "daemon": daemon_median, "daemon_start": daemon_start_time}
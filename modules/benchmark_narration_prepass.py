@@ -0,0 +1,50 @@
+import time
+from file_reader import read_file
+from line_alignment import get_comparable_text
+from narration_prepass import split_into_paragraphs, split_narration_and_dialogue
+
+
+def run_narration_prepass_benchmark(input_file):
+    """
+    Run the narration pre-pass on every section of a book as the file reader returns it, and report how many paragraphs
+    each section is split into and how much of its text is labelled Narrator without the LLM.
+    Fails if a section of several lines is read as a single paragraph, which would send all of it to the LLM,
+    or if the segments leave out or change any of the section's text.
+    """
+    text = read_file(input_file)
+    sections = [text] if isinstance(text, str) else text
+    sections = [section for section in sections if section.strip()]
+
+    passed = True
+    total_characters = 0
+    narration_characters = 0
+    start_time = time.perf_counter()
+
+    for i, section in enumerate(sections):
+        paragraphs, separator = split_into_paragraphs(section)
+        segments = split_narration_and_dialogue(section)
+
+        section_narration_characters = sum(len(segment_text) for needs_llm, segment_text in segments if not needs_llm)
+        total_characters += len(section)
+        narration_characters += section_narration_characters
+
+        problems = []
+
+        if len(paragraphs) == 1 and len(section.strip().splitlines()) > 1:
+            problems.append("read as one paragraph")
+
+        if get_comparable_text(" ".join(segment_text for _, segment_text in segments))[0] != get_comparable_text(section)[0]:
+            problems.append("segments don't match the text")
+
+        passed = passed and not problems
+        print(
+            f"Section {i + 1}: {len(paragraphs)} paragraphs ({'blank line' if separator == chr(10) * 2 else 'line'} separated), "
+            f"{section_narration_characters / max(1, len(section)):.1%} labelled Narrator without the LLM"
+            + (f", FAILED: {', '.join(problems)}" if problems else "")
+        )
+
+    elapsed_time = time.perf_counter() - start_time
+    print(f"\n{len(sections)} sections in {elapsed_time * 1000:.1f}ms, {narration_characters / max(1, total_characters):.1%} of the text labelled Narrator without the LLM")
+    print(f"Narration pre-pass check {'passed' if passed else 'FAILED'}")
+
+    return passed
@@ -0,0 +1,75 @@
+import gc
+import time
+from collections import Counter
+from llm import Llm
+from text_generator import Model_Type
+from file_reader import read_file
+from llm_line_identifier import identify_lines_in_chapter
+
+
+def run_speculative_decoding_benchmark(input_file, llm_model_path, modes=("none", "prompt_lookup"), draft_model_path=None,
+                                       speculative_tokens=10, context_length=4096, gpu_layers=0, line_output_format="text"):
+    """
+    Identify the lines of the same section of a book with each speculative decoding mode, loading the model for each,
+    and report the tokens generated per second. Sampling is greedy and the response cache is off, so every mode generates
+    the same output from scratch and only the speed should differ. Also reports how many drafted tokens were accepted,
+    and fails if a mode drafted tokens but none were ever accepted, as its drafts then only slow generation down.
+    """
+    text = read_file(input_file)
+    chapters = [text] if isinstance(text, str) else text
+    chapter = next(chapter for chapter in chapters if chapter.strip())
+
+    results = {}
+    outputs = {}
+    acceptance = {}
+
+    for speculative_mode in modes:
+        llm = Llm({
+            'model_path': llm_model_path,
+            'context_length': context_length,
+            'gpu_layers': gpu_layers,
+            'temperature': 0.0,
+            'seed': 0,
+            'model_type': Model_Type.LOCAL_FILE,
+            'use_response_cache': False,
+            'speculative_mode': speculative_mode,
+            'draft_model_path': draft_model_path,
+            'speculative_tokens': speculative_tokens
+        })
+
+        stats = Counter()
+        start_time = time.perf_counter()
+        outputs[speculative_mode] = identify_lines_in_chapter(chapter, llm, 0, line_output_format=line_output_format, stats=stats)
+        elapsed_time = time.perf_counter() - start_time
+
+        results[speculative_mode] = stats["completion_tokens"] / elapsed_time
+        print(f"{speculative_mode}: {stats['completion_tokens']} tokens generated in {elapsed_time:.1f}s, {results[speculative_mode]:.1f} tokens/s")
+
+        draft_model = getattr(llm.model, "draft_model", None)
+        if draft_model is not None:
+            acceptance[speculative_mode] = draft_model
+            print(f"{speculative_mode}: {draft_model.accepted_tokens} of {draft_model.drafted_tokens} drafted tokens accepted ({draft_model.acceptance_rate:.1%})")
+
+        # Release the model before loading the next, so only one is in memory
+        del llm
+        gc.collect()
+
+    print(f"\nTokens generated per second on the same section ({line_output_format} format):")
+    passed = True
+
+    for speculative_mode, tokens_per_second in results.items():
+        same_output = outputs[speculative_mode] == outputs[modes[0]]
+        draft_model = acceptance.get(speculative_mode)
+        never_accepted = draft_model is not None and draft_model.drafted_tokens > 0 and draft_model.accepted_tokens == 0
+        passed = passed and not never_accepted
+
+        print(
+            f"  {speculative_mode}: {tokens_per_second:.1f} tokens/s, {tokens_per_second / results[modes[0]]:.2f}x {modes[0]}"
+            + (f", {draft_model.acceptance_rate:.1%} of drafted tokens accepted" if draft_model is not None else "")
+            + ("" if same_output else ", output differs")
+            + (", FAILED: no drafted token was ever accepted" if never_accepted else "")
+        )
+
+    print(f"Speculative decoding check {'passed' if passed else 'FAILED'}")
+
+    return passed
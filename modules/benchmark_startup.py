@@ -0,0 +1,140 @@
+import re
+import sys
+import subprocess
+from pathlib import Path
+
+script_dir = Path(__file__).resolve().parent
+
+# Heavy libraries each entry point must not import when it starts. They should only be loaded by the stage that uses them
+LLM_MODULES = ["llama_cpp", "openai"]
+TTS_MODULES = ["torch", "TTS", "scipy", "soundfile", "diskcache"]
+EPUB_MODULES = ["ebooklib", "bs4"]
+UI_MODULES = ["gradio"]
+
+# Entry points measured: (arguments to python, modules that must not be imported, import time budget in milliseconds).
+# Times are above a bare interpreter. A budget of None only reports the time, for entry points dominated by a library they need
+STARTUP_TARGETS = {
+    "cli_help": (
+        ["run_cli.py", "--help"],
+        LLM_MODULES + TTS_MODULES + EPUB_MODULES + UI_MODULES + ["numpy"],
+        100
+    ),
+    "benchmarks_help": (
+        ["run_benchmarks.py", "--help"],
+        LLM_MODULES + TTS_MODULES + EPUB_MODULES + UI_MODULES + ["numpy"],
+        100
+    ),
+    # What an identify-only CLI run imports before loading its model
+    "identify_lines": (
+        ["-c", "import run_cli, session, text_generator, llm_chapter_manager"],
+        LLM_MODULES + TTS_MODULES + EPUB_MODULES + UI_MODULES + ["numpy"],
+        150
+    ),
+    # What an audio generation job imports when it starts
+    "generate_audio": (
+        ["-c", "import audio_generator_manager"],
+        LLM_MODULES + EPUB_MODULES + UI_MODULES,
+        None
+    ),
+    "ui": (
+        ["-c", "import ui, session"],
+        LLM_MODULES + ["torch", "TTS", "scipy"] + EPUB_MODULES,
+        None
+    )
+}
+
+# One line of python -X importtime output: self and cumulative microseconds, then the module name indented by its depth
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)')
+
+
+# Run python -X importtime with the given arguments, returning {module: cumulative microseconds} of the top level imports
+# and the set of every module imported. Raises if the command fails
+def measure_imports(python_args):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *python_args],
+        cwd=script_dir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+
+    top_level_times = {}
+    modules = set()
+    errors = []
+
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+
+        if match is None:
+            if not line.startswith("import time:"):
+                errors.append(line)
+            continue
+
+        cumulative, indent, module = int(match.group(2)), match.group(3), match.group(4)
+        modules.add(module)
+
+        # The top level imports' cumulative times add up to the total, the nested ones are already counted in them
+        if len(indent) <= 1:
+            top_level_times[module] = top_level_times.get(module, 0) + cumulative
+
+    if result.returncode != 0:
+        raise Exception("\n".join(errors[-5:]) or f"Exited with code {result.returncode}")
+
+    return top_level_times, modules
+
+
+# Best import time in milliseconds over several runs, with the modules imported
+def measure_best_import_time(python_args, repeats):
+    best_time = None
+
+    for _ in range(repeats):
+        top_level_times, modules = measure_imports(python_args)
+        total_time = sum(top_level_times.values()) / 1000
+        best_time = total_time if best_time is None else min(best_time, total_time)
+
+    return best_time, modules, top_level_times
+
+
+def run_startup_benchmark(targets=None, repeats=5, threshold_scale=1.0, show_slowest=5):
+    """
+    Measure the import time of each entry point with python -X importtime, above a bare interpreter.
+    An entry point fails if it imports a library it shouldn't need yet, or takes longer than its budget times threshold_scale.
+    Returns True if every entry point passed.
+    """
+    baseline_time, baseline_modules, _ = measure_best_import_time(["-c", "pass"], repeats)
+    passed = True
+
+    print(f"Bare interpreter: {baseline_time:.1f}ms of imports, best of {repeats} runs\n")
+
+    for name in targets or STARTUP_TARGETS:
+        python_args, forbidden_modules, budget = STARTUP_TARGETS[name]
+
+        try:
+            total_time, modules, top_level_times = measure_best_import_time(python_args, repeats)
+        except Exception as e:
+            print(f"{name}: FAILED to run\n  {e}\n")
+            passed = False
+            continue
+
+        import_time = total_time - baseline_time
+        forbidden_imported = sorted(module for module in forbidden_modules if module in modules)
+        over_budget = budget is not None and import_time > budget * threshold_scale
+
+        budget_text = f"budget {budget * threshold_scale:.0f}ms" if budget is not None else "no budget"
+        print(f"{name}: {import_time:.1f}ms ({budget_text}), {len(modules - baseline_modules)} modules")
+
+        slowest = sorted(top_level_times.items(), key=lambda item: item[1], reverse=True)[:show_slowest]
+        print("  Slowest: " + ", ".join(f"{module} {time / 1000:.1f}ms" for module, time in slowest))
+
+        if forbidden_imported:
+            print(f"  FAILED: imports {', '.join(forbidden_imported)} on startup")
+            passed = False
+
+        if over_budget:
+            print("  FAILED: over its import time budget")
+            passed = False
+
+        print()
+
+    print("Startup check " + ("passed" if passed else "FAILED"))
+    return passed
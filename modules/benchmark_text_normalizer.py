@@ -0,0 +1,224 @@
+import os
+import re
+import io
+import time
+import random
+import contextlib
+from text_normalizer import clean_text, clean_texts, limit_sentence_length, split_line
+
+# Line length used by the TTS preprocessing
+MAX_LINE_LENGTH = 600
+
+# Hand-written lines covering every normalization rule and the cases where the rules interact
+EQUIVALENCE_CORPUS = [
+    "",
+    " ",
+    "\n",
+    "Hello there.",
+    "“Where are you going?” she asked.",
+    "He said, “I’m not sure...” and left.",
+    "Wait. . . what was that?",
+    "It was late—too late—for anyone to help.",
+    "Mr. and Mrs. Smith met Dr. Jones of Acme Co. yesterday.",
+    "Mr.s. Smith is an odd abbreviation.",
+    "Mrs.. Smith wrote two periods.",
+    "She shouted \"Stop!\". Then she ran.",
+    "Really?. Yes!. Fine'. Done\".",
+    "A line with a dangling period .",
+    "Two periods.. and an ellipsis... and four....",
+    "''Double quotes'' and \"\"doubled\"\" marks.",
+    "First line\nSecond line starts with a capital",
+    "Ends with comma,\nNext line",
+    "Ends with period.\nNext line",
+    "lowercase\ncontinuation",
+    "Semicolon;\nColon:\nComma,\nPeriod.\nNone\nAgain",
+    "Tabs\tand\r\nwindows line endings\r\nHere",
+    "Symbols like * _ ~ ^ % $ # @ are removed, but ( ) [ ] : ; & - are kept.",
+    "Accents café naïve résumé and emoji 🙂 are removed.",
+    "Non-breaking space and zero​width characters.",
+    "Numbers 1, 2, 3.5 and 10,000 stay.",
+    "Supercalifragilisticexpialidocious is a very long word indeed.",
+    "Pneumonoultramicroscopicsilicovolcanoconiosis.Antidisestablishmentarianism",
+    "PLACE_HOLDER_STRING should not be confused with a placeholder.",
+    "\n\nLeading and trailing newlines\n\n",
+    "   Leading and trailing spaces   ",
+    "Multiple   spaces    between words.",
+    "A\nB\nC\nD",
+    "“Quoted.”\n“Another quote.”",
+    " . . . ",
+    "A null\x00character and a \x01 control character.",
+]
+
+# Characters and fragments random lines are built from, weighted towards the ones the rules react to
+FUZZ_FRAGMENTS = list("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") + list(
+    ".,;:!?'\"()[]&-*_#\n\t\r   ") + [
+    "”", "“", "’", "—", "é", "🙂", " ", ". . .", "..", "...", "Mr.", "Mrs.", "Dr.", "Co.", "Mr.s.",
+    "!.", "?.", "'.", "\".", " .", "''", '""', "\nA", ",\n", ".\n", "PLACE_HOLDER_STRING",
+    "Supercalifragilisticexpialidocious"
+]
+
+
+# The original clean_text from tts_audio_generator, kept as the reference the normalizer must match
+def legacy_clean_text(text):
+    text = text.replace("—", "-").replace(". . .", "...")
+    text = text.replace("”", '"').replace("“", '"').replace("’", "'").replace("''", "'").replace('""', '"')
+    text = text.replace("Mr.", "Mr").replace("Mrs.", "Mrs").replace("Dr.", "Dr").replace("Co.", "Co")
+    text = text.replace("!.", "!").replace("?.", "?").replace("'.", "'").replace("\".", "\"")
+    text = text.replace(" .", "")
+    text = re.sub(r'(?<!\.)\.\.(?!\.)', '', text)
+    text = re.sub(r'[^a-zA-Z0-9\s,.\'"!?()\[\]:;&\n-]', '', text)
+    place_holder = "PLACE_HOLDER_STRING"
+    text = re.sub(r'(?<![.,;:])\n(?=[A-Z])', place_holder, text)
+    text = re.sub(r'(?<!\.)\n', ' ', text)
+    text = re.sub(place_holder, '. ', text)
+    text = text.replace(".", "\n")
+    text = text.replace('"', "\n")
+    return text
+
+
+# The original limit_sentence_length from tts_audio_generator, including its per-line print
+def legacy_limit_sentence_length(text, max_line_length):
+    text = text.split("\n")
+
+    for i, line in enumerate(text):
+        print("\n\nLine:\n", line)
+        line = legacy_limit_word_size(line)
+
+        if len(line) > max_line_length:
+            line = split_line(line)
+            line = legacy_limit_sentence_length(line, max_line_length)
+
+        line = line + "\n"
+        line = os.linesep.join([s for s in line.splitlines() if s])
+        text[i] = line.replace("\n\n", "\n").lstrip(" ").rstrip(" ")
+
+    filtered_text = [line for line in text if line]
+    return '\n'.join(filtered_text) + '\n' if filtered_text else ''
+
+
+# The original limit_word_size from tts_audio_generator
+def legacy_limit_word_size(line):
+    result = []
+
+    for word in line.split():
+        if len(word) > 19:
+            result.append("\n".join(word[i:i + 19] for i in range(0, len(word), 19)))
+        else:
+            result.append(word)
+
+    return " ".join(result)
+
+
+# The original preprocessing of a line before synthesis
+def legacy_prepare_text(text):
+    return legacy_clean_text(legacy_limit_sentence_length(text, MAX_LINE_LENGTH))
+
+
+# The new preprocessing of a line before synthesis
+def prepare_text(text):
+    return clean_text(limit_sentence_length(text, MAX_LINE_LENGTH))
+
+
+# The new preprocessing of a batch of lines before synthesis
+def prepare_texts(texts):
+    return clean_texts([limit_sentence_length(text, MAX_LINE_LENGTH) for text in texts])
+
+
+# Build random lines that combine the fragments the rules react to
+def generate_fuzz_lines(count, seed):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FUZZ_FRAGMENTS) for _ in range(rng.randint(0, 80))) for _ in range(count)]
+
+
+# Build lines of long text for the equivalence check, so the splitting of long lines is covered too
+def generate_long_lines(count, seed):
+    rng = random.Random(seed)
+    words = [fragment for fragment in FUZZ_FRAGMENTS if fragment.strip()] + ["word"] * 40
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(100, 400))) for _ in range(count)]
+
+
+# Compare the new normalizer with the original one, returning a list of (line, expected, actual) mismatches
+def check_equivalence(lines):
+    mismatches = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected_lines = [legacy_prepare_text(line) for line in lines]
+
+    for line, expected in zip(lines, expected_lines):
+        if clean_text(line) != legacy_clean_text(line):
+            mismatches.append((line, legacy_clean_text(line), clean_text(line)))
+        elif prepare_text(line) != expected:
+            mismatches.append((line, expected, prepare_text(line)))
+
+    # Batched cleaning joins the lines together before cleaning them, so check the batches against the original too
+    for start in range(0, len(lines), 50):
+        batch = lines[start:start + 50]
+
+        for line, expected, actual in zip(batch, expected_lines[start:start + 50], prepare_texts(batch)):
+            if actual != expected:
+                mismatches.append((line, expected, actual))
+
+    return mismatches
+
+
+# Time a function over the lines, returning the lines processed per second
+def measure_lines_per_second(function, lines, repeats):
+    best_time = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function(lines)
+        elapsed_time = time.perf_counter() - start_time
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+
+    return len(lines) / best_time if best_time > 0 else float("inf")
+
+
+# Read the lines of a text file to benchmark with, instead of the generated ones
+def read_benchmark_lines(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return [line for line in f.read().split("\n") if line.strip()]
+
+
+def run_text_normalizer_benchmark(input_file=None, line_count=20000, fuzz_count=20000, repeats=5, seed=0):
+    """
+    Check that the text normalizer gives exactly the same output as the original preprocessing,
+    then report how many lines per second each of them processes. Returns False if any output differs.
+    """
+    # Equivalence first, a faster normalizer is no use if it changes the text sent to the TTS model
+    equivalence_lines = EQUIVALENCE_CORPUS + generate_fuzz_lines(fuzz_count, seed) + generate_long_lines(200, seed)
+    if input_file:
+        equivalence_lines += read_benchmark_lines(input_file)
+
+    mismatches = check_equivalence(equivalence_lines)
+    print(f"Equivalence: {len(equivalence_lines) - len(mismatches)}/{len(equivalence_lines)} lines identical")
+
+    for line, expected, actual in mismatches[:10]:
+        print(f"  Mismatch for {line!r}:\n    expected {expected!r}\n    got      {actual!r}")
+
+    if mismatches:
+        return False
+
+    # Benchmark on the book if one is given, otherwise on prose-like lines built from the corpus
+    if input_file:
+        lines = read_benchmark_lines(input_file)
+    else:
+        rng = random.Random(seed)
+        prose_lines = [line for line in EQUIVALENCE_CORPUS if line.strip()]
+        lines = [rng.choice(prose_lines) + " " + rng.choice(prose_lines) for _ in range(line_count)]
+
+    total_characters = sum(len(line) for line in lines)
+    print(f"Benchmarking {len(lines)} lines ({total_characters} characters), best of {repeats} runs")
+
+    # The original prints every line, send that output nowhere so only the processing is timed
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        legacy_rate = measure_lines_per_second(lambda texts: [legacy_prepare_text(text) for text in texts], lines, repeats)
+
+    single_rate = measure_lines_per_second(lambda texts: [prepare_text(text) for text in texts], lines, repeats)
+    batch_rate = measure_lines_per_second(prepare_texts, lines, repeats)
+
+    print(f"  Original (printing discarded): {legacy_rate:12,.0f} lines/s")
+    print(f"  Normalizer, line by line:      {single_rate:12,.0f} lines/s  ({single_rate / legacy_rate:.2f}x)")
+    print(f"  Normalizer, batched:           {batch_rate:12,.0f} lines/s  ({batch_rate / legacy_rate:.2f}x)")
+
+    return True
@@ -0,0 +1,72 @@
+import gc
+import time
+import torch
+import tts_audio_generator
+from tts_model_loader import load_coqui_model, get_cpu_performance_profile
+from tts_audio_generator import synthesize_audio, get_output_sample_rate
+
+# Fixed text synthesized by the benchmark, so results from different runs and machines can be compared
+BENCHMARK_TEXT = (
+    "The old lighthouse keeper climbed the spiral stairs one last time. "
+    "Outside, the storm had finally passed, and the sea lay calm beneath a pale morning sky. "
+    "\"Is anyone there?\" a voice called from the rocks below. He smiled, and went down to meet them."
+)
+
+# Seed set before every run so each one samples the same tokens
+BENCHMARK_SEED = 0
+
+
+# Synthesize the text several times with a loaded model, returning (seconds of audio, best seconds taken)
+def measure_synthesis(tts, text, voice, runs):
+    best_time = None
+    audio_seconds = 0.0
+
+    # Compute the speaker conditioning and run the model once before timing
+    synthesize_audio("Warm up.", voice, tts, "coqui")
+
+    for _ in range(runs):
+        torch.manual_seed(BENCHMARK_SEED)
+
+        start_time = time.perf_counter()
+        wav = synthesize_audio(text, voice, tts, "coqui")
+        elapsed_time = time.perf_counter() - start_time
+
+        audio_seconds = len(wav) / get_output_sample_rate(tts, "coqui")
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+
+    return audio_seconds, best_time
+
+
+def run_tts_inference_benchmark(voice, text=BENCHMARK_TEXT, runs=3, intra_op_threads=None, inter_op_threads=None, torch_compile=False):
+    """
+    Report the real-time factor (seconds to synthesize / seconds of audio, lower is faster) of the Coqui model
+    loaded normally and with the CPU performance profile, on a fixed text and voice.
+    """
+    # Every run has to reach the model, otherwise the second run would just read the first from the cache
+    tts_audio_generator.USE_SYNTHESIS_CACHE = False
+
+    performance_profile = get_cpu_performance_profile(
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+        torch_compile=torch_compile
+    )
+
+    results = {}
+
+    for name, profile in [("default", None), ("fast CPU", performance_profile)]:
+        print(f"\nLoading model ({name})")
+        tts = load_coqui_model(profile)
+
+        audio_seconds, synthesis_seconds = measure_synthesis(tts, text, voice, runs)
+        results[name] = synthesis_seconds / audio_seconds if audio_seconds > 0 else float("inf")
+        print(f"{name}: {synthesis_seconds:.2f}s to synthesize {audio_seconds:.2f}s of audio, RTF {results[name]:.3f}")
+
+        # Free the model before loading the next so both never share the memory
+        del tts
+        gc.collect()
+
+    print(f"\nReal-time factor on {torch.get_num_threads()} threads, best of {runs} runs:")
+    print(f"  Default:  {results['default']:.3f}")
+    print(f"  Fast CPU: {results['fast CPU']:.3f}  ({results['default'] / results['fast CPU']:.2f}x faster)")
+
+    return results
@@ -1,6 +1,3 @@
-# Import the ebub reader module
-import epub_file_reader
-
 def read_file(file_path):
     """
     Reads the content of a .txt or .epub file based on its extension.
@@ -60,5 +57,7 @@ def read_epub_file(file_path):
     """
     print("Reading .epub file:", file_path)
     
-    # Delegate to the custom EPUB file reader module
+    # Delegate to the custom EPUB file reader module, imported here so ebooklib and bs4 are only loaded for EPUB files
+    import epub_file_reader
+
     return epub_file_reader.read_epub_file(file_path)
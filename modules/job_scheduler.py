@@ -0,0 +1,321 @@
+import time
+import queue
+import itertools
+import threading
+import traceback
+from collections import OrderedDict
+
+# States a job moves through. A job ends completed, failed or cancelled
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_JOB_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# Resources a job can need. Only as many jobs as a resource's limit run on it at once
+LLM_RESOURCE = "llm"
+TTS_RESOURCE = "tts"
+
+# The LLM can only work on one prompt at a time. Each extra TTS job needs its own copy of the TTS model
+DEFAULT_RESOURCE_LIMITS = {LLM_RESOURCE: 1, TTS_RESOURCE: 1}
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job when it has been cancelled, to stop it at the next progress report.
+    """
+
+
+class Job:
+    """
+    A unit of work run by a JobScheduler, with its status, progress and result.
+    The job's function is called with the job as its job keyword argument, and calls job.report_progress() as it goes.
+    Progress reports are also where a cancelled job stops: report_progress() raises JobCancelled once cancel() has been called.
+    """
+
+    def __init__(self, job_id, name, resource, function, args, kwargs, depends_on):
+        self.id = job_id
+        self.name = name
+        self.resource = resource
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.depends_on = depends_on
+        self.status = JOB_QUEUED
+        self.slot = None  # Index of the resource's worker running the job
+        self.result = None
+        self.error = None
+        self.progress_completed = 0
+        self.progress_total = 0
+        self.progress_message = ""
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    def report_progress(self, completed, total, message=None):
+        """
+        Record how much of the job is done. completed may be fractional, such as a chapter that is partly generated.
+        Raises JobCancelled if the job has been cancelled.
+        """
+        self.progress_completed = completed
+        self.progress_total = total
+
+        if message is not None:
+            self.progress_message = message
+
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} ({self.name}) was cancelled")
+
+    def wait(self, timeout=None):
+        """
+        Wait for the job to finish and return its result. Raises the job's error if it failed, or JobCancelled if it was cancelled.
+        """
+        if not self._done_event.wait(timeout):
+            raise TimeoutError(f"Job {self.id} ({self.name}) did not finish within {timeout} seconds")
+
+        if self.status == JOB_FAILED:
+            raise self.error
+
+        if self.status == JOB_CANCELLED:
+            raise JobCancelled(f"Job {self.id} ({self.name}) was cancelled")
+
+        return self.result
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_JOB_STATES
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def progress(self):
+        # Fraction of the job done, from 0 to 1
+        if self.status == JOB_COMPLETED:
+            return 1.0
+
+        if self.progress_total <= 0:
+            return 0.0
+
+        return min(1.0, self.progress_completed / self.progress_total)
+
+    @property
+    def elapsed_seconds(self):
+        if self.start_time is None:
+            return 0.0
+
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    @property
+    def eta_seconds(self):
+        # Estimated seconds left, assuming the rest of the job goes at the rate it has so far. None until there is progress to go on
+        if self.status != JOB_RUNNING or self.progress <= 0:
+            return None
+
+        return self.elapsed_seconds * (1 - self.progress) / self.progress
+
+    def get_status(self):
+        """
+        Return the job's status, progress, timing and result as a dict.
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "resource": self.resource,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.progress_message,
+            "elapsed_seconds": self.elapsed_seconds,
+            "eta_seconds": self.eta_seconds,
+            "result": self.result,
+            "error": str(self.error) if self.error is not None else None
+        }
+
+    def __str__(self):
+        status = f"Job {self.id} ({self.name}): {self.status}"
+
+        if self.status == JOB_RUNNING:
+            status += f", {self.progress:.0%}"
+
+            if self.eta_seconds is not None:
+                status += f", {format_duration(self.eta_seconds)} left"
+
+        if self.progress_message and not self.is_finished:
+            status += f" - {self.progress_message}"
+
+        if self.status == JOB_FAILED:
+            status += f" - {self.error}"
+
+        return status
+
+
+class JobScheduler:
+    """
+    Runs submitted jobs on worker threads, with a separate queue and a fixed number of workers for each resource,
+    so only one job uses the LLM at a time while several TTS jobs run side by side.
+    Jobs on a resource start in the order they were submitted. A job can depend on other jobs, in which case it is only
+    queued once they have completed, and is cancelled if any of them fails or is cancelled.
+    """
+
+    def __init__(self, resource_limits=None):
+        self._resource_limits = dict(DEFAULT_RESOURCE_LIMITS, **(resource_limits or {}))
+        self._queues = {resource: queue.Queue() for resource in self._resource_limits}
+        self._jobs = OrderedDict()  # job id -> job, in the order they were submitted
+        self._waiting_jobs = []     # Jobs waiting for the jobs they depend on
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._workers = []
+
+        for resource, limit in self._resource_limits.items():
+            for slot in range(max(1, limit)):
+                worker = threading.Thread(target=self._run_worker, args=(resource, slot), name=f"{resource}-job-worker-{slot}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, name, resource, function, args=(), kwargs=None, depends_on=None):
+        """
+        Queue function(*args, job=job, **kwargs) to run on the given resource and return its Job.
+        """
+        if resource not in self._queues:
+            raise ValueError(f"Unknown job resource: {resource}. Options: {', '.join(self._queues)}")
+
+        with self._lock:
+            job = Job(next(self._job_ids), name, resource, function, args, kwargs or {}, list(depends_on or []))
+            self._jobs[job.id] = job
+
+            if job.depends_on:
+                self._waiting_jobs.append(job)
+                self._release_waiting_jobs()
+            else:
+                self._queues[resource].put(job)
+
+        print(f"Submitted job {job.id}: {name}")
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. A queued job is cancelled straight away, a running job stops at its next progress report.
+        Returns False if there is no such job or it has already finished.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+            if job is None or job.is_finished:
+                return False
+
+            job._cancel_event.set()
+
+            # Queued jobs are left in their queue and skipped when a worker takes them
+            if job.status == JOB_QUEUED:
+                if job in self._waiting_jobs:
+                    self._waiting_jobs.remove(job)
+
+                self._finish(job, JOB_CANCELLED)
+
+        print(f"Cancelling job {job_id}: {job.name}")
+        return True
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        return list(self._jobs.values())
+
+    def shutdown(self):
+        """
+        Cancel every unfinished job and stop the workers once their current jobs have stopped.
+        """
+        for job in self.list_jobs():
+            self.cancel(job.id)
+
+        for resource, limit in self._resource_limits.items():
+            for _ in range(max(1, limit)):
+                self._queues[resource].put(None)
+
+        for worker in self._workers:
+            worker.join()
+
+    @property
+    def resource_limits(self):
+        return dict(self._resource_limits)
+
+    def _run_worker(self, resource, slot):
+        while True:
+            job = self._queues[resource].get()
+
+            # None tells the worker to stop
+            if job is None:
+                break
+
+            with self._lock:
+                if job.status != JOB_QUEUED:
+                    continue
+
+                job.status = JOB_RUNNING
+                job.slot = slot
+                job.start_time = time.time()
+
+            try:
+                result = job.function(*job.args, job=job, **job.kwargs)
+
+                with self._lock:
+                    job.result = result
+                    self._finish(job, JOB_COMPLETED)
+
+            except JobCancelled:
+                with self._lock:
+                    self._finish(job, JOB_CANCELLED)
+
+            except Exception as e:
+                # Keep the worker going for the next job, but show what went wrong
+                traceback.print_exc()
+
+                with self._lock:
+                    job.error = e
+                    self._finish(job, JOB_FAILED)
+
+            print(job)
+
+    # Must be called with the lock held
+    def _finish(self, job, status):
+        job.status = status
+        job.end_time = time.time()
+        job._done_event.set()
+        self._release_waiting_jobs()
+
+    # Queue waiting jobs whose dependencies have all completed, and cancel those with a dependency that didn't.
+    # Must be called with the lock held
+    def _release_waiting_jobs(self):
+        for job in list(self._waiting_jobs):
+            # Cancelling a job releases its own dependants, which may already have taken jobs off the list
+            if job not in self._waiting_jobs:
+                continue
+
+            if any(dependency.status in (JOB_FAILED, JOB_CANCELLED) for dependency in job.depends_on):
+                self._waiting_jobs.remove(job)
+                job.error = Exception("A job it depends on failed or was cancelled")
+                job._cancel_event.set()
+                self._finish(job, JOB_CANCELLED)
+
+            elif all(dependency.status == JOB_COMPLETED for dependency in job.depends_on):
+                self._waiting_jobs.remove(job)
+                self._queues[job.resource].put(job)
+
+
+# Format a number of seconds as h:mm:ss, or m:ss under an hour
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours > 0:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+    return f"{minutes}:{seconds:02d}"
@@ -0,0 +1,75 @@
+# Maps the lines an LLM returns for a chunk back onto the chunk's text, to find exactly which text it left out or made up.
+# Text is compared by its letters and digits only, lowercased, so changed quotes, dashes, punctuation and spacing still match
+
+
+# The comparable form of a text, with the offset in the original text of each character kept
+def get_comparable_text(text):
+    characters = []
+    offsets = []
+
+    for offset, character in enumerate(text):
+        if character.isalnum():
+            characters.append(character.lower())
+            offsets.append(offset)
+
+    return "".join(characters), offsets
+
+
+def align_lines(source_text, lines):
+    """
+    Find each line in the source text, in order, each searched for after the end of the one before.
+    Returns:
+        aligned_lines: (start offset, line) of every line found in the source.
+        missing_spans: (start, end) offsets of source text no line covers, with the punctuation around it. Gaps of only spaces
+            and punctuation are ignored.
+        unmatched_lines: lines not found in the source, that the LLM changed or made up.
+    """
+    comparable_source, source_offsets = get_comparable_text(source_text)
+
+    aligned_lines = []
+    missing_spans = []
+    unmatched_lines = []
+    cursor = 0
+
+    for line in lines:
+        comparable_line, _ = get_comparable_text(line.get("line", ""))
+
+        if not comparable_line:
+            continue
+
+        position = comparable_source.find(comparable_line, cursor)
+
+        if position == -1:
+            unmatched_lines.append(line)
+            continue
+
+        # Source text skipped over between the previous line and this one
+        if position > cursor:
+            missing_spans.append(get_source_span(source_text, source_offsets, cursor, position))
+
+        aligned_lines.append((source_offsets[position], line))
+        cursor = position + len(comparable_line)
+
+    # Text after the last line found
+    if cursor < len(comparable_source):
+        missing_spans.append(get_source_span(source_text, source_offsets, cursor, len(comparable_source)))
+
+    return aligned_lines, missing_spans, unmatched_lines
+
+
+# Offsets in the source text of a span of its comparable text, widened to whole words so the quotes and punctuation
+# attached to them are kept, without reaching into the lines found before and after it
+def get_source_span(source_text, source_offsets, start, end):
+    previous_line_end = source_offsets[start - 1] + 1 if start > 0 else 0
+    next_line_start = source_offsets[end] if end < len(source_offsets) else len(source_text)
+
+    span_start = source_offsets[start]
+    span_end = source_offsets[end - 1] + 1
+
+    while span_start > previous_line_end and not source_text[span_start - 1].isspace():
+        span_start -= 1
+
+    while span_end < next_line_start and not source_text[span_end].isspace():
+        span_end += 1
+
+    return span_start, span_end
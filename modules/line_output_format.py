@@ -0,0 +1,173 @@
+import re
+import json
+from pathlib import Path
+
+# Folder of the JSON schemas the LLM's output must follow
+script_dir = Path(__file__).resolve().parent
+SCHEMA_FOLDER = script_dir / ".." / "llm_json_schemas"
+
+# Instruction/query for the language model
+USER_QUERY = (
+    "Given the input text, identify and label every line in the exact order it appears. For each line:\n"
+    "- Extract the exact text, including all punctuation, without omissions or modifications.\n"
+    "- Assign each line a speaker: either the character who spoke it or Narrator.\n"
+    "- If a line includes both narration and dialogue (e.g., \"Hello!\" John said.), split and label the parts accordingly:\n"
+    "  - \"Hello!\" → Character: John\n"
+    "  - John said. → Narrator\n"
+    "\n"
+    "Important Instructions:\n"
+    "- Do NOT skip any lines or words.\n"
+    "- Do NOT invent or paraphrase any text.\n"
+    "- Include every line in your output — even those by the Narrator.\n"
+    "- If the speaker is ambiguous or unknown, default to Narrator.\n"
+    "- The final output must include every word from the input text.\n"
+    "- The output should NEVER be empty.\n"
+    "\n"
+    "Your goal is to produce a complete and accurate list of lines with correct speaker attributions.\n"
+)
+
+# Instruction/query for the sentence index format, where the model labels numbered segments instead of copying the text
+SENTENCE_INDEX_QUERY = (
+    "The input text is split into numbered segments, one per line, each starting with its number in square brackets. "
+    "Identify the speaker of every segment, in the exact order they appear:\n"
+    "- Group consecutive segments with the same speaker into one entry, giving the numbers of its first (start) and last (end) segment.\n"
+    "- The speaker is either the character who spoke the segment or Narrator.\n"
+    "- Quoted speech belongs to the character speaking it. The text around it (e.g., John said.) belongs to the Narrator.\n"
+    "\n"
+    "Important Instructions:\n"
+    "- Cover every segment from 1 to the last number exactly once, in order. Do NOT skip any numbers.\n"
+    "- Do NOT output the text of the segments, only their numbers and speakers.\n"
+    "- If the speaker is ambiguous or unknown, default to Narrator.\n"
+    "- The output should NEVER be empty.\n"
+    "\n"
+    "Your goal is to produce a complete and accurate list of segment ranges with correct speaker attributions.\n"
+)
+
+# Quoted speech, each kept as one segment. Single quotes only count where they aren't part of a word, as they are also apostrophes
+QUOTE_PATTERN = re.compile(r'“[^”]*”|"[^"]*"|«[^»]*»|(?<!\w)‘.*?’(?!\w)|(?<!\w)\'.*?\'(?!\w)', re.DOTALL)
+
+# Ends of sentences in the narration between quotes
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+def load_schema(schema_file_name):
+    with open(SCHEMA_FOLDER / schema_file_name, 'r') as file:
+        return json.load(file)
+
+
+class TextLineFormat:
+    """
+    The model copies the text of every line with its speaker. Simple for the model, but the output is as long as the input.
+    """
+    name = "text"
+    query = USER_QUERY
+
+    # The output repeats every word of the input, plus the keys, quotes and speaker of each line
+    output_tokens_per_input_token = 1.3
+    input_tokens_per_text_token = 1.0
+
+    def __init__(self):
+        self.schema = load_schema("line_identifier_schema.json")
+
+    def get_prompt(self, text):
+        return self.query + text
+
+    def get_lines(self, text, returned_lines):
+        # Lines are already text and speaker. Alignment with the source catches what the model changed
+        return returned_lines, 0
+
+
+class SentenceIndexLineFormat:
+    """
+    The text is split into numbered segments (quotes and the sentences between them) and the model only returns
+    ranges of segment numbers with their speakers, so the output is a few tokens per line however long the line is.
+    The line text is rebuilt from the source, so it can't be changed by the model.
+    """
+    name = "sentence_index"
+    query = SENTENCE_INDEX_QUERY
+
+    # Each entry is a few numbers and a speaker, whatever the length of its text. The segment numbers add to the input
+    output_tokens_per_input_token = 0.35
+    input_tokens_per_text_token = 1.2
+
+    def __init__(self):
+        self.schema = load_schema("line_identifier_sentence_index_schema.json")
+
+    def get_prompt(self, text):
+        segments = split_into_segments(text)
+        return self.query + "\n".join(f"[{number}] {text[start:end]}" for number, (start, end) in enumerate(segments, 1))
+
+    def get_lines(self, text, returned_lines):
+        """
+        Rebuild the lines from the returned segment ranges. Ranges that aren't numbers, are out of bounds, or overlap or
+        go back before an earlier range are dropped, so alignment with the source finds their text missing.
+        Returns the lines and how many ranges were dropped.
+        """
+        segments = split_into_segments(text)
+        lines = []
+        invalid_ranges = 0
+        last_end = 0
+
+        for returned_line in returned_lines:
+            start = returned_line.get("start")
+            end = returned_line.get("end")
+
+            if not isinstance(start, int) or not isinstance(end, int) or not last_end < start <= end <= len(segments):
+                invalid_ranges += 1
+                continue
+
+            lines.append({"line": text[segments[start - 1][0]:segments[end - 1][1]], "speaker": returned_line.get("speaker", "Narrator")})
+            last_end = end
+
+        return lines, invalid_ranges
+
+
+# (start, end) offsets of the segments of a text: every quote whole, and the narration between quotes split into sentences
+def split_into_segments(text):
+    segments = []
+    position = 0
+
+    for quote in QUOTE_PATTERN.finditer(text):
+        segments += get_sentence_segments(text, position, quote.start())
+        segments.append((quote.start(), quote.end()))
+        position = quote.end()
+
+    segments += get_sentence_segments(text, position, len(text))
+    return segments
+
+
+def get_sentence_segments(text, start, end):
+    segments = []
+    sentence_start = start
+
+    for sentence_end in SENTENCE_END_PATTERN.finditer(text, start, end):
+        segments.append((sentence_start, sentence_end.start()))
+        sentence_start = sentence_end.end()
+
+    segments.append((sentence_start, end))
+
+    # Leave out the surrounding whitespace, and pieces with no words such as the comma between two quotes
+    trimmed_segments = []
+
+    for segment_start, segment_end in segments:
+        segment_text = text[segment_start:segment_end]
+
+        if any(character.isalnum() for character in segment_text):
+            segment_start += len(segment_text) - len(segment_text.lstrip())
+            segment_end -= len(segment_text) - len(segment_text.rstrip())
+            trimmed_segments.append((segment_start, segment_end))
+
+    return trimmed_segments
+
+
+LINE_OUTPUT_FORMATS = {
+    TextLineFormat.name: TextLineFormat,
+    SentenceIndexLineFormat.name: SentenceIndexLineFormat
+}
+
+
+def get_line_output_format(name):
+    if name not in LINE_OUTPUT_FORMATS:
+        raise ValueError(f"Invalid line output format: {name}. Options: {', '.join(LINE_OUTPUT_FORMATS)}")
+
+    return LINE_OUTPUT_FORMATS[name]()
@@ -1,5 +1,8 @@
+import gc
 # Import the function to load an LLM model
 from llm_model_loader import load_llm_model
+from llm_prompt_cache import PromptPrefixCache
+from text_generator import Model_Type
 
 class Llm:
     def __init__(self, model_config, model=None):
@@ -7,19 +10,47 @@ class Llm:
         self._model_config = model_config
         # Initialize the model attribute to None
         self._model = None
+        # Snapshot of the prompt start every request shares, kept for as long as this model stays loaded
+        self._prompt_cache = PromptPrefixCache()
         
         # If a model instance is passed, use it
         if model is not None:
             self._model = model
-        else:
-            # Otherwise, load the model using the provided config
+        elif self.is_local:
+            # Otherwise, load the model using the provided config. A cloud model has nothing to load
             self._model = load_llm_model(self)
 
     def load_model(self):
-        # Method to (re)load the model using the current config
+        # Method to (re)load the model using the current config, releasing the old one first so both are never in memory
+        self.unload_model()
         self._model = load_llm_model(self)
         return "Model Loaded"
 
+    def unload_model(self):
+        # Free the model's weights and context now rather than whenever the garbage collector gets to them
+        model = self._model
+        self._model = None
+        self._prompt_cache = PromptPrefixCache()
+
+        if model is None:
+            return
+
+        # A draft model used for speculative decoding is a second model to free
+        draft_model = getattr(model, "draft_model", None)
+        if hasattr(draft_model, "close"):
+            draft_model.close()
+
+        if hasattr(model, "close"):
+            model.close()
+
+        del model
+        gc.collect()
+
+    # Whether the model runs in this process, rather than in the cloud
+    @property
+    def is_local(self):
+        return self._model_config['model_type'] in (Model_Type.LOCAL_FILE, Model_Type.HUGGING_FACE)
+
     # Getter for model_config
     @property
     def model_config(self):
@@ -30,6 +61,11 @@ class Llm:
     def model_config(self, value):
         self._model_config = value
 
+    # Getter for the prompt prefix cache
+    @property
+    def prompt_cache(self):
+        return self._prompt_cache
+
     # Getter for model
     @property
     def model(self):
@@ -13,10 +13,13 @@ script_dir = Path(__file__).resolve().parent
 # Default output folder for saving results
 DEFAULT_OUTPUT_FILE_FOLDER = script_dir / ".." / "multi_speaker_outputs"
 
-def identify_book_character_lines(llm, user_input, is_file, start_section, end_section, output_folder, max_retries_if_no_narrator):
+def identify_book_character_lines(llm, user_input, is_file, start_section, end_section, output_folder, max_retries_if_no_narrator, job=None, llm_pool=None, line_output_format="text"):
     """
     Identifies character lines in a book or text input using an LLM and saves the results.
     Can resume from a previous run if the output folder already contains processed sections.
+    If run as a job, progress is reported to it after every chunk, which is also where a cancelled job stops.
+    With an LLM pool, each section's chunks are spread across the pool's workers.
+    line_output_format chooses whether the LLM copies each line's text or labels numbered sentences (see line_output_format.py).
     """
 
     # Determine output directory based on user input or timestamp
@@ -56,7 +59,9 @@ def identify_book_character_lines(llm, user_input, is_file, start_section, end_s
         print("\n\n\nCurrently processing section", (i - start_section), "of", (end_section - start_section), "\n")
         
         # Identify character lines using the LLM
-        character_lines = identify_lines_in_chapter(text[i], llm, max_retries_if_no_narrator)
+        character_lines = identify_lines_in_chapter(
+            text[i], llm, max_retries_if_no_narrator, get_section_progress_callback(job, i - start_section, end_section - start_section), llm_pool, line_output_format
+        )
         
         # Save identified lines to file
         chapter_dir = Path(book_directory_path) / "chapter_lines"
@@ -74,6 +79,21 @@ def identify_book_character_lines(llm, user_input, is_file, start_section, end_s
     print("\n\nLine identification complete")
     
     return book_directory_path
+
+
+# Report a section's finished chunks to the job as a fraction of a section, so progress and ETA move during long sections
+def get_section_progress_callback(job, sections_completed, section_count):
+    if job is None:
+        return None
+    
+    def report_chunk_progress(chunks_completed, chunk_count):
+        job.report_progress(
+            sections_completed + chunks_completed / max(1, chunk_count),
+            section_count,
+            f"Section {sections_completed + 1} of {section_count}: chunk {chunks_completed} of {chunk_count}"
+        )
+    
+    return report_chunk_progress
     
     
 def identify_characters(input_data):
@@ -0,0 +1,113 @@
+from text_generator import Model_Type, SYSTEM_PROMPT
+
+# Tokens the chat template adds around the system and user messages
+CHAT_TEMPLATE_TOKENS = 32
+
+# The JSON output repeats every word of the chunk, plus the keys, quotes and speaker of each line
+OUTPUT_TOKENS_PER_INPUT_TOKEN = 1.3
+OUTPUT_OVERHEAD_TOKENS = 64
+
+# Used when the model's tokenizer isn't available, as with cloud models
+CHARACTERS_PER_TOKEN = 4
+
+# Chunks are never planned smaller than this, even if the context is too small for the prompt
+MIN_CHUNK_TOKENS = 64
+
+
+class ChunkTokenBudget:
+    """
+    Works out how many tokens of text fit in one line identification request and splits text into chunks of that size.
+    Tokens are counted with the loaded model's tokenizer. A local model's context has to hold the prompt, the chunk and the
+    JSON output, which is a little longer than the chunk. For a cloud model, only the output has to fit in max_tokens.
+    Output formats that don't copy the text give a smaller output_tokens_per_input_token, and ones that add to the chunk,
+    such as segment numbers, an input_tokens_per_text_token above 1.
+    """
+
+    def __init__(self, llm, prompt, output_tokens_per_input_token=OUTPUT_TOKENS_PER_INPUT_TOKEN, input_tokens_per_text_token=1.0):
+        self._count_tokens = get_token_counter(llm)
+        self._output_tokens_per_input_token = output_tokens_per_input_token
+        self._input_tokens_per_text_token = input_tokens_per_text_token
+        self._prompt_tokens = self._count_tokens(SYSTEM_PROMPT + prompt) + CHAT_TEMPLATE_TOKENS
+
+        if llm.model_config['model_type'] == Model_Type.OPEN_AI:
+            self._request_token_limit = int(llm.model_config['max_tokens'])
+            self._prompt_in_limit = False
+        else:
+            self._request_token_limit = int(llm.model_config['context_length'])
+            self._prompt_in_limit = True
+
+        available_tokens = self._request_token_limit - OUTPUT_OVERHEAD_TOKENS
+
+        # The prompt and the chunk itself only take up room in a local model's context
+        if self._prompt_in_limit:
+            available_tokens -= self._prompt_tokens
+            self._chunk_tokens = int(available_tokens / (input_tokens_per_text_token * (1 + output_tokens_per_input_token)))
+        else:
+            self._chunk_tokens = int(available_tokens / (input_tokens_per_text_token * output_tokens_per_input_token))
+
+        self._chunk_tokens = max(MIN_CHUNK_TOKENS, self._chunk_tokens)
+
+    def split(self, text, split_text_into_chunks):
+        """
+        Split text into chunks of at most chunk_tokens tokens with the given splitter, packing as many paragraphs into each as fit.
+        """
+        return split_text_into_chunks(text, self._chunk_tokens, self._count_tokens)
+
+    def get_expected_request_tokens(self, chunk):
+        # Tokens of the request that count against the limit, with the output estimated from the chunk's length
+        chunk_tokens = self._count_tokens(chunk) * self._input_tokens_per_text_token
+        expected_tokens = chunk_tokens * self._output_tokens_per_input_token + OUTPUT_OVERHEAD_TOKENS
+
+        if self._prompt_in_limit:
+            expected_tokens += self._prompt_tokens + chunk_tokens
+
+        return expected_tokens
+
+    def get_chunk_report(self, chunks):
+        """
+        Chunk count, mean and highest fill ratio of the request limit, and how many chunks are expected to overflow it.
+        """
+        fill_ratios = [self.get_expected_request_tokens(chunk) / self._request_token_limit for chunk in chunks]
+
+        return {
+            "chunks": len(chunks),
+            "mean_fill": sum(fill_ratios) / max(1, len(fill_ratios)),
+            "max_fill": max(fill_ratios, default=0.0),
+            "expected_overflows": sum(1 for fill_ratio in fill_ratios if fill_ratio > 1)
+        }
+
+    @property
+    def chunk_tokens(self):
+        return self._chunk_tokens
+
+    @property
+    def prompt_tokens(self):
+        return self._prompt_tokens
+
+    @property
+    def request_token_limit(self):
+        return self._request_token_limit
+
+
+# A function counting the tokens of a text with the LLM's own tokenizer, or estimating them if it doesn't have one
+def get_token_counter(llm):
+    model = llm.model
+
+    if model is None or not hasattr(model, "tokenize"):
+        return estimate_token_count
+
+    def count_tokens(text):
+        return len(model.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+    return count_tokens
+
+
+def estimate_token_count(text):
+    return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+
+def format_chunk_report(chunk_report):
+    return (
+        f"{chunk_report['chunks']} chunks, context fill {chunk_report['mean_fill']:.0%} mean, {chunk_report['max_fill']:.0%} max, "
+        f"{chunk_report['expected_overflows']} expected to overflow"
+    )
@@ -1,124 +1,325 @@
 import json
 import re
-import os
-from text_generator import generate_json_text
-
-# Main function to identify spoken and narrator lines in a given chapter
-def identify_lines_in_chapter(chapter, llm, max_retries_if_no_narrator):
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from text_generator import generate_json_text, get_llm_response_cache_stats, Model_Type
+from llm_prompt_cache import get_prompt_cache_totals
+from llm_chunk_budget import ChunkTokenBudget, format_chunk_report
+from line_alignment import align_lines
+from narration_prepass import split_narration_and_dialogue, get_narration_lines
+from line_output_format import get_line_output_format
+
+MAX_CHUNK_RETRIES = 200  # How many times to retry a chunk if issues occur
+MAX_REPAIR_ROUNDS = 3  # How many times to ask again for text the LLM left out of a chunk
+USE_NARRATION_PREPASS = True  # Label paragraphs away from any dialogue as Narrator without asking the LLM
+
+
+# Main function to identify spoken and narrator lines in a given chapter.
+# progress_callback(chunks_completed, chunk_count) is called before the first chunk and after each one.
+# With an LLM pool of more than one worker, chunks are sent to the pool's instances at the same time.
+# line_output_format is "text", where the model copies each line, or "sentence_index", where it labels numbered segments.
+# If a stats Counter is given, the section's request, token and repair counts are added to it
+def identify_lines_in_chapter(chapter, llm, max_retries_if_no_narrator, progress_callback=None, llm_pool=None, line_output_format="text", stats=None):
     print("Start")
     
-    # Get the absolute path to the schema, relative to this file
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    schema_path = os.path.join(script_dir, '../llm_json_schemas/line_identifier_schema.json')
+    # The prompt, output schema and how lines are read from the output
+    line_format = get_line_output_format(line_output_format)
+
+    # Only the parts of the chapter with dialogue go to the LLM. The rest can only be narration
+    if USE_NARRATION_PREPASS:
+        segments = split_narration_and_dialogue(chapter)
+    else:
+        segments = [(True, chapter)]
+        
+    narration_characters = sum(len(segment_text) for needs_llm, segment_text in segments if not needs_llm)
+    print(f"Narration pre-pass: {narration_characters / max(1, len(chapter)):.1%} of the text labelled Narrator without the LLM")
+
+    # Break the parts that need the LLM into chunks of as many tokens as fit in a request alongside the instructions and the JSON output
+    chunk_budget = ChunkTokenBudget(llm, line_format.query, line_format.output_tokens_per_input_token, line_format.input_tokens_per_text_token)
+    chunks = []
+    chunk_segment_indices = []
+    
+    for segment_index, (needs_llm, segment_text) in enumerate(segments):
+        if needs_llm:
+            segment_chunks = chunk_budget.split(segment_text, split_text_into_chunks)
+            chunks += segment_chunks
+            chunk_segment_indices += [segment_index] * len(segment_chunks)
+            
+    print(f"Chunks of up to {chunk_budget.chunk_tokens} tokens: {format_chunk_report(chunk_budget.get_chunk_report(chunks))}")
     
-    # Load the expected JSON schema from file for validation
-    with open(schema_path, 'r') as file:
-        schema = json.load(file)
+    if progress_callback is not None:
+        progress_callback(0, len(chunks))
         
-    # Instruction/query for the language model
-    user_query = (
-        "Given the input text, identify and label every line in the exact order it appears. For each line:\n"
-        "- Extract the exact text, including all punctuation, without omissions or modifications.\n"
-        "- Assign each line a speaker: either the character who spoke it or Narrator.\n"
-        "- If a line includes both narration and dialogue (e.g., \"Hello!\" John said.), split and label the parts accordingly:\n"
-        "  - \"Hello!\" → Character: John\n"
-        "  - John said. → Narrator\n"
-        "\n"
-        "Important Instructions:\n"
-        "- Do NOT skip any lines or words.\n"
-        "- Do NOT invent or paraphrase any text.\n"
-        "- Include every line in your output — even those by the Narrator.\n"
-        "- If the speaker is ambiguous or unknown, default to Narrator.\n"
-        "- The final output must include every word from the input text.\n"
-        "- The output should NEVER be empty.\n"
-        "\n"
-        "Your goal is to produce a complete and accurate list of lines with correct speaker attributions.\n"
-    )
+    start_time = time.perf_counter()
+    workers = llm_pool.workers if llm_pool is not None else 1
+    
+    # Each local model instance keeps the instructions evaluated, so only the chunk's own tokens are evaluated
+    prompt_caches = [instance.prompt_cache for instance in (llm_pool.instances if llm_pool is not None else [llm])]
+    prompt_cache_totals_before = get_prompt_cache_totals(prompt_caches)
+
+    # The response cache counts hits and misses for the whole process, so this section's are the change from here
+    use_response_cache = llm.model_config.get('use_response_cache', True)
+    cache_stats_before = get_llm_response_cache_stats() if use_response_cache else None
+
+    if workers > 1:
+        chunk_results = identify_chunks_in_parallel(chunks, llm_pool, line_format, max_retries_if_no_narrator, progress_callback)
+    else:
+        chunk_results = []
+        
+        # Process each chunk individually
+        for i, chunk in enumerate(chunks):
+            chunk_results.append(identify_lines_in_chunk(chunk, i, len(chunks), llm, line_format, max_retries_if_no_narrator))
+            
+            if progress_callback is not None:
+                progress_callback(i + 1, len(chunks))
+                
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Identified {len(chunks)} chunks in {elapsed_time:.1f}s ({len(chunks) / max(elapsed_time, 1e-9) * 60:.1f} chunks/minute, {workers} LLM workers)")
+    
+    if llm.model_config['model_type'] != Model_Type.OPEN_AI:
+        reused, restored, saved = (total - before for total, before in zip(get_prompt_cache_totals(prompt_caches), prompt_cache_totals_before))
+        print(
+            f"Prompt prefix reused by {reused} requests, {restored} of them from the restored snapshot, saving {saved:.1f}s of prompt eval "
+            f"this section (requests that found the prefix still in the context aren't counted, llama.cpp reuses it by itself)"
+        )
+
+    section_stats = sum((chunk_stats for _, chunk_stats in chunk_results), Counter())
+    print(f"Requests that overflowed the context: {section_stats['overflows']}")
+    print(f"Section {format_repair_stats(section_stats)}")
+    print(f"Tokens generated: {section_stats['completion_tokens']} ({line_format.name} format, {section_stats['prompt_tokens']} prompt tokens)")
+    
+    if stats is not None:
+        stats.update(section_stats)
+    
+    if use_response_cache:
+        cache_stats = get_llm_response_cache_stats()
+        hits = cache_stats['hits'] - cache_stats_before['hits']
+        misses = cache_stats['misses'] - cache_stats_before['misses']
+        print(
+            f"LLM response cache this section: {hits} hits, {misses} misses ({hits / max(1, hits + misses):.1%} hit rate), "
+            f"{cache_stats['entries']} entries, {cache_stats['size_bytes'] / (1024 ** 2):.1f}MB"
+        )
+
+    # Put the LLM's lines and the narration back together in the chapter's order. Chunks that failed every retry are skipped
+    segment_lines = [get_narration_lines(segment_text) if not needs_llm else [] for needs_llm, segment_text in segments]
+    
+    for segment_index, (parsed_chunk, _) in zip(chunk_segment_indices, chunk_results):
+        if parsed_chunk is not None:
+            segment_lines[segment_index] += parsed_chunk["lines"]
 
+    # Flatten the list of lines from all segments
+    combined_lines = [line for lines in segment_lines for line in lines]
 
-    max_retries = 200  # How many times to retry a chunk if issues occur
-    retry_if_no_narrator = True
-    current_no_narrator_retries = 0
-
-    # Break the chapter into smaller text chunks based on model context limit
-    chunks = split_text_into_chunks(chapter, int(llm.model_config['context_length']))
-    identified_chunks = []
+    combined_json_dict = {"lines": combined_lines}
 
-    # Process each chunk individually
-    for i, chunk in enumerate(chunks):
-        current_no_narrator_retries = 0  # Reset retry count for each chunk
-        for attempt in range(max_retries):
-            try:
-                print("\nCurrent chunk:", (i + 1), "of", len(chunks), "\nChunk text (first 100 characters):\n")
-                print(chunk[:100] + "...")
+    # Merge adjacent lines with the same speaker
+    merged_json = merge_consecutive_lines(combined_json_dict)
 
-                print("\nProcessing...")
-                
-                # Ask the LLM to process this chunk
-                response = generate_json_text(user_query + chunk, llm, schema)
-                content = response['choices'][0]['message']['content']
+    print(merged_json)
+    return merged_json
 
-                print("\n\n\nOutput:\n", content, "\n\n\n")
 
-                # Attempt to parse the response content as JSON
-                parsed_chunk = json.loads(content)
+# Ask the LLM for the lines of one chunk, retrying the whole chunk only if the output can't be used at all.
+# Output that leaves text out or changes it is mapped back onto the chunk, and only the missing spans are asked for again.
+# Returns the parsed chunk, or None if every retry failed, and a Counter of the chunk's overflows, retries, repairs and their tokens
+def identify_lines_in_chunk(chunk, i, chunk_count, llm, line_format, max_retries_if_no_narrator):
+    retry_if_no_narrator = True
+    current_no_narrator_retries = 0
+    chunk_stats = Counter()
+    
+    for attempt in range(MAX_CHUNK_RETRIES):
+        if attempt > 0:
+            chunk_stats["retries"] += 1
+            
+        try:
+            print("\nCurrent chunk:", (i + 1), "of", chunk_count, "\nChunk text (first 100 characters):\n")
+            print(chunk[:100] + "...")
+
+            print("\nProcessing...")
+            
+            # Ask the LLM to process this chunk
+            response = generate_json_text(line_format.get_prompt(chunk), llm, line_format.schema, attempt)
+            add_response_token_counts(chunk_stats, response)
+            
+            if attempt > 0:
+                chunk_stats["retry_tokens"] += get_response_token_count(response)
                 
-                # If model indicates an internal error
-                if parsed_chunk.get("was_error"):
-                    print(f"MODEL ERROR: {parsed_chunk.get('error_message')}")
-                    raise Exception("Error")
-
-                # If no lines returned, retry
-                if not parsed_chunk.get("lines"):
-                    print(f"Empty 'lines' array for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{max_retries})")
+            content = response['choices'][0]['message']['content']
+
+            print("\n\n\nOutput:\n", content, "\n\n\n")
+            
+            # Output cut off at the end of the context is never valid JSON
+            if response['choices'][0].get('finish_reason') == "length":
+                chunk_stats["overflows"] += 1
+                print(f"Output ran out of context for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{MAX_CHUNK_RETRIES})")
+                continue
+
+            # Attempt to parse the response content as JSON
+            parsed_chunk = json.loads(content)
+            
+            # If model indicates an internal error
+            if parsed_chunk.get("was_error"):
+                print(f"MODEL ERROR: {parsed_chunk.get('error_message')}")
+                raise Exception("Error")
+
+            # If no lines returned, retry
+            if not parsed_chunk.get("lines"):
+                print(f"Empty 'lines' array for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{MAX_CHUNK_RETRIES})")
+                continue
+            
+            # Rebuild the lines from the output, such as from segment numbers
+            parsed_chunk["lines"], invalid_lines = line_format.get_lines(chunk, parsed_chunk["lines"])
+            chunk_stats["invalid_lines"] += invalid_lines
+            
+            # Map the lines back onto the chunk. Made up lines are dropped, and left out text is asked for on its own
+            aligned_lines, missing_spans, unmatched_lines = align_lines(chunk, parsed_chunk["lines"])
+            
+            # Nothing in the output is from the chunk, so there is nothing to repair
+            if not aligned_lines:
+                print(f"No lines match the chunk: {chunk[:100]}... (Attempt {attempt + 1}/{MAX_CHUNK_RETRIES})")
+                continue
+            
+            if missing_spans or unmatched_lines:
+                print(f"{len(unmatched_lines)} lines not in the chunk, repairing {len(missing_spans)} missing spans")
+                aligned_lines += repair_missing_spans(chunk, missing_spans, llm, line_format, chunk_stats)
+                
+            parsed_chunk["lines"] = [line for _, line in sorted(aligned_lines, key=lambda aligned_line: aligned_line[0])]
+
+            # Check that narrator lines are included
+            has_narrator = any(
+                line.get("speaker", "").strip().lower() == "narrator"
+                for line in parsed_chunk["lines"]
+            )
+
+            # Retry if no narrator lines are found
+            if not has_narrator and retry_if_no_narrator:
+                if current_no_narrator_retries < max_retries_if_no_narrator:
+                    current_no_narrator_retries += 1
+                    print(f"No 'Narrator' found, retrying chunk... (Narrator retry {current_no_narrator_retries}/{max_retries_if_no_narrator})")
                     continue
-
-                # Check that narrator lines are included
-                has_narrator = any(
-                    line.get("speaker", "").strip().lower() == "narrator"
-                    for line in parsed_chunk["lines"]
-                )
-
-                # Retry if no narrator lines are found
-                if not has_narrator and retry_if_no_narrator:
-                    if current_no_narrator_retries < max_retries_if_no_narrator:
-                        current_no_narrator_retries += 1
-                        print(f"No 'Narrator' found, retrying chunk... (Narrator retry {current_no_narrator_retries}/{max_retries_if_no_narrator})")
-                        continue
-                    else:
-                        print(f"No 'Narrator' found after {max_retries_if_no_narrator} retries. Accepting chunk.")
+                else:
+                    print(f"No 'Narrator' found after {max_retries_if_no_narrator} retries. Accepting chunk.")
+            
+            # Return successful result
+            print(i + 1, "of", chunk_count, "chunks completed")
+            
+            if chunk_stats["retries"] or chunk_stats["repairs"]:
+                print(f"Chunk {i + 1}: {format_repair_stats(chunk_stats)}")
                 
-                # Append successful result
-                identified_chunks.append(parsed_chunk)
-                break  # Stop retrying on success
-
-            except json.JSONDecodeError as e:
-                # JSON parsing failed, retry
-                print(f"JSON error for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{max_retries})")
-                print(f"Error: {e}")
-
+            return parsed_chunk, chunk_stats
+
+        except json.JSONDecodeError as e:
+            # JSON parsing failed, retry
+            print(f"JSON error for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{MAX_CHUNK_RETRIES})")
+            print(f"Error: {e}")
+
+        except Exception as e:
+            # The prompt alone didn't fit in the context
+            if "exceed context window" in str(e):
+                chunk_stats["overflows"] += 1
+            
+            # Handle other unexpected errors
+            print(f"Unexpected error for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{MAX_CHUNK_RETRIES})")
+            print(f"Error: {e}")
+
+    # If all retries fail, skip the chunk
+    print("Max retries reached for a chunk. Skipping it.")
+    print(f"Chunk {i + 1}: {format_repair_stats(chunk_stats)}")
+    return None, chunk_stats
+
+
+# Ask the LLM for the lines of only the given spans of the chunk, each on its own. Text a repair leaves out again is asked
+# for in another round. Text still missing after MAX_REPAIR_ROUNDS is given to the Narrator, as the instructions do for an
+# unknown speaker. Returns (start offset, line) of every repaired line
+def repair_missing_spans(chunk, missing_spans, llm, line_format, chunk_stats):
+    repaired_lines = []
+    
+    for repair_round in range(MAX_REPAIR_ROUNDS):
+        if not missing_spans:
+            break
+            
+        still_missing_spans = []
+        
+        for span_start, span_end in missing_spans:
+            span_text = chunk[span_start:span_end]
+            chunk_stats["repairs"] += 1
+            
+            try:
+                response = generate_json_text(line_format.get_prompt(span_text), llm, line_format.schema, repair_round)
+                add_response_token_counts(chunk_stats, response)
+                chunk_stats["repair_tokens"] += get_response_token_count(response)
+                span_lines = json.loads(response['choices'][0]['message']['content']).get("lines") or []
+                span_lines, invalid_lines = line_format.get_lines(span_text, span_lines)
+                chunk_stats["invalid_lines"] += invalid_lines
             except Exception as e:
-                # Handle other unexpected errors
-                print(f"Unexpected error for chunk: {chunk[:100]}... (Attempt {attempt + 1}/{max_retries})")
+                print(f"Repair failed for span: {span_text[:100]}... (Round {repair_round + 1}/{MAX_REPAIR_ROUNDS})")
                 print(f"Error: {e}")
+                still_missing_spans.append((span_start, span_end))
+                continue
+            
+            # Place the span's lines at their offsets in the chunk
+            aligned_span_lines, span_missing_spans, _ = align_lines(span_text, span_lines)
+            repaired_lines += [(span_start + line_start, line) for line_start, line in aligned_span_lines]
+            still_missing_spans += [(span_start + start, span_start + end) for start, end in span_missing_spans]
+            
+        missing_spans = still_missing_spans
+        
+    for span_start, span_end in missing_spans:
+        chunk_stats["narrator_fallbacks"] += 1
+        repaired_lines.append((span_start, {"line": chunk[span_start:span_end], "speaker": "Narrator"}))
+        
+    return repaired_lines
 
-        else:
-            # If all retries fail, skip the chunk
-            print("Max retries reached for a chunk. Skipping it.")
-            continue
 
-        print(i + 1, "of", len(chunks), "chunks completed")
+# Total prompt and completion tokens of a local model's response
+def get_response_token_count(response):
+    return response.get('usage', {}).get('total_tokens', 0)
 
-    # Flatten the list of lines from all chunks
-    combined_lines = [line for chunk in identified_chunks for line in chunk["lines"]]
 
-    combined_json_dict = {"lines": combined_lines}
+# Add a response's prompt and generated token counts to the stats
+def add_response_token_counts(stats, response):
+    usage = response.get('usage', {})
+    stats["prompt_tokens"] += usage.get('prompt_tokens', 0)
+    stats["completion_tokens"] += usage.get('completion_tokens', 0)
 
-    # Merge adjacent lines with the same speaker
-    merged_json = merge_consecutive_lines(combined_json_dict)
 
-    print(merged_json)
-    return merged_json
+def format_repair_stats(stats):
+    return (
+        f"whole chunk retries: {stats['retries']} ({stats['retry_tokens']} tokens), "
+        f"span repairs: {stats['repairs']} ({stats['repair_tokens']} tokens), "
+        f"spans given to the Narrator: {stats['narrator_fallbacks']}"
+    )
+
+
+# Send the chunks to the pool's LLM instances at the same time, each chunk validated and retried on its own.
+# Returns the results in the original chunk order, whatever order they finished in
+def identify_chunks_in_parallel(chunks, llm_pool, line_format, max_retries_if_no_narrator, progress_callback=None):
+    chunk_results = [None] * len(chunks)
+    
+    def identify_chunk(i):
+        with llm_pool.borrow() as llm:
+            return identify_lines_in_chunk(chunks[i], i, len(chunks), llm, line_format, max_retries_if_no_narrator)
+    
+    executor = ThreadPoolExecutor(max_workers=llm_pool.workers, thread_name_prefix="llm-worker")
+    
+    try:
+        futures = {executor.submit(identify_chunk, i): i for i in range(len(chunks))}
+        chunks_completed = 0
+        
+        for future in as_completed(futures):
+            chunk_results[futures[future]] = future.result()
+            chunks_completed += 1
+            
+            # Progress is reported from this thread, so a cancelled job stops here rather than in a worker
+            if progress_callback is not None:
+                progress_callback(chunks_completed, len(chunks))
+                
+    finally:
+        # After an error or cancellation, drop the chunks no worker has started
+        executor.shutdown(wait=True, cancel_futures=True)
+        
+    return chunk_results
 
 
 # Combines consecutive lines from the same speaker into one
@@ -146,8 +347,9 @@ def merge_consecutive_lines(data):
     return data
 
 
-# Splits the input text into chunks that fit within the model's context length
-def split_text_into_chunks(text, chunk_size):
+# Splits the input text into chunks that fit within the chunk size.
+# measure_length gives the size of a piece of text, in characters by default or in tokens with a model's tokenizer
+def split_text_into_chunks(text, chunk_size, measure_length=len):
     text = text.replace("\r", "\n")  # Normalize line endings
 
     # Step 1: Split text into paragraphs using double newlines
@@ -156,24 +358,32 @@ def split_text_into_chunks(text, chunk_size):
     processed_paragraphs = []
     # Step 2: Ensure no single paragraph exceeds the chunk size
     for para in paragraphs:
-        if len(para) <= chunk_size:
-            processed_paragraphs.append(para)
+        para_size = measure_length(para)
+        
+        if para_size <= chunk_size:
+            processed_paragraphs.append((para, para_size))
         else:
             # Break large paragraphs down further by sentence
-            processed_paragraphs.extend(split_large_paragraph(para, chunk_size))
+            processed_paragraphs.extend((part, measure_length(part)) for part in split_large_paragraph(para, chunk_size, measure_length))
 
-    # Step 3: Combine paragraphs into chunks without exceeding chunk size
+    # Step 3: Pack paragraphs into chunks in order, filling each chunk as far as the chunk size allows
     chunks = []
     current_chunk = ""
+    current_size = 0
 
-    for para in processed_paragraphs:
+    for para, para_size in processed_paragraphs:
+        separator_size = 2 if current_chunk else 0
+        
         # If adding this paragraph doesn't exceed limit, append it
-        if len(current_chunk) + len(para) + 2 <= chunk_size:
+        if current_size + separator_size + para_size <= chunk_size:
             current_chunk += ("\n\n" if current_chunk else "") + para
+            current_size += separator_size + para_size
         else:
             # Start a new chunk
-            chunks.append(current_chunk)
+            if current_chunk:
+                chunks.append(current_chunk)
             current_chunk = para
+            current_size = para_size
 
     # Append any remaining content
     if current_chunk:
@@ -184,27 +394,34 @@ def split_text_into_chunks(text, chunk_size):
 
 
 # Further splits a large paragraph into sentence-sized pieces that fit in the chunk size
-def split_large_paragraph(paragraph, chunk_size):
+def split_large_paragraph(paragraph, chunk_size, measure_length=len):
     # Split paragraph into sentences using punctuation as delimiter
     sentences = re.split(r'(?<=[.!?]) +', paragraph)
     
     parts = []
     current = ""
+    current_size = 0
 
     for sentence in sentences:
+        sentence_size = measure_length(sentence)
+        separator_size = 1 if current else 0
+        
         # If adding this sentence doesn't exceed size, append it to current part
-        if len(current) + len(sentence) + 1 <= chunk_size:
+        if current_size + separator_size + sentence_size <= chunk_size:
             current += (" " if current else "") + sentence
+            current_size += separator_size + sentence_size
         else:
             # Save current part and start a new one
             if current:
                 parts.append(current)
             # If a single sentence is still too long, break it further
-            if len(sentence) > chunk_size:
-                parts.extend(split_long_sentence(sentence, chunk_size))
+            if sentence_size > chunk_size:
+                parts.extend(split_long_sentence(sentence, chunk_size, measure_length))
                 current = ""
+                current_size = 0
             else:
                 current = sentence
+                current_size = sentence_size
 
     # Append any leftover text
     if current:
@@ -214,23 +431,29 @@ def split_large_paragraph(paragraph, chunk_size):
 
 
 # Breaks a sentence that exceeds the chunk size into smaller parts by word
-def split_long_sentence(sentence, chunk_size):
+def split_long_sentence(sentence, chunk_size, measure_length=len):
     words = sentence.split()
     parts = []
     current = ""
+    current_size = 0
 
     for word in words:
+        word_size = measure_length(word)
+        separator_size = 1 if current else 0
+        
         # Try to fit this word into the current chunk
-        if len(current) + len(word) + 1 <= chunk_size:
+        if current_size + separator_size + word_size <= chunk_size:
             current += (" " if current else "") + word
+            current_size += separator_size + word_size
         else:
             # Save current part and start a new one with the current word
-            parts.append(current)
+            if current:
+                parts.append(current)
             current = word
+            current_size = word_size
 
     # Append any final leftover text
     if current:
         parts.append(current)
 
     return parts
-
@@ -1,5 +1,6 @@
-from llama_cpp import Llama  # Import the Llama class from the llama_cpp python library
 from text_generator import Model_Type  # Import the Model_Type enum for model source identification
+from llm_speculative_decoding import create_draft_model  # Optional speculative decoding set in the model config
+from llm_runtime_profile import get_llama_runtime_kwargs  # Threads, batch sizes, memory mapping and KV cache type set in the model config
 
 # Load LLM model based on the specified model type in the configuration
 def load_llm_model(llm):
@@ -22,6 +23,8 @@ def load_llm_model(llm):
 
 # Load a model from a local file path using Llama class
 def load_model_from_file(llm):
+    # Import the Llama class from the llama_cpp python library when a model is first loaded, not on startup
+    from llama_cpp import Llama
 
     # Create a Llama instance using configuration details
     loaded_llm = Llama(
@@ -29,7 +32,9 @@ def load_model_from_file(llm):
         n_gpu_layers = llm.model_config['gpu_layers'],     # Number of layers to run on GPU
         n_ctx = llm.model_config['context_length'],        # Context window size
         seed = llm.model_config['seed'],                   # Seed for reproducibility
-        temperature = llm.model_config['temperature']      # Sampling temperature for generation
+        temperature = llm.model_config['temperature'],     # Sampling temperature for generation
+        draft_model = create_draft_model(llm.model_config), # Speculative decoding, if set
+        **get_llama_runtime_kwargs(llm.model_config)       # Runtime performance settings
     )
     
     return loaded_llm  # Return the loaded model instance
@@ -37,6 +42,7 @@ def load_model_from_file(llm):
 
 # Load a model hosted on Hugging Face using from_pretrained method
 def load_model_from_huggingface(llm):
+    from llama_cpp import Llama
 
     # Load the model from a Hugging Face repo using its ID and file name
     loaded_llm = Llama.from_pretrained(
@@ -45,7 +51,9 @@ def load_model_from_huggingface(llm):
         n_gpu_layers = llm.model_config['gpu_layers'],     # Number of GPU layers
         n_ctx = llm.model_config['context_length'],        # Context window size
         seed = llm.model_config['seed'],                   # Seed
-        temperature = llm.model_config['temperature']      # Sampling temperature
+        temperature = llm.model_config['temperature'],     # Sampling temperature
+        draft_model = create_draft_model(llm.model_config), # Speculative decoding, if set
+        **get_llama_runtime_kwargs(llm.model_config)       # Runtime performance settings
     )
     
     return loaded_llm  # Return the model instance
@@ -0,0 +1,197 @@
+import gc
+import os
+import json
+import time
+import threading
+from llm import Llm
+from llm_pool import LlmPool
+
+# Settings read on every request rather than when the model is loaded, so changing them keeps the loaded model
+REQUEST_SETTINGS = ("temperature", "seed", "use_response_cache")
+
+
+# Memory of this process held in RAM, in bytes, or None where it can't be read
+def get_resident_memory():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# The settings that decide what is loaded. Two configs with the same key load the same model
+def get_config_key(model_config):
+    return json.dumps(sorted((key, str(value)) for key, value in model_config.items() if key not in REQUEST_SETTINGS))
+
+
+def format_bytes(size):
+    return "unknown" if size is None else f"{size / 1024 ** 2:.0f}MB"
+
+
+class LlmModelManager:
+    """
+    Keeps one LLM configuration loaded, with its pool of worker instances, and loads each configuration only once.
+    Requesting the loaded configuration again returns the loaded model, updating any per-request settings in place.
+    Requesting a different one unloads the current model before the new one is loaded, so two are never in memory at once.
+    The time each load took and how much resident memory it added are kept in the load report.
+    """
+
+    def __init__(self):
+        self._llm = None
+        self._llm_pool = None
+        self._config_key = None
+        self._load_report = None
+        self._lock = threading.Lock()
+
+    def load(self, model_config, workers=1):
+        """
+        Return the LLM and pool for the config with the given number of workers, loading it unless it is already loaded.
+        Per-request settings are updated on the loaded instances in place, so this must not run while a job is using them.
+        """
+        with self._lock:
+            config_key = get_config_key(model_config)
+
+            if self._llm is not None and config_key == self._config_key:
+                print("Requested LLM is already loaded")
+
+                for instance in self._llm_pool.instances:
+                    instance.model_config.update(model_config)
+
+                if self._llm_pool.workers != max(1, workers):
+                    self._resize_pool(workers)
+
+                return self._llm, self._llm_pool
+
+            self._unload()
+            self._load(lambda: Llm(dict(model_config)), config_key, workers)
+
+            return self._llm, self._llm_pool
+
+    def get_loaded(self, model_config, workers=1):
+        """
+        Return the loaded LLM if it already has exactly this config, per-request settings included, and number of workers,
+        or None if loading the config would change anything. Never changes what is loaded.
+        """
+        with self._lock:
+            if (
+                self._llm is not None and self._llm_pool.workers == max(1, workers)
+                and all(instance.model_config == model_config for instance in self._llm_pool.instances)
+            ):
+                return self._llm
+
+            return None
+
+    def adopt(self, llm, workers=1):
+        """
+        Manage an LLM that was loaded elsewhere, unloading the current one. Returns its pool.
+        """
+        with self._lock:
+            self._unload()
+            self._load(lambda: llm, get_config_key(llm.model_config), workers)
+
+            return self._llm_pool
+
+    def reload(self):
+        """
+        Unload and load the current configuration again, keeping the number of workers. Must not run while a job is using the model.
+        """
+        with self._lock:
+            if self._llm is None:
+                return None
+
+            model_config = dict(self._llm.model_config)
+            config_key = self._config_key
+            workers = self._llm_pool.workers
+
+            self._unload()
+            self._load(lambda: Llm(model_config), config_key, workers)
+
+            return self._llm
+
+    def unload(self):
+        """
+        Unload the current model, if any. Returns True if a model was unloaded. Must not run while a job is using the model.
+        """
+        with self._lock:
+            return self._unload()
+
+    def _load(self, create_llm, config_key, workers):
+        resident_memory = get_resident_memory()
+        start_time = time.perf_counter()
+
+        llm = create_llm()
+        llm_pool = LlmPool(llm, workers)
+
+        load_time = time.perf_counter() - start_time
+        loaded_resident_memory = get_resident_memory()
+
+        self._llm = llm
+        self._llm_pool = llm_pool
+        self._config_key = config_key
+        self._load_report = {
+            'load_time': load_time,
+            'resident_memory': loaded_resident_memory,
+            'added_resident_memory': None if resident_memory is None or loaded_resident_memory is None else loaded_resident_memory - resident_memory,
+            'instances': len(llm_pool.instances)
+        }
+
+        print(self.format_load_report())
+
+    # Change the number of workers without reloading the model the pool was created from
+    def _resize_pool(self, workers):
+        for instance in self._llm_pool.instances:
+            if instance is not self._llm:
+                instance.unload_model()
+
+        self._llm_pool = None
+        gc.collect()
+
+        start_time = time.perf_counter()
+        self._llm_pool = LlmPool(self._llm, workers)
+        print(f"Resized LLM pool to {self._llm_pool.workers} workers in {time.perf_counter() - start_time:.2f} seconds")
+
+    def _unload(self):
+        if self._llm is None:
+            return False
+
+        resident_memory = get_resident_memory()
+
+        for instance in self._llm_pool.instances:
+            instance.unload_model()
+
+        model_name = self._llm.model_config.get('model_path') or self._llm.model_config.get('model_name')
+        self._llm = None
+        self._llm_pool = None
+        self._config_key = None
+        self._load_report = None
+        gc.collect()
+
+        released_memory = None if resident_memory is None else resident_memory - get_resident_memory()
+        print(f"Unloaded LLM: {model_name}, released {format_bytes(released_memory)}")
+
+        return True
+
+    def format_load_report(self):
+        if self._load_report is None:
+            return "No LLM loaded"
+
+        report = self._load_report
+        model_name = self._llm.model_config.get('model_path') or self._llm.model_config.get('model_name')
+
+        return (
+            f"Loaded LLM {model_name} ({report['instances']} instance{'s' if report['instances'] != 1 else ''}) in {report['load_time']:.2f} seconds, "
+            f"resident memory {format_bytes(report['resident_memory'])} ({format_bytes(report['added_resident_memory'])} added)"
+        )
+
+    @property
+    def llm(self):
+        return self._llm
+
+    @property
+    def llm_pool(self):
+        return self._llm_pool
+
+    @property
+    def load_report(self):
+        # Load time in seconds and resident memory in bytes of the current model, or None if none is loaded
+        return self._load_report
@@ -0,0 +1,53 @@
+import queue
+import contextlib
+from llm import Llm
+from text_generator import Model_Type
+
+
+class LlmPool:
+    """
+    A set of interchangeable LLM instances that several chunks can be sent to at the same time, one chunk per instance.
+    A local model gets a separate Llama instance for each worker. They load the same file with mmap, so the weights
+    are shared in memory, and each only adds its own context. A cloud model shares one instance, as every request is independent.
+    """
+
+    def __init__(self, llm, workers=1):
+        self._llm = llm
+        self._workers = max(1, workers)
+        self._available = queue.Queue()
+
+        if llm.model_config['model_type'] == Model_Type.OPEN_AI:
+            instances = [llm] * self._workers
+        else:
+            instances = [llm] + [Llm(dict(llm.model_config)) for _ in range(self._workers - 1)]
+
+        # Distinct instances, as a cloud model repeats the same one
+        self._instances = list({id(instance): instance for instance in instances}.values())
+
+        for instance in instances:
+            self._available.put(instance)
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """
+        Wait for a free LLM instance and hand it out until the with block ends.
+        """
+        instance = self._available.get()
+
+        try:
+            yield instance
+        finally:
+            self._available.put(instance)
+
+    @property
+    def llm(self):
+        # The instance the pool was created from
+        return self._llm
+
+    @property
+    def instances(self):
+        return self._instances
+
+    @property
+    def workers(self):
+        return self._workers
@@ -0,0 +1,124 @@
+import time
+
+# Shared prompt starts shorter than this aren't worth a snapshot
+MIN_PREFIX_TOKENS = 16
+
+
+class PromptPrefixCache:
+    """
+    Keeps a llama.cpp state snapshot of the start every prompt shares, the system prompt and line identification instructions,
+    so that part is evaluated once per model load rather than once per chunk.
+    The shared start is found by comparing the tokens of the first two prompts. It is then evaluated on its own, timed and
+    snapshotted with save_state. Before each later request the snapshot is restored with load_state if the model's context
+    no longer starts with it, and llama.cpp only evaluates the tokens that follow it.
+    Only requests that used a restored snapshot count towards the time saved. When the context still starts with the
+    prefix, llama.cpp's own prefix matching would have reused it without the snapshot.
+    """
+
+    def __init__(self):
+        self._previous_prompt_tokens = None
+        self._prefix_tokens = None
+        self._state = None
+        self._prefix_eval_seconds = 0.0
+        self._reused_prompts = 0
+        self._restored_prompts = 0
+        self._restored_for_request = False
+
+    def prepare(self, model):
+        """
+        Called before a request: restore the snapshot unless the context already starts with the shared prefix.
+        """
+        self._restored_for_request = False
+
+        if self._state is None:
+            return
+
+        # input_ids is the whole context buffer. Only its first n_tokens are still in the KV cache
+        evaluated_tokens = model.input_ids[:model.n_tokens][:len(self._prefix_tokens)].tolist()
+
+        if evaluated_tokens != self._prefix_tokens:
+            model.load_state(self._state)
+            self._restored_for_request = True
+
+    def record(self, model, prompt_token_count):
+        """
+        Called after a request, while the model's context still holds its prompt.
+        Counts the prompt if it reused the prefix, or finds and snapshots the prefix once two prompts have been seen.
+        """
+        prompt_tokens = model.input_ids[:prompt_token_count].tolist()
+
+        if self._prefix_tokens is not None:
+            if prompt_tokens[:len(self._prefix_tokens)] == self._prefix_tokens:
+                self._reused_prompts += 1
+
+                if self._restored_for_request:
+                    self._restored_prompts += 1
+
+            self._restored_for_request = False
+            return
+
+        if self._previous_prompt_tokens is None:
+            self._previous_prompt_tokens = prompt_tokens
+            return
+
+        prefix_length = get_common_prefix_length(self._previous_prompt_tokens, prompt_tokens)
+
+        # Keep the latest prompt to compare with, in case the first one was a different kind of request
+        if prefix_length < MIN_PREFIX_TOKENS:
+            self._previous_prompt_tokens = prompt_tokens
+            return
+
+        self._snapshot(model, prompt_tokens[:prefix_length])
+
+    def _snapshot(self, model, prefix_tokens):
+        # Evaluate the prefix on its own, timing it, so the snapshot holds nothing after it
+        model.reset()
+
+        start_time = time.perf_counter()
+        model.eval(prefix_tokens)
+        self._prefix_eval_seconds = time.perf_counter() - start_time
+
+        self._state = model.save_state()
+        self._prefix_tokens = prefix_tokens
+        self._previous_prompt_tokens = None
+
+        print(f"Cached the shared prompt prefix: {len(prefix_tokens)} tokens, {self._prefix_eval_seconds:.2f}s to evaluate")
+
+    @property
+    def prefix_token_count(self):
+        return len(self._prefix_tokens) if self._prefix_tokens is not None else 0
+
+    @property
+    def reused_prompts(self):
+        # Prompts that started with the prefix, whether it came from the snapshot or was still in the context
+        return self._reused_prompts
+
+    @property
+    def restored_prompts(self):
+        # Prompts that started with the prefix restored from the snapshot
+        return self._restored_prompts
+
+    @property
+    def saved_seconds(self):
+        # Prompt eval time the snapshot saved. Prompts that found the prefix still in the context don't count
+        return self._restored_prompts * self._prefix_eval_seconds
+
+
+def get_common_prefix_length(first_tokens, second_tokens):
+    length = 0
+
+    for first_token, second_token in zip(first_tokens, second_tokens):
+        if first_token != second_token:
+            break
+        length += 1
+
+    return length
+
+
+# Prompts that reused the prefix, prompts that reused it from a restored snapshot and prompt eval seconds saved, summed over several caches
+def get_prompt_cache_totals(prompt_caches):
+    return (
+        sum(prompt_cache.reused_prompts for prompt_cache in prompt_caches),
+        sum(prompt_cache.restored_prompts for prompt_cache in prompt_caches),
+        sum(prompt_cache.saved_seconds for prompt_cache in prompt_caches)
+    )
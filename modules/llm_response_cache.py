@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+# Folder where LLM responses are cached
+script_dir = Path(__file__).resolve().parent
+DEFAULT_CACHE_FOLDER = (script_dir / ".." / "cache" / "llm_responses").resolve()
+
+# Maximum size of the cache on disk before the least recently used responses are evicted
+DEFAULT_CACHE_SIZE_LIMIT = 1024 ** 3
+
+# Identifies how requests are built from a prompt (system prompt, response format, API call).
+# Change it whenever text_generator sends requests differently, so responses to the old requests aren't reused
+PROMPT_VERSION = 1
+
+# Bytes read from each end of a model file to identify it. Hashing a whole model of several GB would take longer than many requests
+MODEL_HASH_SAMPLE_BYTES = 16 * 1024 ** 2
+
+
+class LlmResponseCache:
+    """
+    On-disk cache of LLM responses, keyed by a hash of the model, prompt version, schema, prompt, temperature and seed,
+    so running line identification again on the same text, such as after a crash or with a different section range,
+    doesn't ask the LLM again. diskcache is only imported once the first response is looked up.
+    """
+
+    def __init__(self, cache_folder=DEFAULT_CACHE_FOLDER, size_limit=DEFAULT_CACHE_SIZE_LIMIT):
+        self._cache_folder = cache_folder
+        self._size_limit = size_limit
+        self._cache = None
+        self._model_hashes = {}  # model path -> (size, modified time, hash)
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, prompt, llm, schema, attempt=0):
+        """
+        Build the cache key for a request. attempt numbers the requests a caller makes for the same prompt, as a retry
+        wants a new response rather than the one it rejected, while a later run replays the same responses in order.
+        """
+        model_config = llm.model_config
+
+        key_source = json.dumps([
+            self.get_model_hash(llm),
+            PROMPT_VERSION,
+            hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest(),
+            prompt,
+            model_config.get('temperature'),
+            model_config.get('seed'),
+            attempt
+        ])
+
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached response for the key, or None if it has not been cached.
+        """
+        value = self._get_cache().get(key)
+
+        with self._lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+
+        return value
+
+    def set(self, key, response):
+        self._get_cache().set(key, response)
+
+    def get_model_hash(self, llm):
+        """
+        Identify the model: a hash of the size and both ends of a local model file, recomputed only when the file changes,
+        or the model name of a cloud model.
+        """
+        model_config = llm.model_config
+        model_path = getattr(llm.model, "model_path", None) or model_config.get('model_path')
+
+        if model_path is None or not os.path.isfile(model_path):
+            return "|".join(str(model_config.get(key)) for key in ('model_type', 'repo_id', 'model_path', 'model_name'))
+
+        stat = os.stat(model_path)
+
+        with self._lock:
+            cached = self._model_hashes.get(model_path)
+
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        model_hash = hashlib.sha256(str(stat.st_size).encode("utf-8"))
+
+        with open(model_path, "rb") as file:
+            model_hash.update(file.read(MODEL_HASH_SAMPLE_BYTES))
+            file.seek(max(0, stat.st_size - MODEL_HASH_SAMPLE_BYTES))
+            model_hash.update(file.read(MODEL_HASH_SAMPLE_BYTES))
+
+        with self._lock:
+            self._model_hashes[model_path] = (stat.st_size, stat.st_mtime_ns, model_hash.hexdigest())
+
+        return model_hash.hexdigest()
+
+    def stats(self):
+        """
+        Return the hit/miss counts for this process and the current size of the cache.
+        """
+        with self._lock:
+            hits = self._hits
+            misses = self._misses
+
+        lookups = hits + misses
+        cache = self._get_cache()
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups > 0 else 0.0,
+            "entries": len(cache),
+            "size_bytes": cache.volume()
+        }
+
+    def clear(self):
+        self._get_cache().clear()
+
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
+
+    def _get_cache(self):
+        with self._lock:
+            if self._cache is None:
+                from diskcache import Cache
+                self._cache = Cache(str(self._cache_folder), size_limit=self._size_limit, eviction_policy="least-recently-used")
+
+            return self._cache
+
+    def __str__(self):
+        stats = self.stats()
+        return (
+            f"LlmResponseCache(hits={stats['hits']}, misses={stats['misses']}, hit_rate={stats['hit_rate']:.1%}, "
+            f"entries={stats['entries']}, size={stats['size_bytes'] / (1024 ** 2):.1f}MB)"
+        )
@@ -0,0 +1,153 @@
+import os
+import json
+from pathlib import Path
+
+# Runtime settings of a local model. They change how fast llama.cpp runs and how much memory it uses, not what it generates.
+# A thread count of None keeps the llama.cpp default: half the CPUs for generation and all of them for prompt processing
+script_dir = Path(__file__).resolve().parent
+
+# Where the autotune benchmark saves the best profile found on this machine
+DEFAULT_RUNTIME_PROFILE_PATH = (script_dir / ".." / "cache" / "llm_runtime_profile.json").resolve()
+
+# KV cache types and their ggml type ids, passed to llama.cpp as type_k and type_v
+KV_CACHE_TYPES = {
+    "f16": 1,
+    "q8_0": 8,
+    "q4_0": 2
+}
+
+RUNTIME_SETTINGS = ["n_threads", "n_threads_batch", "n_batch", "n_ubatch", "use_mmap", "use_mlock", "flash_attn", "kv_cache_type"]
+
+
+# The llama.cpp defaults
+def get_default_runtime_profile():
+    return {
+        'n_threads': None,         # Threads used to generate tokens
+        'n_threads_batch': None,   # Threads used to process the prompt
+        'n_batch': 512,            # Prompt tokens submitted to llama.cpp at a time
+        'n_ubatch': 512,           # Prompt tokens computed at a time, at most n_batch
+        'use_mmap': True,          # Map the model file into memory instead of reading it, so instances share the weights
+        'use_mlock': False,        # Lock the model in RAM so it is never swapped out
+        'flash_attn': False,       # Flash attention, needed for a quantized V cache
+        'kv_cache_type': "f16"     # Type of the keys and values kept in the context
+    }
+
+
+# Logical CPUs this process may run on, and an estimate of the physical cores behind them
+def get_cpu_counts():
+    logical_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return logical_cpus, max(1, logical_cpus // 2)
+
+
+# Named starting points. Settings passed alongside a preset override it
+def get_runtime_presets():
+    logical_cpus, physical_cores = get_cpu_counts()
+
+    presets = {
+        # llama.cpp's own defaults
+        "default": {},
+        # Generation on each physical core and prompt processing on every CPU, with larger prompt batches
+        "cpu_throughput": {'n_threads': physical_cores, 'n_threads_batch': logical_cpus, 'n_batch': 1024, 'n_ubatch': 512},
+        # Half size KV cache and smaller prompt batches, for long contexts or several workers on little memory
+        "low_memory": {'n_batch': 256, 'n_ubatch': 256, 'flash_attn': True, 'kv_cache_type': "q8_0"},
+        # Large prompt batches and flash attention for models offloaded to the GPU
+        "gpu": {'n_batch': 2048, 'n_ubatch': 512, 'flash_attn': True}
+    }
+
+    # The profile the autotune benchmark saved on this machine, if it has been run
+    if DEFAULT_RUNTIME_PROFILE_PATH.exists():
+        presets["autotuned"] = load_runtime_profile(DEFAULT_RUNTIME_PROFILE_PATH)
+
+    return presets
+
+
+def get_runtime_profile(preset="default", **settings):
+    """
+    Build a runtime profile from a preset and any settings overriding it. Settings given as None keep the preset's value.
+    Raises ValueError for an unknown preset or invalid settings.
+    """
+    presets = get_runtime_presets()
+
+    if preset not in presets:
+        raise ValueError(f"Invalid LLM runtime preset: {preset}. Options: {', '.join(presets)}")
+
+    profile = dict(get_default_runtime_profile(), **presets[preset])
+
+    for key, value in settings.items():
+        if key not in RUNTIME_SETTINGS:
+            raise ValueError(f"Invalid LLM runtime setting: {key}. Options: {', '.join(RUNTIME_SETTINGS)}")
+
+        if value is not None:
+            profile[key] = value
+
+    validate_runtime_profile(profile)
+
+    return profile
+
+
+def validate_runtime_profile(profile):
+    """
+    Raise ValueError if llama.cpp would refuse the profile or silently ignore part of it.
+    """
+    for key in ("n_threads", "n_threads_batch"):
+        if profile[key] is not None and (not isinstance(profile[key], int) or profile[key] < 1):
+            raise ValueError(f"{key} must be a positive whole number, or None for the llama.cpp default")
+
+    for key in ("n_batch", "n_ubatch"):
+        if not isinstance(profile[key], int) or profile[key] < 1:
+            raise ValueError(f"{key} must be a positive whole number")
+
+    if profile['n_ubatch'] > profile['n_batch']:
+        raise ValueError(f"n_ubatch ({profile['n_ubatch']}) can't be larger than n_batch ({profile['n_batch']})")
+
+    if profile['kv_cache_type'] not in KV_CACHE_TYPES:
+        raise ValueError(f"Invalid KV cache type: {profile['kv_cache_type']}. Options: {', '.join(KV_CACHE_TYPES)}")
+
+    # llama.cpp can only quantize the V cache with flash attention
+    if profile['kv_cache_type'] != "f16" and not profile['flash_attn']:
+        raise ValueError(f"A {profile['kv_cache_type']} KV cache needs flash attention")
+
+
+# Keyword arguments for Llama from the runtime settings in a model config. Missing settings keep the llama.cpp defaults
+def get_llama_runtime_kwargs(model_config):
+    profile = dict(get_default_runtime_profile(), **{key: model_config[key] for key in RUNTIME_SETTINGS if key in model_config})
+    kv_cache_type = KV_CACHE_TYPES[profile['kv_cache_type']]
+
+    kwargs = {
+        'n_batch': profile['n_batch'],
+        'n_ubatch': profile['n_ubatch'],
+        'use_mmap': profile['use_mmap'],
+        'use_mlock': profile['use_mlock'],
+        'flash_attn': profile['flash_attn'],
+        'type_k': kv_cache_type,
+        'type_v': kv_cache_type
+    }
+
+    for key in ("n_threads", "n_threads_batch"):
+        if profile[key] is not None:
+            kwargs[key] = profile[key]
+
+    return kwargs
+
+
+def save_runtime_profile(profile, path=DEFAULT_RUNTIME_PROFILE_PATH, results=None):
+    """
+    Save a runtime profile as JSON, with the measurements it was chosen from, if any.
+    """
+    validate_runtime_profile(profile)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"profile": profile, "results": results or []}, file, indent=2)
+
+
+# The settings of a saved runtime profile
+def load_runtime_profile(path=DEFAULT_RUNTIME_PROFILE_PATH):
+    with open(path, encoding="utf-8") as file:
+        profile = json.load(file)["profile"]
+
+    profile = {key: value for key, value in profile.items() if key in RUNTIME_SETTINGS}
+    validate_runtime_profile(dict(get_default_runtime_profile(), **profile))
+
+    return profile
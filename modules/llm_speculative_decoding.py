@@ -0,0 +1,149 @@
+# Speculative decoding for local models: a cheap drafter proposes the next few tokens and the model checks them all in one
+# batch, keeping the ones it agrees with. Line identification output is mostly copied from the prompt, so most drafts are kept
+
+SPECULATIVE_MODES = ["none", "prompt_lookup", "draft_model"]
+
+# Tokens drafted at a time
+DEFAULT_SPECULATIVE_TOKENS = 10
+
+
+def create_draft_model(model_config):
+    """
+    Build the draft_model for Llama from the model config, or None if speculative decoding is off.
+    "prompt_lookup" drafts by finding the latest tokens earlier in the prompt and proposing what followed them.
+    "draft_model" runs a small GGUF model, which must share the main model's vocabulary, such as a smaller model of the same family.
+    """
+    speculative_mode = model_config.get('speculative_mode', "none")
+    speculative_tokens = model_config.get('speculative_tokens', DEFAULT_SPECULATIVE_TOKENS)
+    validate_speculative_tokens(speculative_tokens)
+
+    if speculative_mode == "none":
+        return None
+
+    elif speculative_mode == "prompt_lookup":
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+        return DraftAcceptanceCounter(LlamaPromptLookupDecoding(num_pred_tokens=speculative_tokens))
+
+    elif speculative_mode == "draft_model":
+        if not model_config.get('draft_model_path'):
+            raise ValueError("A draft model path is needed for draft model speculative decoding")
+
+        return DraftAcceptanceCounter(create_gguf_draft_model(model_config['draft_model_path'], speculative_tokens, model_config['context_length'], model_config['gpu_layers']))
+
+    else:
+        raise ValueError(f"Invalid speculative decoding mode: {speculative_mode}. Options: {', '.join(SPECULATIVE_MODES)}")
+
+
+# Raise ValueError for a number of drafted tokens that would silently draft nothing
+def validate_speculative_tokens(speculative_tokens):
+    if not isinstance(speculative_tokens, int) or speculative_tokens < 1:
+        raise ValueError(f"The number of speculative tokens must be at least 1, got {speculative_tokens}")
+
+
+class DraftAcceptanceCounter:
+    """
+    Wraps a draft model and counts the tokens it drafts and how many of them the main model accepted.
+    Llama only reports the tokens it generates, so the accepted tokens of a draft are found on the next call,
+    by comparing the draft with the tokens that followed the same context.
+    """
+
+    def __init__(self, draft_model):
+        self._draft_model = draft_model
+        self._last_input_ids = None
+        self._last_draft_ids = None
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        self._count_accepted(input_ids)
+
+        draft_ids = self._draft_model(input_ids, **kwargs)
+
+        self._last_input_ids = input_ids.copy()
+        self._last_draft_ids = draft_ids
+        self.drafted_tokens += len(draft_ids)
+
+        return draft_ids
+
+    def _count_accepted(self, input_ids):
+        if self._last_draft_ids is None or len(self._last_draft_ids) == 0:
+            return
+
+        context_length = len(self._last_input_ids)
+
+        # A new prompt doesn't continue the last draft's context, so none of that draft was used
+        if len(input_ids) <= context_length or (input_ids[:context_length] != self._last_input_ids).any():
+            return
+
+        for draft_id, input_id in zip(self._last_draft_ids, input_ids[context_length:]):
+            if draft_id != input_id:
+                break
+            self.accepted_tokens += 1
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted_tokens / self.drafted_tokens if self.drafted_tokens > 0 else 0.0
+
+    def close(self):
+        if hasattr(self._draft_model, "close"):
+            self._draft_model.close()
+
+
+def create_gguf_draft_model(draft_model_path, speculative_tokens, context_length, gpu_layers):
+    # llama_cpp is only imported once a model is loaded, so the class is defined here
+    import numpy as np
+    import llama_cpp
+    from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaDraftModel
+
+    class GgufDraftModel(LlamaDraftModel):
+        """
+        Drafts tokens by greedy decoding with a small model. The tokens it has already evaluated are kept between calls,
+        so each call only evaluates what the main model accepted since the last one.
+        Llama only keeps the logits of every token in scores when built with logits_all, which would hold n_ctx rows of
+        the vocabulary, so the logits of the last evaluated token are read from the context instead.
+        """
+
+        def __init__(self):
+            self._model = Llama(model_path=draft_model_path, n_ctx=context_length, n_gpu_layers=gpu_layers, verbose=False)
+
+        def __call__(self, input_ids, /, **kwargs):
+            input_ids = input_ids.tolist()
+            # input_ids is the whole context buffer. Only its first n_tokens are still in the KV cache
+            evaluated_ids = self._model.input_ids[:self._model.n_tokens].tolist()
+
+            # Keep the longest evaluated prefix, always evaluating at least the last token to get its logits
+            prefix_length = 0
+            for evaluated_id, input_id in zip(evaluated_ids, input_ids[:-1]):
+                if evaluated_id != input_id:
+                    break
+                prefix_length += 1
+
+            self._model.n_tokens = prefix_length
+            self._model.eval(input_ids[prefix_length:])
+
+            draft_ids = []
+            max_draft_tokens = min(speculative_tokens, self._model.n_ctx() - self._model.n_tokens - 1)
+
+            for _ in range(max(0, max_draft_tokens)):
+                draft_id = int(np.argmax(self._get_last_logits()))
+
+                if draft_id == self._model.token_eos():
+                    break
+
+                draft_ids.append(draft_id)
+                self._model.eval([draft_id])
+
+            return np.array(draft_ids, dtype=np.intc)
+
+        def _get_last_logits(self):
+            logits = llama_cpp.llama_get_logits_ith(self._model.ctx, -1)
+            return np.ctypeslib.as_array(logits, shape=(self._model.n_vocab(),))
+
+        def close(self):
+            # Free the small model along with the main one
+            if self._model is not None:
+                self._model.close()
+                self._model = None
+
+    return GgufDraftModel()
@@ -0,0 +1,253 @@
+import os
+import time
+import secrets
+import threading
+import traceback
+from pathlib import Path
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+# The daemon only listens on this machine
+DAEMON_HOST = "127.0.0.1"
+DEFAULT_DAEMON_PORT = 7861
+
+# Seconds between progress updates sent to a client while its jobs run
+PROGRESS_INTERVAL = 2.0
+
+# Seconds between checks for finished jobs
+JOB_POLL_INTERVAL = 0.2
+
+
+# Path of the secret a daemon's clients authenticate with. Only the user who started the daemon can read it
+def get_authkey_path(port):
+    return Path.home() / f".audiobook_generator_daemon_{port}.key"
+
+
+# Create a new secret for a daemon, replacing any left over from a previous one
+def create_authkey(port):
+    authkey = secrets.token_bytes(32)
+    authkey_path = get_authkey_path(port)
+
+    file_descriptor = os.open(authkey_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, "wb") as file:
+        file.write(authkey)
+
+    return authkey
+
+
+def read_authkey(port):
+    authkey_path = get_authkey_path(port)
+
+    if not authkey_path.exists():
+        raise Exception(f"No model daemon is running on port {port}. Start one with: python modules/run_cli.py --daemon")
+
+    return authkey_path.read_bytes()
+
+
+# Job status that can be sent to a client, whatever the job's result is
+def get_sendable_job_status(job):
+    status = job.get_status()
+    status["summary"] = str(job)
+
+    if status["result"] is not None and not isinstance(status["result"], (str, int, float, bool)):
+        status["result"] = str(status["result"])
+
+    return status
+
+
+class ModelDaemon:
+    """
+    Keeps a Session, with its LLM and TTS models loaded, running in the background and runs the jobs clients send to it,
+    so scripted CLI runs don't each pay for loading the models. Every client is served on its own thread and its jobs go
+    through the session's job scheduler, so jobs from several clients can be in flight at once.
+    Clients connect over localhost and authenticate with a secret the daemon writes to the user's home folder.
+    """
+
+    def __init__(self, session, port=DEFAULT_DAEMON_PORT):
+        self._session = session
+        self._port = port
+        self._stop_event = threading.Event()
+        self._llm_lock = threading.Lock()
+
+    def serve_forever(self):
+        """
+        Accept clients until a client asks the daemon to shut down, or Ctrl+C is pressed.
+        """
+        authkey = create_authkey(self._port)
+
+        try:
+            with Listener((DAEMON_HOST, self._port), authkey=authkey) as listener:
+                print(f"Model daemon listening on {DAEMON_HOST}:{self._port}")
+
+                while not self._stop_event.is_set():
+                    try:
+                        connection = listener.accept()
+                    except (AuthenticationError, EOFError, OSError) as e:
+                        print(f"Rejected model daemon connection: {e}")
+                        continue
+
+                    threading.Thread(target=self._serve_client, args=(connection,), name="model-daemon-client", daemon=True).start()
+
+        except KeyboardInterrupt:
+            print("Model daemon interrupted")
+
+        finally:
+            get_authkey_path(self._port).unlink(missing_ok=True)
+            self._session.job_scheduler.shutdown()
+
+        print("Model daemon stopped")
+
+    def _serve_client(self, connection):
+        with connection:
+            try:
+                request = connection.recv()
+                command = request.get("command")
+
+                if command == "ping":
+                    connection.send({"type": "pong", "pid": os.getpid()})
+
+                elif command == "load_llm":
+                    connection.send({"type": "llm", "llm": self._load_llm(request["kwargs"])})
+
+                elif command == "set_cloud_llm":
+                    connection.send({"type": "llm", "llm": str(self._session.set_cloud_llm(**request["kwargs"]))})
+
+                elif command == "submit":
+                    self._run_jobs(connection, request["jobs"])
+
+                elif command == "cancel":
+                    connection.send({"type": "cancelled", "cancelled": self._session.cancel_job(request["job_id"])})
+
+                elif command == "shutdown":
+                    connection.send({"type": "shutdown"})
+                    self._shutdown()
+
+                else:
+                    connection.send({"type": "error", "error": f"Unknown command: {command}"})
+
+            except (EOFError, ConnectionError):
+                # The client went away. Its jobs carry on unless it cancelled them
+                pass
+
+            except Exception as e:
+                traceback.print_exc()
+
+                try:
+                    connection.send({"type": "error", "error": str(e)})
+                except (EOFError, ConnectionError, OSError):
+                    pass
+
+    # Load the local LLM. The session's model manager keeps it loaded if it has the same settings, so it stays warm between runs
+    def _load_llm(self, llm_kwargs):
+        from text_generator import Model_Type
+
+        llm_kwargs = dict(llm_kwargs, model_type=Model_Type[llm_kwargs["model_type"]])
+
+        with self._llm_lock:
+            llm = self._session.set_and_load_llm(**llm_kwargs)
+            return f"{llm}\n{self._session.llm_model_manager.format_load_report()}"
+
+    # Submit the client's jobs and send their status until they have all finished.
+    # Each job request is a dict of task, kwargs and depends_on, the indices of earlier jobs in the same request
+    def _run_jobs(self, connection, job_requests):
+        jobs = []
+
+        for job_request in job_requests:
+            depends_on = [jobs[index] for index in job_request.get("depends_on", [])]
+            jobs.append(self._session.submit_task(job_request["task"], job_request["kwargs"], depends_on))
+
+        connection.send({"type": "submitted", "jobs": [get_sendable_job_status(job) for job in jobs]})
+        last_update_time = time.time()
+
+        while not all(job.is_finished for job in jobs):
+            time.sleep(JOB_POLL_INTERVAL)
+
+            if time.time() - last_update_time >= PROGRESS_INTERVAL:
+                connection.send({"type": "progress", "jobs": [get_sendable_job_status(job) for job in jobs]})
+                last_update_time = time.time()
+
+        connection.send({"type": "done", "jobs": [get_sendable_job_status(job) for job in jobs]})
+
+    def _shutdown(self):
+        self._stop_event.set()
+
+        # Wake the listener up from waiting for the next client, so it sees the daemon is stopping
+        try:
+            Client((DAEMON_HOST, self._port), authkey=read_authkey(self._port)).close()
+        except Exception:
+            pass
+
+
+class DaemonClient:
+    """
+    Sends requests to a running ModelDaemon. Each request uses its own connection.
+    """
+
+    def __init__(self, port=DEFAULT_DAEMON_PORT):
+        self._port = port
+
+    def ping(self):
+        return self._request({"command": "ping"})
+
+    def load_llm(self, **llm_kwargs):
+        """
+        Load a local LLM in the daemon, with the arguments of Session.set_and_load_llm and model_type given by name.
+        Nothing is loaded if the daemon already has the same model loaded.
+        """
+        return self._request({"command": "load_llm", "kwargs": llm_kwargs})["llm"]
+
+    def set_cloud_llm(self, **llm_kwargs):
+        return self._request({"command": "set_cloud_llm", "kwargs": llm_kwargs})["llm"]
+
+    def cancel(self, job_id):
+        return self._request({"command": "cancel", "job_id": job_id})["cancelled"]
+
+    def shutdown(self):
+        return self._request({"command": "shutdown"})
+
+    def run_jobs(self, job_requests, on_update=None):
+        """
+        Submit jobs to the daemon and wait for them to finish, returning the final status of each.
+        on_update(message_type, job_statuses) is called when the jobs are submitted, as they progress and when they finish.
+        Ctrl+C cancels the jobs in the daemon.
+        """
+        with self._connect() as connection:
+            connection.send({"command": "submit", "jobs": job_requests})
+            job_ids = []
+
+            while True:
+                try:
+                    message = connection.recv()
+                except KeyboardInterrupt:
+                    print("\nCancelling jobs...")
+
+                    for job_id in job_ids:
+                        self.cancel(job_id)
+
+                    continue
+
+                if message["type"] == "error":
+                    raise Exception(f"Model daemon error: {message['error']}")
+
+                job_ids = [status["id"] for status in message["jobs"]]
+
+                if on_update is not None:
+                    on_update(message["type"], message["jobs"])
+
+                if message["type"] == "done":
+                    return message["jobs"]
+
+    def _request(self, message):
+        with self._connect() as connection:
+            connection.send(message)
+            reply = connection.recv()
+
+        if reply["type"] == "error":
+            raise Exception(f"Model daemon error: {reply['error']}")
+
+        return reply
+
+    def _connect(self):
+        try:
+            return Client((DAEMON_HOST, self._port), authkey=read_authkey(self._port))
+        except ConnectionRefusedError:
+            raise Exception(f"Could not connect to the model daemon on port {self._port}. Start one with: python modules/run_cli.py --daemon")
@@ -0,0 +1,52 @@
+import re
+
+# Marks of dialogue in a paragraph: double and angle quotation marks anywhere, single quotation marks only where they open a
+# word as they are also apostrophes, and a dash opening the paragraph as some books mark dialogue that way
+DIALOGUE_PATTERN = re.compile(r'["“”„«»‹›]|(?:^|\s)[\'‘’]\w|^\s*[—–]')
+
+# Narration paragraphs before and after dialogue that still go to the LLM, so it can see who is speaking
+CONTEXT_PARAGRAPHS = 1
+
+
+# Paragraphs of a text, and the separator that joins them back together. Text files separate paragraphs with blank lines
+# and may wrap the lines within one, while the EPUB reader puts each paragraph on its own line without blank lines
+def split_into_paragraphs(text):
+    text = text.replace("\r\n", "\n").replace("\r", "\n").strip()  # Normalize line endings
+
+    if re.search(r'\n\s*\n', text):
+        return [paragraph for paragraph in re.split(r'\n\s*\n', text) if paragraph.strip()], "\n\n"
+
+    return [line for line in text.split("\n") if line.strip()], "\n"
+
+
+def split_narration_and_dialogue(text):
+    """
+    Split text into segments of whole paragraphs, in order, as (needs_llm, segment text).
+    Paragraphs with dialogue, and the narration next to them, need the LLM to tell the speakers apart.
+    Runs of paragraphs without any dialogue can only be narration, so they are labelled without it.
+    """
+    paragraphs, separator = split_into_paragraphs(text)
+
+    has_dialogue = [DIALOGUE_PATTERN.search(paragraph) is not None for paragraph in paragraphs]
+    needs_llm = list(has_dialogue)
+
+    for i, paragraph_has_dialogue in enumerate(has_dialogue):
+        if paragraph_has_dialogue:
+            for j in range(max(0, i - CONTEXT_PARAGRAPHS), min(len(paragraphs), i + CONTEXT_PARAGRAPHS + 1)):
+                needs_llm[j] = True
+
+    segments = []
+
+    for paragraph, paragraph_needs_llm in zip(paragraphs, needs_llm):
+        if segments and segments[-1][0] == paragraph_needs_llm:
+            segments[-1][1].append(paragraph)
+        else:
+            segments.append((paragraph_needs_llm, [paragraph]))
+
+    return [(segment_needs_llm, separator.join(segment_paragraphs)) for segment_needs_llm, segment_paragraphs in segments]
+
+
+# Lines for a narration-only segment, one per paragraph, as the LLM would label them
+def get_narration_lines(segment_text):
+    paragraphs, _ = split_into_paragraphs(segment_text)
+    return [{"line": paragraph, "speaker": "Narrator"} for paragraph in paragraphs]
@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+
+# Folder inside a book folder where audio generation progress is recorded
+MANIFEST_FOLDER_NAME = "progress_manifest"
+
+
+class ProgressManifest:
+    """
+    Records which chapters and lines of a multi-speaker book have finished audio generation, so an interrupted run can resume.
+    Each chapter has its own small JSON file, so parallel workers never write to the same file.
+    Every write goes to a temporary file that is then moved into place, so a crash never leaves a half-written record.
+    """
+
+    def __init__(self, book_folder_path):
+        self._manifest_folder = Path(book_folder_path) / MANIFEST_FOLDER_NAME
+
+    def get_chapter_progress(self, chapter_index):
+        """
+        Return the recorded progress for a chapter, or None if nothing has been recorded.
+        """
+        chapter_file = self._get_chapter_file(chapter_index)
+
+        if not chapter_file.exists():
+            return None
+
+        try:
+            with open(chapter_file, "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Could not read progress for chapter {chapter_index}, it will be regenerated: {e}")
+            return None
+
+    def is_chapter_complete(self, chapter_index, lines_hash):
+        progress = self.get_chapter_progress(chapter_index)
+        return progress is not None and progress["complete"] and progress["lines_hash"] == lines_hash
+
+    def get_lines_completed(self, chapter_index, lines_hash):
+        """
+        Return (lines completed, audio bytes written) for a partly generated chapter, or (0, 0) if it has to start again.
+        Progress is discarded if the chapter's lines have changed since it was recorded.
+        """
+        progress = self.get_chapter_progress(chapter_index)
+
+        if progress is None or progress["complete"] or progress["lines_hash"] != lines_hash:
+            return 0, 0
+
+        return progress["lines_completed"], progress["data_size"]
+
+    def mark_lines_completed(self, chapter_index, lines_hash, lines_completed, total_lines, data_size):
+        self._write(chapter_index, {
+            "complete": False,
+            "lines_hash": lines_hash,
+            "lines_completed": lines_completed,
+            "total_lines": total_lines,
+            "data_size": data_size
+        })
+
+    def mark_chapter_complete(self, chapter_index, lines_hash, total_lines):
+        self._write(chapter_index, {
+            "complete": True,
+            "lines_hash": lines_hash,
+            "lines_completed": total_lines,
+            "total_lines": total_lines,
+            "data_size": None
+        })
+
+    def reset_chapter(self, chapter_index):
+        chapter_file = self._get_chapter_file(chapter_index)
+
+        if chapter_file.exists():
+            chapter_file.unlink()
+
+    def _get_chapter_file(self, chapter_index):
+        return self._manifest_folder / f"chapter_{chapter_index}.json"
+
+    def _write(self, chapter_index, progress):
+        self._manifest_folder.mkdir(parents=True, exist_ok=True)
+
+        chapter_file = self._get_chapter_file(chapter_index)
+        temp_file = chapter_file.with_suffix(".tmp")
+
+        with open(temp_file, "w") as f:
+            json.dump(progress, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_file, chapter_file)
+
+
+# Hash of a chapter's lines and voices, used to detect when recorded progress no longer matches the chapter
+def get_lines_hash(lines, voices):
+    return hashlib.sha256(json.dumps([lines, voices]).encode("utf-8")).hexdigest()
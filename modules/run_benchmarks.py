@@ -0,0 +1,159 @@
+import argparse
+import sys
+from pathlib import Path
+
+script_dir = Path(__file__).resolve().parent
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark parts of the audiobook pipeline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", help="Benchmark to run.")
+
+    # Text normalization before synthesis
+    text_normalizer_parser = subparsers.add_parser("text_normalizer", help="Check the text normalizer matches the original preprocessing and measure lines/second.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    text_normalizer_parser.add_argument("--input_file", type=str, default=None, help="Optional UTF-8 text file whose lines are checked and benchmarked.")
+    text_normalizer_parser.add_argument("--lines", type=int, default=20000, help="Number of generated lines to benchmark when no input file is given.")
+    text_normalizer_parser.add_argument("--fuzz_lines", type=int, default=20000, help="Number of random lines checked for identical output.")
+    text_normalizer_parser.add_argument("--repeats", type=int, default=5, help="Number of timed runs, the best is reported.")
+    text_normalizer_parser.add_argument("--seed", type=int, default=0, help="Seed for the generated lines.")
+
+    # Real-time factor of the TTS model, with and without the fast CPU profile
+    tts_inference_parser = subparsers.add_parser("tts_inference", help="Measure the TTS real-time factor with the default loading and the fast CPU profile.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    tts_inference_parser.add_argument("--voice", type=str, required=True, help="Voice file used for synthesis.")
+    tts_inference_parser.add_argument("--text", type=str, default=None, help="Text to synthesize. Default is a fixed passage of about 250 characters.")
+    tts_inference_parser.add_argument("--runs", type=int, default=3, help="Number of timed runs, the best is reported.")
+    tts_inference_parser.add_argument("--intra_op_threads", type=int, default=None, help="Intra-op threads for the fast CPU profile.")
+    tts_inference_parser.add_argument("--inter_op_threads", type=int, default=None, help="Inter-op threads for the fast CPU profile.")
+    tts_inference_parser.add_argument("--torch_compile", action="store_true", help="Also compile the vocoder in the fast CPU profile.")
+
+    # Per-job latency of cold CLI runs compared with jobs sent to the resident model daemon
+    model_daemon_parser = subparsers.add_parser("model_daemon", help="Compare per-job latency of cold CLI runs with jobs sent to the model daemon.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    model_daemon_parser.add_argument("--voice", type=str, required=True, help="Voice file used for synthesis.")
+    model_daemon_parser.add_argument("--text", type=str, default=None, help="Text synthesized by each job. Default is a short fixed sentence.")
+    model_daemon_parser.add_argument("--jobs", type=int, default=5, help="Number of jobs run each way.")
+    model_daemon_parser.add_argument("--port", type=int, default=7862, help="Localhost port for the benchmark's daemon.")
+    model_daemon_parser.add_argument("--llm_model_path", type=str, default=None, help="Optional local LLM. If given, each job also identifies the lines of the text.")
+
+    # Import time of each entry point, failing if one imports a heavy library too early or goes over its budget
+    startup_parser = subparsers.add_parser("startup", help="Measure python -X importtime cost of each entry point against its budget.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    startup_parser.add_argument("--targets", type=str, nargs="+", default=None, help="Entry points to measure: cli_help, benchmarks_help, identify_lines, generate_audio, ui. Default is all.")
+    startup_parser.add_argument("--repeats", type=int, default=5, help="Number of runs of each entry point, the best is reported.")
+    startup_parser.add_argument("--threshold_scale", type=float, default=1.0, help="Multiply every import time budget by this, for slower machines.")
+
+    # Line identification chunks sized by characters compared with chunks sized by the model's tokens
+    chunking_parser = subparsers.add_parser("chunking", help="Compare chunk count, context fill and expected overflows of character and token chunking.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    chunking_parser.add_argument("--input_file", type=str, required=True, help="Book (.txt or .epub) to split into chunks.")
+    chunking_parser.add_argument("--llm_model_path", type=str, required=True, help="Local GGUF model whose tokenizer counts the tokens. Only the tokenizer is loaded.")
+    chunking_parser.add_argument("--context_length", type=int, default=4096, help="Context length of the model.")
+
+    # Tokens generated per section when the LLM copies each line's text compared with labelling numbered sentences
+    line_formats_parser = subparsers.add_parser("line_formats", help="Compare tokens generated per section by each line identification output format.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    line_formats_parser.add_argument("--input_file", type=str, required=True, help="Book (.txt or .epub) whose first sections are identified.")
+    line_formats_parser.add_argument("--llm_model_path", type=str, required=True, help="Local GGUF model used for line identification.")
+    line_formats_parser.add_argument("--sections", type=int, default=1, help="Number of sections identified with each format.")
+    line_formats_parser.add_argument("--context_length", type=int, default=4096, help="Context length of the model.")
+    line_formats_parser.add_argument("--gpu_layers", type=int, default=0, help="Number of layers offloaded to the GPU.")
+
+    # Share of each section the narration pre-pass labels without the LLM, on the text the file reader returns
+    narration_parser = subparsers.add_parser("narration_prepass", help="Check the narration pre-pass splits a book's sections into paragraphs and report how much skips the LLM.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    narration_parser.add_argument("--input_file", type=str, required=True, help="Book (.txt or .epub) read with the same reader as line identification.")
+
+    # Tokens per second of line identification with and without speculative decoding
+    speculative_parser = subparsers.add_parser("speculative_decoding", help="Compare line identification tokens/second with each speculative decoding mode.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    speculative_parser.add_argument("--input_file", type=str, required=True, help="Book (.txt or .epub) whose first section is identified.")
+    speculative_parser.add_argument("--llm_model_path", type=str, required=True, help="Local GGUF model used for line identification.")
+    speculative_parser.add_argument("--modes", type=str, nargs="+", default=["none", "prompt_lookup"], help="Speculative decoding modes to compare: none, prompt_lookup, draft_model. The first is the baseline.")
+    speculative_parser.add_argument("--draft_model_path", type=str, default=None, help="Small GGUF model sharing the LLM's vocabulary, for the draft_model mode.")
+    speculative_parser.add_argument("--speculative_tokens", type=int, default=10, help="Number of tokens drafted at a time.")
+    speculative_parser.add_argument("--context_length", type=int, default=4096, help="Context length of the model.")
+    speculative_parser.add_argument("--gpu_layers", type=int, default=0, help="Number of layers offloaded to the GPU.")
+    speculative_parser.add_argument("--line_output_format", type=str, default="text", help="Line identification output format: text or sentence_index.")
+
+    # Fastest llama.cpp threads and batch sizes on this machine, saved as the autotuned runtime profile
+    autotune_parser = subparsers.add_parser("llm_autotune", help="Measure llama.cpp thread counts and batch sizes for a model and save the fastest as the autotuned runtime profile.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    autotune_parser.add_argument("--llm_model_path", type=str, required=True, help="Local GGUF model to tune for.")
+    autotune_parser.add_argument("--context_length", type=int, default=4096, help="Context length of the model.")
+    autotune_parser.add_argument("--gpu_layers", type=int, default=0, help="Number of layers offloaded to the GPU.")
+    autotune_parser.add_argument("--base_preset", type=str, default="default", help="Runtime preset the other settings (memory mapping, flash attention, KV cache type) are taken from.")
+    autotune_parser.add_argument("--threads", type=int, nargs="+", default=None, help="Thread counts to try. Default tries half the cores, the cores and all CPUs.")
+    autotune_parser.add_argument("--batch_sizes", type=int, nargs="+", default=[256, 512, 1024], help="Batch sizes (n_batch) to try.")
+    autotune_parser.add_argument("--ubatch_sizes", type=int, nargs="+", default=[128, 256, 512], help="Micro-batch sizes (n_ubatch) to try, with each batch size at least as large.")
+    autotune_parser.add_argument("--prompt_tokens", type=int, default=1024, help="Length of the benchmark prompt in tokens.")
+    autotune_parser.add_argument("--generate_tokens", type=int, default=64, help="Number of tokens generated after the prompt.")
+    autotune_parser.add_argument("--runs", type=int, default=2, help="Number of timed runs of each setting, the best is kept.")
+    autotune_parser.add_argument("--output_path", type=str, default=None, help="Where the profile is saved. Default is the autotuned preset's file in the cache folder.")
+
+    args = parser.parse_args()
+
+    if args.benchmark is None:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    if args.benchmark == "text_normalizer":
+        from benchmark_text_normalizer import run_text_normalizer_benchmark
+        passed = run_text_normalizer_benchmark(args.input_file, args.lines, args.fuzz_lines, args.repeats, args.seed)
+
+    elif args.benchmark == "tts_inference":
+        from benchmark_tts_inference import run_tts_inference_benchmark, BENCHMARK_TEXT
+        run_tts_inference_benchmark(args.voice, args.text or BENCHMARK_TEXT, args.runs, args.intra_op_threads, args.inter_op_threads, args.torch_compile)
+        passed = True
+
+    elif args.benchmark == "model_daemon":
+        from benchmark_model_daemon import run_model_daemon_benchmark, BENCHMARK_TEXT
+        run_model_daemon_benchmark(args.voice, args.text or BENCHMARK_TEXT, args.jobs, args.port, args.llm_model_path)
+        passed = True
+
+    elif args.benchmark == "startup":
+        from benchmark_startup import run_startup_benchmark, STARTUP_TARGETS
+
+        for target in args.targets or []:
+            if target not in STARTUP_TARGETS:
+                parser.error(f"Unknown startup target: {target}. Options: {', '.join(STARTUP_TARGETS)}")
+
+        passed = run_startup_benchmark(args.targets, args.repeats, args.threshold_scale)
+
+    elif args.benchmark == "chunking":
+        from benchmark_chunking import run_chunking_benchmark
+        passed = run_chunking_benchmark(args.input_file, args.llm_model_path, args.context_length)
+
+    elif args.benchmark == "line_formats":
+        from benchmark_line_formats import run_line_format_benchmark
+        run_line_format_benchmark(args.input_file, args.llm_model_path, args.sections, args.context_length, args.gpu_layers)
+        passed = True
+
+    elif args.benchmark == "narration_prepass":
+        from benchmark_narration_prepass import run_narration_prepass_benchmark
+        passed = run_narration_prepass_benchmark(args.input_file)
+
+    elif args.benchmark == "speculative_decoding":
+        from llm_speculative_decoding import SPECULATIVE_MODES
+        from benchmark_speculative_decoding import run_speculative_decoding_benchmark
+
+        for mode in args.modes:
+            if mode not in SPECULATIVE_MODES:
+                parser.error(f"Unknown speculative decoding mode: {mode}. Options: {', '.join(SPECULATIVE_MODES)}")
+
+        passed = run_speculative_decoding_benchmark(
+            args.input_file, args.llm_model_path, args.modes, args.draft_model_path, args.speculative_tokens,
+            args.context_length, args.gpu_layers, args.line_output_format
+        )
+
+    elif args.benchmark == "llm_autotune":
+        from llm_runtime_profile import DEFAULT_RUNTIME_PROFILE_PATH
+        from benchmark_llm_autotune import run_llm_autotune
+        run_llm_autotune(
+            args.llm_model_path, args.context_length, args.gpu_layers, args.base_preset, args.threads, args.batch_sizes, args.ubatch_sizes,
+            args.prompt_tokens, args.generate_tokens, args.runs, args.output_path or DEFAULT_RUNTIME_PROFILE_PATH
+        )
+        passed = True
+
+    # A benchmark fails if it finds a regression, so scripts can stop on it
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
 import argparse
+import os
 import sys
-from session import Session
+import time
 from pathlib import Path
-from text_generator import Model_Type  # <- Important: import Model_Type for enum conversion
+from model_daemon import DaemonClient, DEFAULT_DAEMON_PORT
 
 script_dir = Path(__file__).resolve().parent
 outputs_path = script_dir / ".." / "single_speaker_outputs"
 
+# Seconds between printing the status of running jobs
+JOB_STATUS_INTERVAL = 30
+
+# Argument type for counts that must be at least 1
+def positive_int(value):
+    number = int(value)
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+
+    return number
+
+
 def main():
     print("Processing...")
 
@@ -23,12 +37,28 @@ def main():
     parser.add_argument("--llm_gpu_layers", type=int, default=0, help="Number of GPU layers.")
     parser.add_argument("--llm_temperature", type=float, default=0.7, help="Temperature setting for the model.")
     parser.add_argument("--llm_seed", type=int, default=-1, help="Seed for the LLM. Default (-1) is a random seed.")
+    parser.add_argument("--llm_speculative_mode", choices=["none", "prompt_lookup", "draft_model"], default="none", help="Speculative decoding for the local LLM: drafting tokens from the prompt, or with a small draft model.")
+    parser.add_argument("--llm_draft_model_path", type=str, default=None, help="Small GGUF model sharing the LLM's vocabulary, used with --llm_speculative_mode draft_model.")
+    parser.add_argument("--llm_speculative_tokens", type=positive_int, default=10, help="Number of tokens drafted at a time by speculative decoding, at least 1.")
+
+    # llama.cpp runtime performance. The preset is applied first and any of the settings below override it
+    parser.add_argument("--llm_runtime_preset", type=str, default="default", help="Runtime settings preset for the local LLM: default, cpu_throughput, low_memory, gpu, or autotuned (the profile saved by the llm_autotune benchmark).")
+    parser.add_argument("--llm_threads", type=int, default=None, help="Threads used to generate tokens. Default keeps the preset's value.")
+    parser.add_argument("--llm_threads_batch", type=int, default=None, help="Threads used to process prompts. Default keeps the preset's value.")
+    parser.add_argument("--llm_batch_size", type=int, default=None, help="Prompt tokens submitted to llama.cpp at a time (n_batch).")
+    parser.add_argument("--llm_ubatch_size", type=int, default=None, help="Prompt tokens computed at a time (n_ubatch), at most the batch size.")
+    parser.add_argument("--llm_no_mmap", action="store_const", const=False, default=None, dest="llm_use_mmap", help="Read the model into memory instead of memory mapping it.")
+    parser.add_argument("--llm_mlock", action="store_const", const=True, default=None, dest="llm_use_mlock", help="Lock the model in RAM so it is never swapped out.")
+    parser.add_argument("--llm_flash_attn", action="store_const", const=True, default=None, help="Use flash attention. Needed for a quantized KV cache.")
+    parser.add_argument("--llm_kv_cache_type", type=str, default=None, help="Type of the KV cache: f16, q8_0 or q4_0. Quantized types halve or quarter its memory.")
 
     # LLM arguments (cloud-based)
     parser.add_argument("--cloud_llm_model_name", type=str, help="Cloud LLM model name.")
     parser.add_argument("--cloud_llm_api_key", type=str, help="API key for cloud LLM.")
     parser.add_argument("--cloud_llm_model_type", type=str, help="Model type for cloud LLM. Options: OPEN_AI")
     parser.add_argument("--cloud_llm_max_tokens", type=int, default=2048, help="Max tokens for cloud LLM.")
+    parser.add_argument("--no_llm_cache", action="store_true", help="Always ask the LLM, without reading or saving responses in the LLM response cache.")
+    parser.add_argument("--llm_workers", type=int, default=1, help="Number of chunks line identification sends to the LLM at once. A local model loads one instance per worker.")
 
     # Identify lines
     parser.add_argument("--identify_lines_input_text", type=str, help="Direct text input for identifying lines.")
@@ -37,14 +67,33 @@ def main():
     parser.add_argument("--end_section", type=int, default=-1, help="End section index for line identification.")
     parser.add_argument("--output_folder", type=str, help="Optional folder to store character line outputs.")
     parser.add_argument("--missing_narrator_max_retries", type=int, default=5, help="Max retries for missing narrator detection.")
+    parser.add_argument("--line_output_format", choices=["text", "sentence_index"], default="text", help="What the LLM outputs for each line: its text, or the numbers of its sentences in the chunk, which generates far fewer tokens.")
 
     # Audio generation
     parser.add_argument("--generate_audio_input_text", type=str, help="Direct text input for generating audio.")
     parser.add_argument("--generate_audio_input_file", type=str, help="File path input for generating audio.")
     parser.add_argument("--generate_audio_voice", type=str, help="Voice for generating audio.")
+    parser.add_argument("--output_format", type=str, default="wav", choices=["wav", "flac", "opus", "mp3"], help="File format of the generated audio, for single and multi-speaker audio.")
+    parser.add_argument("--output_sample_rate", type=int, default=None, help="Resample the generated audio to this sample rate. Default keeps the model's sample rate (24000 for XTTS).")
 
     # Multi-speaker audio
-    parser.add_argument("--multi_speaker_audio_folder_path", type=str, help="Folder path for multi-speaker audio generation.")
+    parser.add_argument("--multi_speaker_audio_folder_path", type=str, nargs="+", help="Folder path for multi-speaker audio generation. Several folders can be given to generate several books.")
+    parser.add_argument("--resume", action="store_true", help="Skip chapters and lines already generated by a previous multi-speaker audio run.")
+    parser.add_argument("--tts_workers", type=int, default=1, help="Number of worker processes generating chapters in parallel. Each loads its own TTS model.")
+    parser.add_argument("--tts_threads_per_worker", type=int, default=None, help="Torch threads per TTS worker. Default splits the CPU cores evenly between workers.")
+    parser.add_argument("--tts_jobs", type=int, default=1, help="Number of audio generation jobs (books or single-speaker inputs) run at once. Each loads its own TTS model.")
+
+    # Resident model daemon
+    parser.add_argument("--daemon", action="store_true", help="Run as a model daemon that keeps the LLM and TTS models loaded and runs jobs sent with --use_daemon. Model and TTS arguments given here are used for every job.")
+    parser.add_argument("--use_daemon", action="store_true", help="Send the jobs to a running model daemon instead of loading the models in this process.")
+    parser.add_argument("--stop_daemon", action="store_true", help="Stop a running model daemon.")
+    parser.add_argument("--daemon_port", type=int, default=DEFAULT_DAEMON_PORT, help="Localhost port of the model daemon.")
+
+    # TTS CPU performance
+    parser.add_argument("--tts_fast_cpu", action="store_true", help="Load the TTS model with the fast CPU profile: int8 quantized linear layers and torch.inference_mode.")
+    parser.add_argument("--tts_intra_op_threads", type=int, default=None, help="Torch threads within an operator for the fast CPU profile. Default keeps the torch default.")
+    parser.add_argument("--tts_inter_op_threads", type=int, default=None, help="Torch threads between operators for the fast CPU profile. Default keeps the torch default.")
+    parser.add_argument("--tts_compile", action="store_true", help="Compile the TTS vocoder with torch.compile and warm it up after loading (fast CPU profile).")
 
     # Show help if no arguments are passed
     if len(sys.argv) == 1:
@@ -54,13 +103,6 @@ def main():
 
     args = parser.parse_args()
 
-    # Fix model type to Model_Type enum (important!)
-    try:
-        args.llm_model_type = Model_Type[args.llm_model_type]
-    except KeyError:
-        print(f"Invalid model type '{args.llm_model_type}'. Valid options are: {[e.name for e in Model_Type]}")
-        sys.exit(1)
-
     # Safety checks
     if args.generate_audio_input_text and args.generate_audio_input_file:
         parser.error("You cannot provide both --generate_audio_input_text and --generate_audio_input_file.")
@@ -74,65 +116,290 @@ def main():
     if args.generate_audio_voice and not (args.generate_audio_input_text or args.generate_audio_input_file):
         parser.error("To generate audio, you must provide either --generate_audio_input_text or --generate_audio_input_file.")
 
-    session = Session()
+    if args.output_sample_rate is not None and args.output_sample_rate < 1:
+        parser.error("--output_sample_rate must be at least 1.")
 
-    # Set LLM if needed
-    if args.llm_model_path:
-        session.set_and_load_llm(
-            model_path=args.llm_model_path,
-            model_type=args.llm_model_type,
-            repo_id=args.llm_repo_id,
-            context_length=args.llm_context_length,
-            gpu_layers=args.llm_gpu_layers,
-            temperature=args.llm_temperature,
-            seed=args.llm_seed
-        )
-        print("LLM Model Loaded.")
+    if args.tts_workers < 1:
+        parser.error("--tts_workers must be at least 1.")
 
-    # Set Cloud LLM if needed
-    if args.cloud_llm_model_name and args.cloud_llm_api_key and args.cloud_llm_model_type:
-        session.set_cloud_llm(
-            model_name=args.cloud_llm_model_name,
-            api_key=args.cloud_llm_api_key,
-            model_type=args.cloud_llm_model_type,
-            max_tokens=args.cloud_llm_max_tokens
-        )
-        print("Cloud-based LLM Loaded.")
+    if args.tts_jobs < 1:
+        parser.error("--tts_jobs must be at least 1.")
+
+    if args.tts_threads_per_worker is not None and args.tts_threads_per_worker < 1:
+        parser.error("--tts_threads_per_worker must be at least 1.")
+
+    if (args.tts_intra_op_threads or args.tts_inter_op_threads or args.tts_compile) and not args.tts_fast_cpu:
+        parser.error("--tts_intra_op_threads, --tts_inter_op_threads and --tts_compile require --tts_fast_cpu.")
+
+    if sum([args.daemon, args.use_daemon, args.stop_daemon]) > 1:
+        parser.error("Only one of --daemon, --use_daemon and --stop_daemon can be given.")
+
+    if args.use_daemon and (args.tts_fast_cpu or args.tts_jobs != 1):
+        parser.error("TTS performance settings and --tts_jobs are chosen when the daemon is started with --daemon.")
+
+    job_requests = get_job_requests(args)
+
+    if args.daemon:
+        if job_requests:
+            parser.error("Jobs can't be given with --daemon. Send them with --use_daemon.")
+
+        run_daemon(args)
+
+    elif args.stop_daemon:
+        DaemonClient(args.daemon_port).shutdown()
+        print("Model daemon stopped.")
+
+    elif args.use_daemon:
+        if not run_jobs_in_daemon(args, job_requests):
+            sys.exit(1)
+
+    elif not run_jobs_locally(args, job_requests):
+        sys.exit(1)
+
+
+# Describe the requested tasks as jobs: dicts of task, kwargs and depends_on (indices of earlier jobs), run the same way locally or by the daemon.
+# Paths are made absolute, as the daemon may be running in another folder
+def get_job_requests(args):
+    job_requests = []
+    identify_lines_index = None
 
     # Identify lines (if requested)
     if args.identify_lines_input_text or args.identify_lines_input_file:
-        user_input = args.identify_lines_input_text if args.identify_lines_input_text else args.identify_lines_input_file
         is_file = args.identify_lines_input_file is not None
+        user_input = os.path.abspath(args.identify_lines_input_file) if is_file else args.identify_lines_input_text
 
-        output_folder = args.output_folder if args.output_folder else ""
-        result = session.indentify_character_lines(
-            user_input=user_input,
-            is_file=is_file,
-            output_folder=output_folder,
-            start_section=args.start_section,
-            end_section=args.end_section,
-            missing_narrator_max_retries=args.missing_narrator_max_retries
-        )
-        print("Identified Character Lines:", result)
+        identify_lines_index = len(job_requests)
+        job_requests.append({
+            "task": "identify_lines",
+            "kwargs": {
+                "user_input": user_input,
+                "is_file": is_file,
+                "output_folder": os.path.abspath(args.output_folder) if args.output_folder else "",
+                "start_section": args.start_section,
+                "end_section": args.end_section,
+                "missing_narrator_max_retries": args.missing_narrator_max_retries,
+                "line_output_format": args.line_output_format
+            }
+        })
 
     # Generate audio (if requested)
     if args.generate_audio_input_text or args.generate_audio_input_file:
-        user_input = args.generate_audio_input_text if args.generate_audio_input_text else args.generate_audio_input_file
         is_file = args.generate_audio_input_file is not None
+        user_input = os.path.abspath(args.generate_audio_input_file) if is_file else args.generate_audio_input_text
+
+        job_requests.append({
+            "task": "generate_audio",
+            "kwargs": {
+                "user_input": user_input,
+                "voice": os.path.abspath(args.generate_audio_voice),
+                "is_file": is_file,
+                "output_folder": None,
+                "output_file_type": "." + args.output_format,
+                "output_sample_rate": args.output_sample_rate
+            }
+        })
+
+    # Generate multi-speaker audio (if requested). The books may be the output of the line identification, so they wait for it
+    for folder_path in args.multi_speaker_audio_folder_path or []:
+        job_requests.append({
+            "task": "generate_multi_speaker_audio",
+            "kwargs": {
+                "folder_path": os.path.abspath(folder_path),
+                "workers": args.tts_workers,
+                "threads_per_worker": args.tts_threads_per_worker,
+                "resume": args.resume,
+                "output_file_type": "." + args.output_format,
+                "output_sample_rate": args.output_sample_rate
+            },
+            "depends_on": [identify_lines_index] if identify_lines_index is not None else []
+        })
+
+    return job_requests
+
+
+# Keyword arguments for Session.set_and_load_llm, with the model type given by name
+def get_llm_kwargs(args):
+    return {
+        "model_path": args.llm_model_path,
+        "model_type": args.llm_model_type,
+        "repo_id": args.llm_repo_id,
+        "context_length": args.llm_context_length,
+        "gpu_layers": args.llm_gpu_layers,
+        "temperature": args.llm_temperature,
+        "seed": args.llm_seed,
+        "speculative_mode": args.llm_speculative_mode,
+        "draft_model_path": os.path.abspath(args.llm_draft_model_path) if args.llm_draft_model_path else None,
+        "speculative_tokens": args.llm_speculative_tokens,
+        "runtime_profile": get_llm_runtime_profile(args),
+        "llm_workers": args.llm_workers,
+        "use_response_cache": not args.no_llm_cache
+    }
+
+
+# The llama.cpp runtime settings from the preset and the settings given on the command line
+def get_llm_runtime_profile(args):
+    from llm_runtime_profile import get_runtime_profile
+
+    try:
+        return get_runtime_profile(
+            args.llm_runtime_preset,
+            n_threads=args.llm_threads,
+            n_threads_batch=args.llm_threads_batch,
+            n_batch=args.llm_batch_size,
+            n_ubatch=args.llm_ubatch_size,
+            use_mmap=args.llm_use_mmap,
+            use_mlock=args.llm_use_mlock,
+            flash_attn=args.llm_flash_attn,
+            kv_cache_type=args.llm_kv_cache_type
+        )
+    except ValueError as e:
+        print(f"Invalid LLM runtime settings: {e}")
+        sys.exit(1)
+
+
+def get_cloud_llm_kwargs(args):
+    return {
+        "model_name": args.cloud_llm_model_name,
+        "api_key": args.cloud_llm_api_key,
+        "model_type": args.cloud_llm_model_type,
+        "max_tokens": args.cloud_llm_max_tokens,
+        "llm_workers": args.llm_workers,
+        "use_response_cache": not args.no_llm_cache
+    }
+
 
-        result = session.generate_audio(
-            user_input=user_input,
-            voice=args.generate_audio_voice,
-            is_file=is_file,
-            output_folder=None,
-            output_file_type=".wav"
+def has_cloud_llm_args(args):
+    return args.cloud_llm_model_name and args.cloud_llm_api_key and args.cloud_llm_model_type
+
+
+# Create a session with the LLM and TTS settings given on the command line.
+# The models are only imported here, so running as a daemon client never loads them
+def create_session(args):
+    from session import Session
+    from text_generator import Model_Type  # <- Important: import Model_Type for enum conversion
+
+    # Fix model type to Model_Type enum (important!)
+    try:
+        model_type = Model_Type[args.llm_model_type]
+    except KeyError:
+        print(f"Invalid model type '{args.llm_model_type}'. Valid options are: {[e.name for e in Model_Type]}")
+        sys.exit(1)
+
+    tts_performance_profile = None
+    if args.tts_fast_cpu:
+        from tts_model_loader import get_cpu_performance_profile
+
+        tts_performance_profile = get_cpu_performance_profile(
+            intra_op_threads=args.tts_intra_op_threads,
+            inter_op_threads=args.tts_inter_op_threads,
+            torch_compile=args.tts_compile
         )
-        print("Generated Audio:", result)
 
-    # Generate multi-speaker audio (if requested)
-    if args.multi_speaker_audio_folder_path:
-        result = session.generate_multi_speaker_audio(args.multi_speaker_audio_folder_path)
-        print("Multi-Speaker Audio:", result)
+    session = Session(tts_performance_profile=tts_performance_profile, tts_jobs=args.tts_jobs)
+
+    # Set LLM if needed
+    if args.llm_model_path:
+        session.set_and_load_llm(**dict(get_llm_kwargs(args), model_type=model_type))
+        print("LLM Model Loaded.")
+
+    # Set Cloud LLM if needed
+    if has_cloud_llm_args(args):
+        session.set_cloud_llm(**get_cloud_llm_kwargs(args))
+        print("Cloud-based LLM Loaded.")
+
+    return session
+
+
+# Run the jobs in this process, loading the models first
+def run_jobs_locally(args, job_requests):
+    session = create_session(args)
+
+    # Every task is submitted as a job. Line identification runs on the LLM while audio is generated on TTS
+    jobs = []
+
+    for job_request in job_requests:
+        depends_on = [jobs[index] for index in job_request.get("depends_on", [])]
+        jobs.append(session.submit_task(job_request["task"], job_request["kwargs"], depends_on))
+
+    return wait_for_jobs(session, jobs)
+
+
+# Keep the models loaded and run jobs sent by clients until stopped
+def run_daemon(args):
+    from model_daemon import ModelDaemon
+
+    session = create_session(args)
+
+    # Load the TTS model now so the first job doesn't wait for it
+    session.preload_tts_models()
+
+    ModelDaemon(session, args.daemon_port).serve_forever()
+
+
+# Send the jobs to the model daemon and print their progress as it comes back. Returns True if every job completed
+def run_jobs_in_daemon(args, job_requests):
+    client = DaemonClient(args.daemon_port)
+
+    # The daemon only loads the LLM if it doesn't already have the same one loaded
+    if args.llm_model_path:
+        print("LLM:", client.load_llm(**get_llm_kwargs(args)))
+
+    if has_cloud_llm_args(args):
+        print("Cloud LLM:", client.set_cloud_llm(**get_cloud_llm_kwargs(args)))
+
+    if not job_requests:
+        return True
+
+    def print_update(message_type, job_statuses):
+        if message_type != "done":
+            print("\n".join(status["summary"] for status in job_statuses))
+
+    job_statuses = client.run_jobs(job_requests, print_update)
+
+    for status in job_statuses:
+        if status["status"] == "completed":
+            print(f"{status['name']}: {status['result']}")
+        else:
+            print(status["summary"])
+
+    return all(status["status"] == "completed" for status in job_statuses)
+
+
+# Wait for the jobs to finish, printing their status as they go and their results at the end.
+# Ctrl+C cancels them. Returns True if every job completed
+def wait_for_jobs(session, jobs):
+    from job_scheduler import JOB_COMPLETED
+
+    last_status_time = time.time()
+
+    try:
+        while not all(job.is_finished for job in jobs):
+            time.sleep(1)
+
+            if time.time() - last_status_time >= JOB_STATUS_INTERVAL:
+                print("\n" + "\n".join(str(job) for job in jobs) + "\n")
+                last_status_time = time.time()
+
+    except KeyboardInterrupt:
+        print("\nCancelling jobs...")
+
+        for job in jobs:
+            session.cancel_job(job.id)
+
+        for job in jobs:
+            # Cancelled and failed jobs are reported below
+            try:
+                job.wait()
+            except Exception:
+                pass
+
+    for job in jobs:
+        if job.status == JOB_COMPLETED:
+            print(f"{job.name}: {job.result}")
+        else:
+            print(job)
+
+    return all(job.status == JOB_COMPLETED for job in jobs)
 
 if __name__ == "__main__":
     main()
@@ -3,7 +3,8 @@ from ui import Ui
 from session import Session
 
 launch_ui_on_start_up = True
+tts_jobs = 1  # Number of audio generation jobs run at once. Each loads its own TTS model
 
 print("Starting...")
-current_session = Session() # Create a session
+current_session = Session(tts_jobs=tts_jobs) # Create a session
 ui = Ui(current_session, launch_ui_on_start_up) # Load the UI
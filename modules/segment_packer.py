@@ -0,0 +1,66 @@
+import re
+
+# Characters per segment XTTS handles without cutting audio off, used when the model doesn't report its own limit
+DEFAULT_SEGMENT_LENGTH = 250
+
+# Where text may be split, from most to least preferred: after a sentence, after a clause, then between words
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?])\s+')
+CLAUSE_SPLIT_PATTERN = re.compile(r'(?<=[,;:])\s+')
+WORD_SPLIT_PATTERN = re.compile(r'\s+')
+SPLIT_PATTERNS = [SENTENCE_SPLIT_PATTERN, CLAUSE_SPLIT_PATTERN, WORD_SPLIT_PATTERN]
+
+
+def pack_segments(text, max_segment_length=DEFAULT_SEGMENT_LENGTH):
+    """
+    Split text into the fewest segments of at most max_segment_length characters, keeping sentences whole.
+    Consecutive sentences are packed together greedily, which gives the fewest segments when their order has to be kept.
+    A sentence longer than the limit is split after a clause if possible, otherwise between words.
+    """
+    return split_and_pack(" ".join(text.split()), max_segment_length, 0)
+
+
+# Split text at the given level and pack the pieces, splitting pieces that are too long at the next level down
+def split_and_pack(text, max_segment_length, level):
+    pieces = []
+
+    for piece in SPLIT_PATTERNS[level].split(text):
+        if not piece:
+            continue
+
+        # A single word longer than the limit can't be split any further, so it is kept whole
+        if len(piece) > max_segment_length and level + 1 < len(SPLIT_PATTERNS):
+            pieces.extend(split_and_pack(piece, max_segment_length, level + 1))
+        else:
+            pieces.append(piece)
+
+    segments = []
+    segment = ""
+
+    for piece in pieces:
+        if segment and len(segment) + 1 + len(piece) <= max_segment_length:
+            segment += " " + piece
+        else:
+            if segment:
+                segments.append(segment)
+            segment = piece
+
+    if segment:
+        segments.append(segment)
+
+    return segments
+
+
+def get_segment_plan_stats(segment_plan, max_segment_length):
+    """
+    Summarize a segment plan (a list of segments for each text): the number of segments and how full they are on average.
+    """
+    segment_lengths = [len(segment) for segments in segment_plan for segment in segments]
+    segment_count = len(segment_lengths)
+
+    return {
+        "texts": len(segment_plan),
+        "segments": segment_count,
+        "characters": sum(segment_lengths),
+        "average_segment_length": sum(segment_lengths) / segment_count if segment_count > 0 else 0.0,
+        "fill_ratio": sum(segment_lengths) / (segment_count * max_segment_length) if segment_count > 0 else 0.0
+    }
@@ -1,19 +1,42 @@
 import os
-from llm import Llm
+from llm_model_manager import LlmModelManager  # Loads each LLM config once and swaps models without holding two
+from llm_speculative_decoding import DEFAULT_SPECULATIVE_TOKENS, validate_speculative_tokens
+from llm_runtime_profile import get_runtime_profile
 from llm_chapter_manager import identify_book_character_lines  # Function to process and identify character lines in text
-from audio_generator_manager import tts_generate_audio, tts_generate_multi_speaker_audio  # Functions to generate audio from text
+from line_output_format import get_line_output_format  # Checks the LLM output format a line identification job asks for
+from tts_model_registry import TtsModelRegistry  # Keeps TTS models loaded between generation requests
+from job_scheduler import JobScheduler, LLM_RESOURCE, TTS_RESOURCE  # Runs LLM and TTS work in the background
 
 # Define the Session class to manage the LLM and associated operations
 class Session:
-    def __init__(self, llm=None):
+    def __init__(self, llm=None, max_loaded_tts_models=1, tts_performance_profile=None, tts_jobs=1):
+        # Holds the loaded LLM and its pool of instances, so line identification can send several chunks at once.
         # Initialize with an optional LLM instance
-        self._llm = llm
+        self._llm_model_manager = LlmModelManager()
+        if llm is not None:
+            self._llm_model_manager.adopt(llm)
+        # TTS models are loaded on first use and reused for every later request.
+        # Each TTS job slot has its own registry, as one model can't synthesize for two jobs at once
+        self._tts_model_registries = [TtsModelRegistry(max_loaded_tts_models, tts_performance_profile) for _ in range(max(1, tts_jobs))]
+        # Line identification, audio generation and LLM loading all run as jobs: one at a time on the LLM, tts_jobs at a time on TTS
+        self._job_scheduler = JobScheduler({LLM_RESOURCE: 1, TTS_RESOURCE: len(self._tts_model_registries)})
         self.create_output_folders()
 
-    def set_and_load_llm(self, model_path, model_type, repo_id=None, context_length=2048, gpu_layers=0, temperature=0.7, seed=0):
+    def set_and_load_llm(self, model_path, model_type, repo_id=None, context_length=2048, gpu_layers=0, temperature=0.7, seed=0, llm_workers=1, use_response_cache=True,
+                         speculative_mode="none", draft_model_path=None, speculative_tokens=DEFAULT_SPECULATIVE_TOKENS, runtime_profile=None):
         """
         Set up a local LLM using the given configuration parameters and load it.
+        speculative_mode is "none", "prompt_lookup" (drafting from the prompt) or "draft_model" (drafting with the small GGUF
+        model at draft_model_path), with speculative_tokens drafted at a time.
+        runtime_profile sets llama.cpp's threads, batch sizes, memory mapping and KV cache type (see llm_runtime_profile.get_runtime_profile).
+        Settings it leaves out, or all of them if it is None, keep the llama.cpp defaults.
+        With llm_workers above 1, that many instances of the model are loaded so line identification can process chunks in parallel.
+        With use_response_cache, responses are saved to disk and reused when the same chunk is identified again.
         """
+        # Fill in the llama.cpp defaults for any settings left out, and check them before anything is loaded
+        runtime_profile = get_runtime_profile(**(runtime_profile or {}))
+        validate_speculative_tokens(speculative_tokens)
+
         llm_config = {
             'model_path': model_path,
             'repo_id': repo_id,
@@ -21,54 +44,104 @@ class Session:
             'gpu_layers': gpu_layers,
             'temperature': temperature,
             'seed': seed,
-            'model_type': model_type
+            'model_type': model_type,
+            'use_response_cache': use_response_cache,
+            'speculative_mode': speculative_mode,
+            'draft_model_path': draft_model_path,
+            'speculative_tokens': speculative_tokens,
+            **runtime_profile
         }
 
-        # Create an LLM instance with the config
-        self._llm = Llm(llm_config)
-        self.load_llm()  # Load the model
+        # Exactly this model and these settings are already loaded, so there is nothing to wait for on the job queue.
+        # Any change, even to the temperature, waits for running jobs so they finish with the settings they started with
+        llm = self._llm_model_manager.get_loaded(llm_config, llm_workers)
+        if llm is not None:
+            print("Requested LLM is already loaded")
+            return llm
+
+        # Load on the LLM's job queue, so the model is never swapped out from under a running line identification job.
+        # The manager keeps the loaded model if it has the same config, and otherwise unloads it before loading the new one
+        def load_llm_job(job):
+            llm, _ = self._llm_model_manager.load(llm_config, llm_workers)
 
-        return self._llm  # Return the initialized and loaded LLM instance
+            return llm  # Return the loaded LLM instance
 
-    def set_cloud_llm(self, model_name, api_key, model_type, max_tokens=2048, temperature=0.7):
+        return self._job_scheduler.submit(f"Load LLM {model_path}", LLM_RESOURCE, load_llm_job).wait()
+
+    def set_cloud_llm(self, model_name, api_key, model_type, max_tokens=2048, temperature=0.7, llm_workers=1, use_response_cache=True):
         """
         Set up a cloud-based LLM using the given API credentials and parameters.
+        With llm_workers above 1, line identification sends that many chunk requests at once.
+        With use_response_cache, responses are saved to disk and reused when the same chunk is identified again.
         """
         llm_config = {
             'model_name': model_name,
             'api_key': api_key,
             'max_tokens': max_tokens,
             'temperature': temperature,
-            'model_type': model_type
+            'model_type': model_type,
+            'use_response_cache': use_response_cache
         }
 
-        # Create an LLM instance with cloud configuration
-        self._llm = Llm(llm_config)
+        # Switch to the cloud configuration on the LLM's job queue, so a local model is only unloaded once no job is using it
+        def set_cloud_llm_job(job):
+            llm, _ = self._llm_model_manager.load(llm_config, llm_workers)
+
+            return llm  # Return the cloud-based LLM instance
 
-        return self._llm  # Return the cloud-based LLM instance
+        return self._job_scheduler.submit(f"Set cloud LLM {model_name}", LLM_RESOURCE, set_cloud_llm_job).wait()
 
     def load_llm(self):
         """
-        Load the model for inference.
+        Reload the current model for inference, releasing the loaded copy first, once no job is using it.
+        """
+        return self._job_scheduler.submit("Reload LLM", LLM_RESOURCE, lambda job: self._llm_model_manager.reload()).wait()  # Return the loaded model instance
+
+    def unload_llm(self):
+        """
+        Unload the LLM and free its memory. Returns True if a model was loaded.
         """
-        self._llm.load_model()  # Trigger the model loading
-        return self._llm  # Return the loaded model instance
+        return self._job_scheduler.submit("Unload LLM", LLM_RESOURCE, lambda job: self._llm_model_manager.unload()).wait()
 
-    def indentify_character_lines(self, user_input, is_file, output_folder="", start_section=0, end_section=-1, missing_narrator_max_retries=10):
+    def indentify_character_lines(self, user_input, is_file, output_folder="", start_section=0, end_section=-1, missing_narrator_max_retries=10, line_output_format="text"):
         """
-        Identify character lines in the given input (file or text) using the loaded LLM.
+        Identify character lines in the given input (file or text) using the loaded LLM, waiting for the job to finish.
         """
+        return self.submit_identify_character_lines(
+            user_input, is_file, output_folder, start_section, end_section, missing_narrator_max_retries, line_output_format
+        ).wait()
+
+    def submit_identify_character_lines(self, user_input, is_file, output_folder="", start_section=0, end_section=-1, missing_narrator_max_retries=10, line_output_format="text", depends_on=None):
+        """
+        Queue a job identifying character lines in the given input (file or text) using the loaded LLM. Returns the Job.
+        line_output_format is "text", where the LLM copies every line, or "sentence_index", where it labels numbered sentences.
+        """
+        # Fail on submit rather than when the job runs
+        get_line_output_format(line_output_format)
+        
+        return self._job_scheduler.submit(
+            f"Identify lines: {get_job_input_name(user_input, is_file)}",
+            LLM_RESOURCE,
+            self._identify_character_lines,
+            (user_input, is_file, output_folder, start_section, end_section, missing_narrator_max_retries, line_output_format),
+            depends_on=depends_on
+        )
+
+    def _identify_character_lines(self, user_input, is_file, output_folder, start_section, end_section, missing_narrator_max_retries, line_output_format, job=None):
         self.create_output_folders()
         
-        if self._llm is not None:
+        if self.llm is not None:
             output_path = identify_book_character_lines(
-                self._llm,
+                self.llm,
                 user_input,
                 is_file,
                 start_section,
                 end_section,
                 output_folder,
-                missing_narrator_max_retries
+                missing_narrator_max_retries,
+                job=job,
+                llm_pool=self.llm_pool,
+                line_output_format=line_output_format
             )
             
             output_path = os.path.realpath(output_path)
@@ -78,22 +151,148 @@ class Session:
             
         return "No model loaded"  # Return error message if model is not set
 
-    def generate_audio(self, user_input, voice, is_file, output_folder, output_file_type=".wav"):
+    def generate_audio(self, user_input, voice, is_file, output_folder, output_file_type=".wav", output_sample_rate=None):
+        """
+        Generate single-speaker audio from text using TTS, waiting for the job to finish.
+        """
+        return self.submit_generate_audio(user_input, voice, is_file, output_folder, output_file_type, output_sample_rate).wait()
+
+    def submit_generate_audio(self, user_input, voice, is_file, output_folder, output_file_type=".wav", output_sample_rate=None, depends_on=None):
         """
-        Generate single-speaker audio from text using TTS.
+        Queue a job generating single-speaker audio from text using TTS. Returns the Job.
         """
+        return self._job_scheduler.submit(
+            f"Single-speaker audio: {get_job_input_name(user_input, is_file)}",
+            TTS_RESOURCE,
+            self._generate_audio,
+            (user_input, voice, is_file, output_folder, output_file_type, output_sample_rate),
+            depends_on=depends_on
+        )
+
+    def _generate_audio(self, user_input, voice, is_file, output_folder, output_file_type, output_sample_rate, job=None):
+        # Functions to generate audio from text. They import torch and the TTS library, so are only loaded once audio is generated
+        from audio_generator_manager import tts_generate_audio
+
         self.create_output_folders()
         
-        return tts_generate_audio(user_input, voice, is_file, output_folder, False, output_file_type)
+        return tts_generate_audio(
+            user_input, voice, is_file, output_folder, output_file_type, tts_model_registry=self._get_job_tts_model_registry(job), output_sample_rate=output_sample_rate, job=job
+        )
 
-    def generate_multi_speaker_audio(self, folder_path):
+    def generate_multi_speaker_audio(self, folder_path, workers=1, threads_per_worker=None, resume=False, output_file_type=".wav", output_sample_rate=None):
         """
-        Generate multi-speaker audio from previously processed text data.
+        Generate multi-speaker audio from previously processed text data, waiting for the job to finish.
+        If workers is more than 1, chapters are generated in parallel by that many processes, each loading its own TTS model.
+        If resume is set, chapters and lines finished by a previous run are skipped.
+        Chapters are saved as output_file_type (.wav, .flac, .opus or .mp3), resampled to output_sample_rate if given.
         """
-        
+        return self.submit_generate_multi_speaker_audio(
+            folder_path, workers, threads_per_worker, resume, output_file_type, output_sample_rate
+        ).wait()
+
+    def submit_generate_multi_speaker_audio(self, folder_path, workers=1, threads_per_worker=None, resume=False, output_file_type=".wav", output_sample_rate=None, depends_on=None):
+        """
+        Queue a job generating multi-speaker audio from previously processed text data. Returns the Job.
+        """
+        return self._job_scheduler.submit(
+            f"Multi-speaker audio: {os.path.basename(os.path.normpath(folder_path))}",
+            TTS_RESOURCE,
+            self._generate_multi_speaker_audio,
+            (folder_path, workers, threads_per_worker, resume, output_file_type, output_sample_rate),
+            depends_on=depends_on
+        )
+
+    def _generate_multi_speaker_audio(self, folder_path, workers, threads_per_worker, resume, output_file_type, output_sample_rate, job=None):
+        from audio_generator_manager import tts_generate_multi_speaker_audio
+
         print("Generating multi-speaker audio")
         
-        return tts_generate_multi_speaker_audio(folder_path)
+        return tts_generate_multi_speaker_audio(
+            folder_path, self._get_job_tts_model_registry(job), workers, threads_per_worker, resume, output_file_type, output_sample_rate, job=job
+        )
+
+    def submit_task(self, task, kwargs, depends_on=None):
+        """
+        Queue a job by task name: "identify_lines", "generate_audio" or "generate_multi_speaker_audio", with the keyword
+        arguments of the matching submit method. Used for jobs described as data, such as those sent to the model daemon.
+        """
+        submit_methods = {
+            "identify_lines": self.submit_identify_character_lines,
+            "generate_audio": self.submit_generate_audio,
+            "generate_multi_speaker_audio": self.submit_generate_multi_speaker_audio
+        }
+
+        if task not in submit_methods:
+            raise ValueError(f"Unknown task: {task}. Options: {', '.join(submit_methods)}")
+
+        return submit_methods[task](**kwargs, depends_on=depends_on)
+
+    def get_jobs(self):
+        """
+        Return every job submitted in this session, oldest first.
+        """
+        return self._job_scheduler.list_jobs()
+
+    def get_job(self, job_id):
+        return self._job_scheduler.get_job(job_id)
+
+    def cancel_job(self, job_id):
+        """
+        Cancel a queued or running job. Returns False if there is no such job or it has already finished.
+        """
+        return self._job_scheduler.cancel(job_id)
+
+    # Each TTS job slot uses its own registry, so jobs running side by side never share a model
+    def _get_job_tts_model_registry(self, job):
+        if job is None or job.slot is None:
+            return self._tts_model_registries[0]
+
+        return self._tts_model_registries[job.slot]
+
+    def unload_tts_model(self, model_type="coqui"):
+        """
+        Unload a TTS model from every job slot to free its memory. It will be reloaded the next time it is needed.
+        """
+        return any([tts_model_registry.unload(model_type) for tts_model_registry in self._tts_model_registries])
+
+    def preload_tts_models(self, model_type="coqui"):
+        """
+        Load a TTS model into every TTS job slot now, rather than when each slot's first job starts.
+        """
+        for tts_model_registry in self._tts_model_registries:
+            tts_model_registry.get_model(model_type)
+
+    def set_tts_performance_profile(self, performance_profile):
+        """
+        Set the CPU performance profile TTS models are loaded with (see tts_model_loader.get_cpu_performance_profile), or None for the default.
+        Any loaded TTS models are unloaded so they are reloaded with the new profile.
+        """
+        for tts_model_registry in self._tts_model_registries:
+            tts_model_registry.performance_profile = performance_profile
+
+    @property
+    def llm(self):
+        return self._llm_model_manager.llm
+
+    @property
+    def llm_pool(self):
+        return self._llm_model_manager.llm_pool
+
+    @property
+    def llm_workers(self):
+        return self.llm_pool.workers if self.llm_pool is not None else 0
+
+    @property
+    def llm_model_manager(self):
+        return self._llm_model_manager
+
+    @property
+    def tts_model_registry(self):
+        return self._tts_model_registries[0]
+
+    @property
+    def job_scheduler(self):
+        return self._job_scheduler
         
         
     def create_output_folders(self):
@@ -110,3 +309,12 @@ class Session:
             if not os.path.exists(path):
                 os.makedirs(path)
                 print(f"Created folder: {path}")
+
+
+# Short name for a job's input: the file name, or the start of the text
+def get_job_input_name(user_input, is_file, max_length=40):
+    if is_file:
+        return os.path.basename(user_input)
+
+    text = " ".join(user_input.split())
+    return text if len(text) <= max_length else text[:max_length] + "..."
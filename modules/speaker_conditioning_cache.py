@@ -0,0 +1,131 @@
+import os
+import hashlib
+import threading
+import torch
+from pathlib import Path
+
+# Folder where precomputed speaker conditioning tensors are stored
+script_dir = Path(__file__).resolve().parent
+DEFAULT_CACHE_FOLDER = (script_dir / ".." / "cache" / "speaker_conditioning").resolve()
+
+# Size of the blocks voice files are read in when hashing
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class SpeakerConditioningCache:
+    """
+    Caches the XTTS GPT conditioning latents and speaker embedding computed from a reference voice file.
+    Entries are kept in memory and on disk, keyed by the voice file's content hash and the model version,
+    so they are only recomputed when the voice file or the model changes.
+    """
+
+    def __init__(self, cache_folder=DEFAULT_CACHE_FOLDER):
+        self._cache_folder = Path(cache_folder)
+        self._memory_cache = {}  # cache key -> (gpt_cond_latent, speaker_embedding)
+        self._file_hashes = {}   # voice path -> (size, modified time, content hash)
+        self._lock = threading.Lock()
+
+    def get_conditioning_latents(self, xtts_model, voice_path, model_version):
+        """
+        Return (gpt_cond_latent, speaker_embedding) for the voice file, computing and storing them on a cache miss.
+        """
+        config = xtts_model.config
+        cache_key = self.get_cache_key(voice_path, model_version, config)
+
+        with self._lock:
+            # Fastest path: already loaded in this process
+            if cache_key in self._memory_cache:
+                return self._memory_cache[cache_key]
+
+            device = next(xtts_model.parameters()).device
+            cache_file_path = self._cache_folder / f"{cache_key}.pt"
+
+            # Load from disk if a previous run already computed this voice
+            if cache_file_path.exists():
+                try:
+                    cached = torch.load(cache_file_path, map_location=device)
+                    latents = (cached["gpt_cond_latent"], cached["speaker_embedding"])
+                    self._memory_cache[cache_key] = latents
+                    return latents
+                except Exception as e:
+                    print(f"Could not read cached speaker conditioning {cache_file_path}, recomputing: {e}")
+
+            print("Computing speaker conditioning for voice:", voice_path)
+
+            gpt_cond_latent, speaker_embedding = xtts_model.get_conditioning_latents(
+                audio_path=[voice_path],
+                gpt_cond_len=config.gpt_cond_len,
+                gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+                max_ref_length=config.max_ref_len,
+                sound_norm_refs=config.sound_norm_refs
+            )
+
+            self._save(cache_file_path, gpt_cond_latent, speaker_embedding)
+
+            latents = (gpt_cond_latent, speaker_embedding)
+            self._memory_cache[cache_key] = latents
+            return latents
+
+    def get_cache_key(self, voice_path, model_version, config):
+        # Include the conditioning settings so changing them in the model config invalidates old entries
+        key_source = "|".join([
+            self.get_voice_hash(voice_path),
+            str(model_version),
+            str(config.gpt_cond_len),
+            str(config.gpt_cond_chunk_len),
+            str(config.max_ref_len),
+            str(config.sound_norm_refs)
+        ])
+
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get_voice_hash(self, voice_path):
+        """
+        Return the SHA-256 of the voice file's contents. The hash is only recomputed when the file's size or modified time changes.
+        """
+        stat = os.stat(voice_path)
+
+        with self._lock:
+            cached = self._file_hashes.get(voice_path)
+
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        sha256 = hashlib.sha256()
+
+        with open(voice_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                sha256.update(block)
+
+        voice_hash = sha256.hexdigest()
+
+        with self._lock:
+            self._file_hashes[voice_path] = (stat.st_size, stat.st_mtime_ns, voice_hash)
+
+        return voice_hash
+
+    def clear(self, delete_files=False):
+        """
+        Clear the in-memory cache, and optionally the files stored on disk.
+        """
+        with self._lock:
+            self._memory_cache.clear()
+            self._file_hashes.clear()
+
+            if delete_files and self._cache_folder.exists():
+                for cache_file in self._cache_folder.glob("*.pt"):
+                    cache_file.unlink()
+
+    def _save(self, cache_file_path, gpt_cond_latent, speaker_embedding):
+        self._cache_folder.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so an interrupted write never leaves a corrupt cache entry
+        temp_file_path = cache_file_path.with_suffix(".tmp")
+        torch.save(
+            {
+                "gpt_cond_latent": gpt_cond_latent.cpu(),
+                "speaker_embedding": speaker_embedding.cpu()
+            },
+            temp_file_path
+        )
+        os.replace(temp_file_path, cache_file_path)
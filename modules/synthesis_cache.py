@@ -0,0 +1,105 @@
+import json
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+
+# Folder where synthesized audio segments are cached
+script_dir = Path(__file__).resolve().parent
+DEFAULT_CACHE_FOLDER = (script_dir / ".." / "cache" / "synthesis").resolve()
+
+# Maximum size of the cache on disk before the least recently used segments are evicted
+DEFAULT_CACHE_SIZE_LIMIT = 4 * 1024 ** 3
+
+
+class SynthesisCache:
+    """
+    On-disk cache of synthesized audio segments, keyed by a hash of the segment text, voice, model and synthesis settings.
+    Audio is stored as 16-bit PCM plus its peak level, which is half the size of the float samples the model produces.
+    The cache folder is only opened once the first segment is looked up.
+    """
+
+    def __init__(self, cache_folder=DEFAULT_CACHE_FOLDER, size_limit=DEFAULT_CACHE_SIZE_LIMIT):
+        self._cache_folder = cache_folder
+        self._size_limit = size_limit
+        self._cache = None
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, text, voice_hash, model_id, params):
+        """
+        Build the cache key for a segment. params is a dict of every setting that changes the generated audio.
+        """
+        key_source = json.dumps([text, voice_hash, model_id, params], sort_keys=True)
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached float samples for the key, or None if the segment has not been cached.
+        """
+        value = self._get_cache().get(key)
+
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+
+        peak, pcm_bytes = value
+        return np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) * (peak / 32767)
+
+    def set(self, key, wav):
+        """
+        Store the float samples for the key.
+        """
+        wav = np.asarray(wav, dtype=np.float32)
+        peak = float(np.max(np.abs(wav))) if len(wav) > 0 else 0.0
+
+        # Scale to the full 16-bit range so quiet segments keep their precision
+        scale = 32767 / peak if peak > 0 else 0.0
+        pcm_bytes = np.round(wav * scale).astype(np.int16).tobytes()
+
+        self._get_cache().set(key, (peak, pcm_bytes))
+
+    def stats(self):
+        """
+        Return the hit/miss counts for this process and the current size of the cache.
+        """
+        with self._lock:
+            hits = self._hits
+            misses = self._misses
+
+        lookups = hits + misses
+        cache = self._get_cache()
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups > 0 else 0.0,
+            "entries": len(cache),
+            "size_bytes": cache.volume()
+        }
+
+    def clear(self):
+        self._get_cache().clear()
+
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
+
+    def _get_cache(self):
+        with self._lock:
+            if self._cache is None:
+                from diskcache import Cache
+                self._cache = Cache(str(self._cache_folder), size_limit=self._size_limit, eviction_policy="least-recently-used")
+
+            return self._cache
+
+    def __str__(self):
+        stats = self.stats()
+        return (
+            f"SynthesisCache(hits={stats['hits']}, misses={stats['misses']}, hit_rate={stats['hit_rate']:.1%}, "
+            f"entries={stats['entries']}, size={stats['size_bytes'] / (1024 ** 2):.1f}MB)"
+        )
@@ -0,0 +1,209 @@
+import time
+import queue
+import threading
+
+# Number of items that can wait between two stages before the earlier stage has to wait for the later one
+DEFAULT_QUEUE_SIZE = 4
+
+# How often a waiting stage checks whether the pipeline has been stopped by an error elsewhere
+STOP_CHECK_INTERVAL = 0.1
+
+# Marks the end of the items in a stage's queue
+END_OF_ITEMS = object()
+
+
+class PipelineStage:
+    """
+    One stage of a SynthesisPipeline: a function applied to every item from the stage's input queue by one or more threads.
+    Records how long the stage spent working, how long it spent waiting for the next stage to take its output,
+    and how full its input queue got, so the slowest stage can be found.
+    """
+
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.items_processed = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_queue_depth = 0
+        self._workers_running = workers
+        self._lock = threading.Lock()
+
+    def record_item(self, busy_seconds, blocked_seconds):
+        with self._lock:
+            self.items_processed += 1
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+
+    def record_queue_depth(self):
+        depth = self.input_queue.qsize()
+
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def finish_worker(self):
+        # Returns True for the last of the stage's workers to finish
+        with self._lock:
+            self._workers_running -= 1
+            return self._workers_running == 0
+
+    def stats(self, elapsed_seconds):
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "items": self.items_processed,
+            "busy_seconds": self.busy_seconds,
+            "blocked_seconds": self.blocked_seconds,
+            "utilization": self.busy_seconds / (elapsed_seconds * self.workers) if elapsed_seconds > 0 else 0.0,
+            "queue_depth": self.input_queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_size": self.input_queue.maxsize
+        }
+
+
+class SynthesisPipeline:
+    """
+    Runs items through a chain of stages that work at the same time, each on its own threads, joined by bounded queues.
+    A stage that gets ahead waits for space in the next stage's queue, so no more than a few items are ever held in memory.
+    Each stage function takes an item and returns the item passed to the next stage; the last stage's results are discarded.
+    If any stage raises an error, the whole pipeline stops and the error is raised from run().
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self._queue_size = queue_size
+        self._stages = []
+        self._stop_event = threading.Event()
+        self._error = None
+        self._start_time = None
+        self._end_time = None
+
+    def add_stage(self, name, function, workers=1):
+        """
+        Add a stage after the existing ones. A stage with several workers may pass items on out of order.
+        """
+        self._stages.append(PipelineStage(name, function, workers, self._queue_size))
+        return self
+
+    def run(self, items):
+        """
+        Feed the items through every stage and wait for them all to finish. Returns the stats of each stage.
+        """
+        self._start_time = time.perf_counter()
+        self._end_time = None
+
+        threads = []
+
+        for stage_index, stage in enumerate(self._stages):
+            next_stage = self._stages[stage_index + 1] if stage_index + 1 < len(self._stages) else None
+
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(target=self._run_worker, args=(stage, next_stage), name=f"{stage.name}-{worker_index}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # Feed the first stage from this thread, which waits whenever the first stage is full
+        first_stage = self._stages[0]
+
+        for item in items:
+            if not self._put(first_stage, item):
+                break
+
+        for _ in range(first_stage.workers):
+            self._put(first_stage, END_OF_ITEMS)
+
+        for thread in threads:
+            thread.join()
+
+        self._end_time = time.perf_counter()
+
+        if self._error is not None:
+            raise self._error
+
+        return self.stats()
+
+    def stop(self):
+        """
+        Stop every stage as soon as its current item is done. run() returns without processing the remaining items.
+        """
+        self._stop_event.set()
+
+    def stats(self):
+        """
+        Return each stage's item count, busy and blocked time, utilization and queue depth so far.
+        """
+        end_time = self._end_time if self._end_time is not None else time.perf_counter()
+        elapsed_seconds = end_time - self._start_time if self._start_time is not None else 0.0
+
+        return [stage.stats(elapsed_seconds) for stage in self._stages]
+
+    def format_stats(self):
+        """
+        Describe each stage's stats on its own line, marking the busiest stage as the bottleneck.
+        """
+        stats = self.stats()
+        bottleneck = max(stats, key=lambda stage_stats: stage_stats["utilization"]) if stats else None
+        lines = []
+
+        for stage_stats in stats:
+            lines.append(
+                f"  {stage_stats['name']}: {stage_stats['items']} items, "
+                f"busy {stage_stats['busy_seconds']:.1f}s ({stage_stats['utilization']:.0%}), "
+                f"blocked {stage_stats['blocked_seconds']:.1f}s, "
+                f"queue max {stage_stats['max_queue_depth']}/{stage_stats['queue_size']}"
+                + (" <- bottleneck" if stage_stats is bottleneck else "")
+            )
+
+        return "\n".join(lines)
+
+    def _run_worker(self, stage, next_stage):
+        try:
+            while True:
+                item = self._get(stage)
+
+                if item is END_OF_ITEMS or self._stop_event.is_set():
+                    break
+
+                start_time = time.perf_counter()
+                result = stage.function(item)
+                busy_seconds = time.perf_counter() - start_time
+
+                # Time spent waiting here means the next stage is the slower one
+                if next_stage is not None:
+                    if not self._put(next_stage, result):
+                        break
+
+                stage.record_item(busy_seconds, time.perf_counter() - start_time - busy_seconds)
+
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            self._stop_event.set()
+
+        # The last worker of the stage tells every worker of the next stage there are no more items.
+        # After a stop the next stage's workers exit by themselves, so the markers aren't needed
+        if stage.finish_worker() and next_stage is not None:
+            for _ in range(next_stage.workers):
+                self._put(next_stage, END_OF_ITEMS)
+
+    def _put(self, stage, item):
+        # Wait for space in the stage's queue. Returns False if the pipeline was stopped while waiting
+        while not self._stop_event.is_set():
+            try:
+                stage.input_queue.put(item, timeout=STOP_CHECK_INTERVAL)
+                stage.record_queue_depth()
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _get(self, stage):
+        while not self._stop_event.is_set():
+            try:
+                return stage.input_queue.get(timeout=STOP_CHECK_INTERVAL)
+            except queue.Empty:
+                pass
+
+        return END_OF_ITEMS
@@ -1,6 +1,5 @@
-# Import necessary libraries for interacting with different LLMs (OpenAI)
-import openai
 from enum import Enum
+from llm_response_cache import LlmResponseCache
 
 
 # Define an Enum to categorize different model sources/types
@@ -10,8 +9,36 @@ class Model_Type(Enum):
     OPEN_AI = 3          # OpenAI's API model
 
 
-# Main function to generate a JSON-formatted response from a given prompt and LLM
-def generate_json_text(initial_prompt, llm, schema):
+# System prompt sent with every request to a local model
+SYSTEM_PROMPT = "You are a helpful assistant that outputs in JSON."
+
+# Responses of both local and cloud models, reused when the same request is made again.
+# A model's config can turn it off with use_response_cache
+llm_response_cache = LlmResponseCache()
+
+
+# Main function to generate a JSON-formatted response from a given prompt and LLM.
+# attempt numbers repeated requests for the same prompt, so a retry gets a new response rather than the cached one it rejected
+def generate_json_text(initial_prompt, llm, schema, attempt=0):
+    use_response_cache = llm.model_config.get('use_response_cache', True)
+
+    # Reuse the response if the same model was already asked the same thing with the same settings
+    if use_response_cache:
+        cache_key = llm_response_cache.get_key(initial_prompt, llm, schema, attempt)
+        response = llm_response_cache.get(cache_key)
+
+        if response is not None:
+            return response
+
+    response = generate_uncached_json_text(initial_prompt, llm, schema)
+
+    if use_response_cache:
+        llm_response_cache.set(cache_key, response)
+
+    return response
+
+
+def generate_uncached_json_text(initial_prompt, llm, schema):
     model_type = llm.model_config['model_type']
 
     # Call corresponding generation method for the model type
@@ -24,14 +51,22 @@ def generate_json_text(initial_prompt, llm, schema):
         raise ValueError(f"Invalid Model Type: {model_type}")
 
 
+# Hit/miss statistics of the LLM response cache
+def get_llm_response_cache_stats():
+    return llm_response_cache.stats()
+
+
 # Function to handle text generation using a local model
 def generate_local_json_text(initial_prompt, llm, schema):
+    # Restore the evaluated system prompt and instructions, if another request has replaced them in the context
+    llm.prompt_cache.prepare(llm.model)
+
     # Construct the chat completion request with system and user messages
     response = llm.model.create_chat_completion(
         messages=[
             {
                 "role": "system",
-                "content": "You are a helpful assistant that outputs in JSON.",
+                "content": SYSTEM_PROMPT,
             },
             {"role": "user", "content": initial_prompt},
         ],
@@ -43,10 +78,15 @@ def generate_local_json_text(initial_prompt, llm, schema):
         seed = llm.model_config['seed']  # For deterministic output
     )
     
+    llm.prompt_cache.record(llm.model, response['usage']['prompt_tokens'])
+    
     return response
 
 # Function to handle text generation using OpenAI's ChatCompletion API
 def generate_open_ai_json_text(initial_prompt, llm, schema):
+    # Import the OpenAI library only when it is used, so local models never pay for loading it
+    import openai
+
     openai.api_key = llm.model_config['api_key']  # Set API key
 
     # Make a chat completion call to OpenAI's API
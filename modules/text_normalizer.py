@@ -0,0 +1,180 @@
+import re
+import os
+
+# Characters kept by clean_text. Anything else is removed
+DISALLOWED_CHARACTER_PATTERN = re.compile(r'[^a-zA-Z0-9\s,.\'"!?()\[\]:;&\n-]+')
+
+# Separates lines when a batch is cleaned in one pass. No rule matches it, so lines cannot affect each other
+LINE_SEPARATOR = "\x00"
+
+# Same as DISALLOWED_CHARACTER_PATTERN, but keeps the line separator so the batch can be split up again afterwards
+BATCH_DISALLOWED_CHARACTER_PATTERN = re.compile(r'[^a-zA-Z0-9\s,.\'"!?()\[\]:;&\n\x00-]+')
+
+# The ASCII characters each pattern removes, so ASCII text can be filtered with bytes.translate instead of a regex
+DISALLOWED_ASCII_CHARACTERS = bytes(c for c in range(128) if DISALLOWED_CHARACTER_PATTERN.match(chr(c)))
+BATCH_DISALLOWED_ASCII_CHARACTERS = bytes(c for c in range(128) if BATCH_DISALLOWED_CHARACTER_PATTERN.match(chr(c)))
+
+# Double periods '..' that are not part of an ellipsis.
+# The patterns below start with a literal character so the regex engine can skip ahead to it instead of trying every position
+DOUBLE_PERIOD_PATTERN = re.compile(r'\.(?<!\.\.)\.(?!\.)')
+
+# A newline that starts a new sentence without punctuation before it
+SENTENCE_BREAK_PATTERN = re.compile(r'\n(?<![.,;:]\n)(?=[A-Z])')
+
+# Marks sentence breaks and line breaks after a period until the periods are converted.
+# Both are always removed by the character filter, so they can't already be in the text
+SENTENCE_BREAK_PLACEHOLDER = "\x01"
+PERIOD_LINE_BREAK_PLACEHOLDER = "\x02"
+
+# Maximum number of characters in a word before it is split
+MAX_WORD_SIZE = 19
+
+
+# Clean text from special characters and formatting issues.
+# Periods and quotation marks become new lines unless keep_sentence_punctuation is set, in which case
+# sentences keep their periods, quotation marks are removed and line breaks become spaces, for the segment packer
+def clean_text(text, keep_sentence_punctuation=False):
+    return normalize_text(text, keep_sentence_punctuation=keep_sentence_punctuation)
+
+
+# Clean a list of texts, giving the same results as calling clean_text on each one.
+# The texts are joined and cleaned in one pass, which is much faster than cleaning them one at a time
+def clean_texts(texts, keep_sentence_punctuation=False):
+    if not texts:
+        return []
+
+    # Texts containing the separator can't be split apart again afterwards, so clean them one at a time
+    if any(LINE_SEPARATOR in text for text in texts):
+        return [clean_text(text, keep_sentence_punctuation) for text in texts]
+
+    text = normalize_text(LINE_SEPARATOR.join(texts), keep_line_separator=True, keep_sentence_punctuation=keep_sentence_punctuation)
+    return text.split(LINE_SEPARATOR)
+
+
+# Apply every cleaning rule to the text. Plain string replacements run in C and are faster than a translation
+# table or a single regex with a Python callback, so only the rules that need a regex use one
+def normalize_text(text, keep_line_separator=False, keep_sentence_punctuation=False):
+
+    # Replace various special and problematic characters with standard ones. The typographic ones can't be in ASCII text
+    if not text.isascii():
+        text = text.replace("—", "-").replace("”", '"').replace("“", '"').replace("’", "'")
+
+    text = text.replace(". . .", "...").replace("''", "'").replace('""', '"')
+    text = text.replace("Mr.", "Mr").replace("Mrs.", "Mrs").replace("Dr.", "Dr").replace("Co.", "Co")
+    text = text.replace("!.", "!").replace("?.", "?").replace("'.", "'").replace("\".", "\"")
+    text = text.replace(" .", "")
+
+    # Replace double periods '..' with a single period, unless it's an ellipsis
+    text = DOUBLE_PERIOD_PATTERN.sub('', text)
+
+    # Remove characters that aren't alphanumeric or selected punctuation
+    if text.isascii():
+        disallowed_characters = BATCH_DISALLOWED_ASCII_CHARACTERS if keep_line_separator else DISALLOWED_ASCII_CHARACTERS
+        text = text.encode("ascii").translate(None, disallowed_characters).decode("ascii")
+    else:
+        disallowed_character_pattern = BATCH_DISALLOWED_CHARACTER_PATTERN if keep_line_separator else DISALLOWED_CHARACTER_PATTERN
+        text = disallowed_character_pattern.sub('', text)
+
+    # Add periods where a newline starts a new sentence without punctuation and join the other lines not ending in a period
+    text = SENTENCE_BREAK_PATTERN.sub(SENTENCE_BREAK_PLACEHOLDER, text)
+    text = text.replace(".\n", PERIOD_LINE_BREAK_PLACEHOLDER).replace("\n", " ")
+
+    if keep_sentence_punctuation:
+        # Sentences that already end in ! or ? don't need the added period
+        text = text.replace('"', " ").replace(PERIOD_LINE_BREAK_PLACEHOLDER, ". ")
+        text = text.replace("!" + SENTENCE_BREAK_PLACEHOLDER, "! ").replace("?" + SENTENCE_BREAK_PLACEHOLDER, "? ")
+        return text.replace(SENTENCE_BREAK_PLACEHOLDER, ". ")
+
+    # Convert quotation marks and periods to new lines to reduce the TTS modules problems with splitting.
+    # The placeholders become the converted form of the ". " and ".\n" they stand for
+    text = text.replace(".", "\n").replace('"', "\n")
+    return text.replace(PERIOD_LINE_BREAK_PLACEHOLDER, "\n\n").replace(SENTENCE_BREAK_PLACEHOLDER, "\n ")
+
+
+# Break down text lines exceeding the maximum length
+def limit_sentence_length(text, max_line_length):
+    lines = []
+
+    for line in text.split("\n"):
+        words = line.split()
+
+        if not words:
+            continue
+
+        # Most lines are short with no overly long words, and joining the words already gives the cleaned line
+        if len(line) <= max_line_length and max(map(len, words)) <= MAX_WORD_SIZE:
+            lines.append(" ".join(words))
+            continue
+
+        # Limit overly long words in the line
+        line = limit_word_size(line)
+
+        # If the line exceeds the maximum length, split and recursively process it
+        if len(line) > max_line_length:
+            line = limit_sentence_length(split_line(line), max_line_length)
+
+        # Remove empty lines and whitespace around the line
+        line = os.linesep.join([s for s in line.splitlines() if s]).strip(" ")
+
+        if line:
+            lines.append(line)
+
+    # Reconstruct the processed lines into a single string
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+# Limit overly long words on every line of the text, keeping the line breaks
+def limit_text_word_size(text):
+    return "\n".join(limit_word_size(line) for line in text.split("\n"))
+
+
+# Split a line near the middle (by period if possible, space if not)
+def split_line(line):
+
+    # Determine halfway point of the line
+    half_index = round(len(line) / 2)
+
+    # Create two parts around the midpoint
+    first_half_string = line[:half_index]
+    second_half_string = line[half_index:]
+
+    # Look for the nearest full stop and space in each half
+    first_full_stop_index = first_half_string.rfind(".")
+    second_full_stop_index = second_half_string.find(".")
+    first_space_index = first_half_string.rfind(" ")
+    second_space_index = second_half_string.find(" ")
+
+    # Choose the best splitting point based on proximity to midpoint
+    if first_full_stop_index >= 0 and second_full_stop_index >= 0:
+        if (len(first_half_string) - first_full_stop_index) < second_full_stop_index:
+            space_index = first_full_stop_index
+        else:
+            space_index = second_full_stop_index + len(first_half_string)
+
+    elif first_full_stop_index >= 0:
+        space_index = first_full_stop_index
+    elif second_full_stop_index >= 0:
+        space_index = second_full_stop_index + len(first_half_string)
+    elif (len(first_half_string) - first_space_index) < second_space_index:
+        space_index = first_space_index
+    elif (len(first_half_string) - first_space_index) >= second_space_index:
+        space_index = second_space_index + len(first_half_string)
+    else:
+        space_index = half_index
+
+    # Insert a newline at the chosen split point
+    return line[:space_index] + "\n" + line[space_index + 1:]
+
+
+# Split very long words into smaller chunks
+def limit_word_size(line):
+    result = []
+
+    for word in line.split():
+        if len(word) > MAX_WORD_SIZE:
+            # Break long word into chunks with line breaks between them
+            result.append("\n".join(word[i:i + MAX_WORD_SIZE] for i in range(0, len(word), MAX_WORD_SIZE)))
+        else:
+            result.append(word)
+
+    return " ".join(result)
@@ -1,159 +1,249 @@
 # Import the TTS (Text-to-Speech) API from Coqui
 from TTS.api import TTS
-import re
-import os
+from TTS import __version__ as TTS_VERSION
+from tts_model_loader import COQUI_MODEL_NAME, inference_context
+from speaker_conditioning_cache import SpeakerConditioningCache
+from synthesis_cache import SynthesisCache
+from text_normalizer import clean_texts, limit_sentence_length, limit_text_word_size
+from segment_packer import DEFAULT_SEGMENT_LENGTH, pack_segments, get_segment_plan_stats
+from xtts_batch_inference import xtts_inference_batch
+import numpy as np
 
 # Maximum allowed line length for audio generation
 MAX_LINE_LENGTH = 600
 
+# Language passed to the Coqui model
+COQUI_LANGUAGE = "en"
 
-# Main function to generate audio using the specified model type
-def generate_audio(text, voice, tts, output_path, model_type):
+# Pack sentences into segments close to the model's length limit, instead of synthesizing every sentence fragment separately
+USE_SEGMENT_PACKING = True
+
+# Maximum characters per segment. None uses the XTTS tokenizer's limit for the language (250 for English)
+COQUI_SEGMENT_LENGTH = None
+
+# Samples of silence inserted after each segment (matches the Coqui synthesizer)
+SEGMENT_SILENCE_SAMPLES = 10000
+
+# Identifies the model that produced cached speaker conditioning, so a model upgrade invalidates the cache
+COQUI_MODEL_VERSION = f"{COQUI_MODEL_NAME}@{TTS_VERSION}"
+
+# Precomputed speaker conditioning, shared by every synthesis call in this process
+speaker_conditioning_cache = SpeakerConditioningCache()
+
+# Previously synthesized segments, checked before calling the model
+USE_SYNTHESIS_CACHE = True
+synthesis_cache = SynthesisCache()
+
+# Most segments of one voice synthesized in one batch. 1 synthesizes every segment on its own
+COQUI_BATCH_SIZE = 8
+
+# A segment only joins a batch if it is at most this many times as long as the batch's shortest segment,
+# as every segment in a batch is padded to the longest
+COQUI_BATCH_LENGTH_RATIO = 1.5
+
+
+# Synthesize text into audio samples using the specified model type
+def synthesize_audio(text, voice, tts, model_type):
+    return synthesize_segment_plan(get_segment_plan([text], tts, model_type), [voice], tts, model_type)[0]
+
+
+# Split texts into the segments the model will synthesize, returning a list of segments for each text.
+# Callers can use the plan to see how many model calls the texts will take, or to batch and cache by segment
+def get_segment_plan(texts, tts, model_type):
     
-    # Currently, only the 'coqui' model is supported
     if model_type == "coqui":
-        return coqui_generate_audio(text, voice, tts, output_path)
+        return coqui_get_segment_plan(texts, tts)
         
-    # Raise an error for unsupported model types
     raise ValueError(f"Invalid model type: {model_type}")
+
+
+# Synthesize a segment plan from get_segment_plan with a voice for each text, returning the audio samples for each text
+def synthesize_segment_plan(segment_plan, voices, tts, model_type):
     
-    
-# Audio generation specifically for the Coqui TTS model
-def coqui_generate_audio(text, voice, tts, output_path):
+    if model_type == "coqui":
+        return coqui_synthesize_segment_plan(segment_plan, voices, tts)
+        
+    raise ValueError(f"Invalid model type: {model_type}")
 
-    # Shorten long sentences if a max line length is set
-    if MAX_LINE_LENGTH > 0:
-        text = limit_sentence_length(text, MAX_LINE_LENGTH)
+
+# Maximum characters per segment of the specified model type
+def get_segment_length(tts, model_type):
+    
+    if model_type == "coqui":
+        return get_coqui_segment_length(tts)
         
-    # Clean up unwanted or problematic characters in the text
-    text = clean_text(text)
+    raise ValueError(f"Invalid model type: {model_type}")
+
+
+# Sample rate of the audio produced by the specified model type
+def get_output_sample_rate(tts, model_type):
+    
+    if model_type == "coqui":
+        return tts.synthesizer.output_sample_rate
         
-    if len(text) > 0:
-        # Use Coqui TTS to generate audio from text
-        tts.tts_to_file(text, speaker_wav=voice, language="en", file_path=output_path)
+    raise ValueError(f"Invalid model type: {model_type}")
+    
+    
+# Hit/miss statistics of the synthesis cache
+def get_synthesis_cache_stats():
+    return synthesis_cache.stats()
+    
     
-    # Return the path where the audio file was saved
-    return output_path
+# Shorten and clean texts so they are ready to be passed to the TTS model, cleaning the whole batch in one pass
+def prepare_texts_for_synthesis(texts):
+    
+    if MAX_LINE_LENGTH > 0:
+        texts = [limit_sentence_length(text, MAX_LINE_LENGTH) for text in texts]
+        
+    return clean_texts(texts)
 
 
-# Function to clean text from special characters and formatting issues
-def clean_text(text):
+# Maximum characters per segment for the Coqui model, taken from the XTTS tokenizer's limit for the language unless set
+def get_coqui_segment_length(tts):
     
-    # Replace various special and problematic characters with standard ones
-    text = text.replace("—", "-").replace(". . .", "...")
-    text = text.replace("”", '"').replace("“", '"').replace("’", "'").replace("''", "'").replace('""', '"')
-    text = text.replace("Mr.", "Mr").replace("Mrs.", "Mrs").replace("Dr.", "Dr").replace("Co.", "Co")
-    text = text.replace("!.", "!").replace("?.", "?").replace("'.", "'").replace("\".", "\"")
-    text = text.replace(" .", "")
+    if COQUI_SEGMENT_LENGTH is not None:
+        return COQUI_SEGMENT_LENGTH
     
-    # Replace double periods '..' with a single period, unless it's an ellipsis
-    text = re.sub(r'(?<!\.)\.\.(?!\.)', '', text)
+    tokenizer = getattr(tts.synthesizer.tts_model, "tokenizer", None)
+    char_limits = getattr(tokenizer, "char_limits", {})
     
-    # Remove characters that aren't alphanumeric or selected punctuation
-    text = re.sub(r'[^a-zA-Z0-9\s,.\'"!?()\[\]:;&\n-]', '', text)
+    return char_limits.get(COQUI_LANGUAGE, DEFAULT_SEGMENT_LENGTH)
+
+
+# Split texts into the segments passed to the Coqui model
+def coqui_get_segment_plan(texts, tts):
     
-    # Add periods where a newline starts a new sentence without punctuation
-    place_holder = "PLACE_HOLDER_STRING"
-    text = re.sub(r'(?<![.,;:])\n(?=[A-Z])', place_holder, text)
-    text = re.sub(r'(?<!\.)\n', ' ', text)
-    text = re.sub(place_holder, '. ', text)
+    # Pack whole sentences into segments as close to the model's limit as possible
+    if USE_SEGMENT_PACKING:
+        max_segment_length = get_coqui_segment_length(tts)
+        texts = clean_texts([limit_text_word_size(text) for text in texts], keep_sentence_punctuation=True)
+        return [pack_segments(text, max_segment_length) for text in texts]
     
-    # Convert quatation marks and periods to new lines to reduce the TTS modules problems with splitting
-    text = text.replace(".", "\n")
-    text = text.replace('"', "\n")
+    # Otherwise synthesize every fragment of the cleaned text separately, the same way tts_to_file does
+    segment_plan = []
     
-    return text
+    for text in prepare_texts_for_synthesis(texts):
+        sentences = tts.synthesizer.split_into_sentences(text) if len(text) > 0 else []
+        segment_plan.append([sentence for sentence in sentences if sentence.strip()])
+        
+    return segment_plan
 
 
-# Function to break down text lines exceeding the maximum length
-def limit_sentence_length(text, max_line_length):
+# Print how many segments a plan has and how full they are
+def print_segment_plan_stats(segment_plan, tts, model_type, description="Segment plan"):
+    max_segment_length = get_segment_length(tts, model_type)
+    stats = get_segment_plan_stats(segment_plan, max_segment_length)
+    
+    print(
+        f"{description}: {stats['texts']} texts in {stats['segments']} segments, {stats['characters']} characters, "
+        f"average {stats['average_segment_length']:.0f} characters ({stats['fill_ratio']:.0%} of {max_segment_length})"
+    )
+
+
+# Version of the loaded Coqui model used to key the caches. A quantized model sounds slightly different, so it gets its own entries
+def get_coqui_model_version(tts):
+    performance_profile = getattr(tts, "performance_profile", None)
     
-    # Break text into lines using newlines
-    text = text.split("\n")
+    if performance_profile is not None and performance_profile.get('quantize'):
+        return COQUI_MODEL_VERSION + "+int8"
+        
+    return COQUI_MODEL_VERSION
+
+
+# Group segments of the same voice into batches of up to COQUI_BATCH_SIZE segments of similar length.
+# segments is a list of (voice, segment text, anything else), and batches are returned as lists of its entries
+def plan_coqui_batches(segments):
+    batches = []
+    segments_by_voice = {}
+    
+    for segment in segments:
+        segments_by_voice.setdefault(segment[0], []).append(segment)
     
-    for i, line in enumerate(text):
-        print("\n\nLine:\n", line)
+    for voice_segments in segments_by_voice.values():
+        batch = []
+        
+        for segment in sorted(voice_segments, key=lambda segment: len(segment[1])):
+            if batch and (len(batch) >= COQUI_BATCH_SIZE or len(segment[1]) > len(batch[0][1]) * COQUI_BATCH_LENGTH_RATIO):
+                batches.append(batch)
+                batch = []
+                
+            batch.append(segment)
+            
+        if batch:
+            batches.append(batch)
+    
+    return batches
+
+
+# Synthesize a segment plan with the Coqui model, with a voice for each text, reusing cached speaker conditioning for each voice.
+# Segments that aren't cached are grouped by voice into batches of similar length, each synthesized in one pass,
+# and put back in order. Returns the audio samples for each text, with a pause after every segment
+def coqui_synthesize_segment_plan(segment_plan, voices, tts):
+    synthesizer = tts.synthesizer
+    xtts_model = synthesizer.tts_model
+    config = synthesizer.tts_config
+    model_version = get_coqui_model_version(tts)
+    
+    # Every setting that changes the generated audio, used to key the synthesis cache
+    synthesis_params = {
+        "language": COQUI_LANGUAGE,
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p
+    }
+    sampling_params = {key: value for key, value in synthesis_params.items() if key != "language"}
+    
+    # Audio of every segment, keyed by (text index, segment index), and the segments still to synthesize
+    segment_wavs = {}
+    uncached_segments = []
+    
+    for text_index, (segments, voice) in enumerate(zip(segment_plan, voices)):
+        voice_hash = speaker_conditioning_cache.get_voice_hash(voice)
         
-        # Limit overly long words in the line
-        line = limit_word_size(line)
+        for segment_index, segment in enumerate(segments):
+            
+            # Reuse the audio if this segment has already been synthesized with the same voice and settings
+            cache_key = synthesis_cache.get_key(segment, voice_hash, model_version, synthesis_params) if USE_SYNTHESIS_CACHE else None
+            wav = synthesis_cache.get(cache_key) if USE_SYNTHESIS_CACHE else None
+            
+            if wav is not None:
+                segment_wavs[(text_index, segment_index)] = wav
+            else:
+                uncached_segments.append((voice, segment, (text_index, segment_index), cache_key))
+    
+    for batch in plan_coqui_batches(uncached_segments):
+        voice = batch[0][0]
         
-        # If the line exceeds the maximum length, split and recursively process it
-        if len(line) > max_line_length:
-            line = split_line(line)
-            line = limit_sentence_length(line, max_line_length)  # Recursively shorten
+        # Only compute the conditioning latents the first time a voice file is used
+        gpt_cond_latent, speaker_embedding = speaker_conditioning_cache.get_conditioning_latents(xtts_model, voice, model_version)
         
-        # Reformat the lines and clean extra whitespace
-        line = line + "\n"
-        line = os.linesep.join([s for s in line.splitlines() if s])
-        text[i] = line.replace("\n\n", "\n").lstrip(" ").rstrip(" ")
-    
-    # Remove any empty lines
-    filtered_text = [line for line in text if line]
-    
-    # Reconstruct the processed lines into a single string
-    return '\n'.join(filtered_text) + '\n' if filtered_text else ''
-
-
-# Function to split a line near the middle (by period if possible, space if not)
-def split_line(line):
-    
-    # Determine halfway point of the line
-    half_index = round(len(line) / 2)
-    
-    # Create two parts around the midpoint
-    first_half_string = line[:half_index]
-    second_half_string = line[half_index:]
-    
-    # Look for the nearest full stop and space in each half
-    first_full_stop_index = first_half_string.rfind(".")
-    second_full_stop_index = second_half_string.find(".")
-    first_space_index = first_half_string.rfind(" ")
-    second_space_index = second_half_string.find(" ")
-    
-    # Choose the best splitting point based on proximity to midpoint
-    if first_full_stop_index >= 0 and second_full_stop_index >= 0:
-        if (len(first_half_string) - first_full_stop_index) < second_full_stop_index:
-            space_index = first_full_stop_index
-        else:
-            space_index = second_full_stop_index + len(first_half_string)
-                                
-    elif first_full_stop_index >= 0:
-        space_index = first_full_stop_index
-    elif second_full_stop_index >= 0:
-        space_index = second_full_stop_index + len(first_half_string)
-    elif (len(first_half_string) - first_space_index) < second_space_index:
-        space_index = first_space_index
-    elif (len(first_half_string) - first_space_index) >= second_space_index:
-        space_index = second_space_index + len(first_half_string)
-    else:
-        space_index = half_index
-    
-    # Insert a newline at the chosen split point
-    line = line[:space_index] + "\n" + line[space_index + 1:]
-    
-    return line
-
-
-# Function to split very long words into smaller chunks
-def limit_word_size(line):
-    
-    # Break line into individual words
-    line = line.split()
-    result = []
-    
-    # Define maximum word length
-    max_word_size = 19
-    
-    # Process each word
-    for word in line:
-        if len(word) > max_word_size:
-            # Break long word into chunks
-            chunks = [word[i:i + max_word_size] for i in range(0, len(word), max_word_size)]
-            result.append("\n".join(chunks))  # Add line breaks within long word
-        else:
-            result.append(word)
-    
-    # Recombine words into a single line
-    final_result = " ".join(result)
-    
-    return final_result
+        with inference_context(tts):
+            if len(batch) == 1:
+                outputs = xtts_model.inference(batch[0][1], COQUI_LANGUAGE, gpt_cond_latent, speaker_embedding, **sampling_params)
+                wavs = [np.asarray(outputs["wav"], dtype=np.float32)]
+            else:
+                wavs = xtts_inference_batch(
+                    xtts_model, [segment for _, segment, _, _ in batch], COQUI_LANGUAGE, gpt_cond_latent, speaker_embedding, **sampling_params
+                )
+        
+        for (_, _, position, cache_key), wav in zip(batch, wavs):
+            segment_wavs[position] = wav
+            
+            if USE_SYNTHESIS_CACHE:
+                synthesis_cache.set(cache_key, wav)
+    
+    # Put the segments back in reading order
+    text_wavs = []
+    
+    for text_index, segments in enumerate(segment_plan):
+        wavs = []
+        
+        for segment_index in range(len(segments)):
+            wavs.append(segment_wavs[(text_index, segment_index)])
+            wavs.append(np.zeros(SEGMENT_SILENCE_SAMPLES, dtype=np.float32))
+        
+        text_wavs.append(np.concatenate(wavs) if wavs else np.zeros(0, dtype=np.float32))
+    
+    return text_wavs
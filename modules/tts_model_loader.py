@@ -1,17 +1,37 @@
 from TTS.api import TTS
+import contextlib
+import time
 import torch
 
-def load_tts_model(model_type):
+# Name of the Coqui XTTS model that is loaded
+COQUI_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+
+# Text synthesized once after loading when torch.compile is enabled, so compilation happens before real work starts
+COMPILE_WARM_UP_TEXT = "This sentence warms up the compiled model."
+
+
+# Settings of the opt-in CPU performance profile. Passing no profile loads the model exactly as before
+def get_cpu_performance_profile(quantize=True, inference_mode=True, intra_op_threads=None, inter_op_threads=None, torch_compile=False):
+    return {
+        'quantize': quantize,                  # Dynamic int8 quantization of the linear layers
+        'inference_mode': inference_mode,      # Run synthesis inside torch.inference_mode
+        'intra_op_threads': intra_op_threads,  # Threads used within an operator, None keeps the torch default
+        'inter_op_threads': inter_op_threads,  # Threads used between operators, None keeps the torch default
+        'torch_compile': torch_compile         # Compile the vocoder with torch.compile and warm it up after loading
+    }
+
+
+def load_tts_model(model_type, performance_profile=None):
     
     # Currently, only the 'coqui' model is supported
     if model_type == "coqui":
-        return load_coqui_model()
+        return load_coqui_model(performance_profile)
         
     raise Exception("Invalid model type:", model_type)
     
 
 # Load TTS model
-def load_coqui_model():
+def load_coqui_model(performance_profile=None):
     
     # Use cuda if available, otherwise use the cpu
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -19,6 +39,108 @@ def load_coqui_model():
     print("Using device:", device)
     
     # Load TTS model
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+    tts = TTS(COQUI_MODEL_NAME).to(device)
+    tts.performance_profile = None
+    
+    # The performance profile is tuned for the CPU, a GPU is already fast without it
+    if performance_profile is not None and device == "cpu":
+        apply_cpu_performance_profile(tts, performance_profile)
+    
+    return tts
+
+
+# Apply the CPU performance profile to a loaded Coqui model
+def apply_cpu_performance_profile(tts, performance_profile):
+    xtts_model = tts.synthesizer.tts_model
+    
+    set_torch_threads(performance_profile.get('intra_op_threads'), performance_profile.get('inter_op_threads'))
+    
+    if performance_profile.get('quantize'):
+        quantize_linear_layers(xtts_model)
+        
+    if performance_profile.get('torch_compile'):
+        # The vocoder is a fixed stack of convolutions that compiles well, the GPT decoding loop doesn't
+        xtts_model.hifigan_decoder = torch.compile(xtts_model.hifigan_decoder, dynamic=True)
+        
+    tts.performance_profile = performance_profile
+    
+    if performance_profile.get('torch_compile'):
+        warm_up_coqui_model(tts)
+        
+    print("CPU performance profile:", performance_profile)
+
+
+# Replace the linear layers of the model with dynamically quantized int8 versions
+def quantize_linear_layers(xtts_model):
+    start_time = time.perf_counter()
+    
+    # The GPT-2 blocks use transformers' Conv1D, which is a linear layer with its weight transposed.
+    # Convert them first so quantization reaches the layers that do most of the work
+    converted_layers = convert_conv1d_to_linear(xtts_model.gpt)
     
-    return tts
\ No newline at end of file
+    torch.ao.quantization.quantize_dynamic(xtts_model.gpt, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    
+    print(f"Quantized linear layers to int8 in {time.perf_counter() - start_time:.2f} seconds ({converted_layers} Conv1D layers converted)")
+
+
+# Replace every transformers Conv1D module with the equivalent torch.nn.Linear, returning how many were replaced
+def convert_conv1d_to_linear(module):
+    converted_layers = 0
+    
+    for name, child in module.named_children():
+        if type(child).__name__ == "Conv1D" and hasattr(child, "nf"):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, device=child.weight.device, dtype=child.weight.dtype)
+            
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                linear.bias.copy_(child.bias)
+                
+            setattr(module, name, linear)
+            converted_layers += 1
+        else:
+            converted_layers += convert_conv1d_to_linear(child)
+            
+    return converted_layers
+
+
+# Synthesize a short sentence so torch.compile compiles the model now rather than during the first real line
+def warm_up_coqui_model(tts):
+    xtts_model = tts.synthesizer.tts_model
+    config = tts.synthesizer.tts_config
+    start_time = time.perf_counter()
+    
+    # Random conditioning is enough to trace the vocoder, no voice file is needed
+    gpt_cond_latent = torch.randn(1, 32, config.model_args.gpt_n_model_channels)
+    speaker_embedding = torch.randn(1, config.model_args.d_vector_dim, 1)
+    
+    with inference_context(tts):
+        xtts_model.inference(COMPILE_WARM_UP_TEXT, "en", gpt_cond_latent, speaker_embedding)
+        
+    print(f"Warmed up compiled model in {time.perf_counter() - start_time:.2f} seconds")
+
+
+# Context to run synthesis in, torch.inference_mode when the model's performance profile asks for it
+def inference_context(tts):
+    performance_profile = getattr(tts, "performance_profile", None)
+    
+    if performance_profile is not None and performance_profile.get('inference_mode'):
+        return torch.inference_mode()
+        
+    return contextlib.nullcontext()
+
+
+# Set how many threads torch uses for operations within and between operators
+def set_torch_threads(intra_op_threads=None, inter_op_threads=None):
+    
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+        
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op parallel work has started
+            print("Could not set inter-op threads:", e)
+            
+    print("Torch threads:", torch.get_num_threads(), "intra-op,", torch.get_num_interop_threads(), "inter-op")
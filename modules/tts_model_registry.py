@@ -0,0 +1,126 @@
+import gc
+import time
+import threading
+from collections import OrderedDict
+
+# Number of TTS backends that can be resident at once before the least recently used one is evicted
+DEFAULT_MAX_LOADED_MODELS = 1
+
+
+class TtsModelRegistry:
+    """
+    Loads each TTS backend once and hands out the same instance on every request.
+    When more backends are requested than max_loaded_models allows, the least recently used one is unloaded.
+    Models are loaded with the given performance profile (see tts_model_loader.get_cpu_performance_profile), if any.
+    """
+
+    def __init__(self, max_loaded_models=DEFAULT_MAX_LOADED_MODELS, performance_profile=None):
+        self._max_loaded_models = max(1, max_loaded_models)
+        self._performance_profile = performance_profile
+        self._models = OrderedDict()  # model_type -> loaded model, ordered from least to most recently used
+        self._load_times = {}         # model_type -> seconds taken to load
+        self._lock = threading.Lock()
+
+    def get_model(self, model_type):
+        """
+        Return the loaded model for the given type, loading it the first time it is requested.
+        """
+        with self._lock:
+            if model_type in self._models:
+                # Mark as most recently used
+                self._models.move_to_end(model_type)
+                return self._models[model_type]
+
+            # Make room for the new model before loading it so two large models are never resident at once
+            while len(self._models) >= self._max_loaded_models:
+                oldest_model_type = next(iter(self._models))
+                print(f"Evicting least recently used TTS model: {oldest_model_type}")
+                self._unload(oldest_model_type)
+
+            # The loader imports torch and the TTS library, which is only worth doing once a model is needed
+            from tts_model_loader import load_tts_model
+
+            start_time = time.perf_counter()
+            model = load_tts_model(model_type, self._performance_profile)
+            load_time = time.perf_counter() - start_time
+
+            self._models[model_type] = model
+            self._load_times[model_type] = load_time
+            print(f"Loaded TTS model '{model_type}' in {load_time:.2f} seconds")
+
+            return model
+
+    def unload(self, model_type):
+        """
+        Unload the model for the given type if it is loaded. Returns True if a model was unloaded.
+        """
+        with self._lock:
+            return self._unload(model_type)
+
+    def unload_all(self):
+        """
+        Unload every loaded model.
+        """
+        with self._lock:
+            for model_type in list(self._models):
+                self._unload(model_type)
+
+    def is_loaded(self, model_type):
+        return model_type in self._models
+
+    def get_load_time(self, model_type):
+        # Seconds the most recent load of this model type took, or None if it has never been loaded
+        return self._load_times.get(model_type)
+
+    @property
+    def loaded_models(self):
+        return list(self._models)
+
+    @property
+    def max_loaded_models(self):
+        return self._max_loaded_models
+
+    @max_loaded_models.setter
+    def max_loaded_models(self, value):
+        with self._lock:
+            self._max_loaded_models = max(1, value)
+
+            # Evict any models over the new limit
+            while len(self._models) > self._max_loaded_models:
+                self._unload(next(iter(self._models)))
+
+    @property
+    def performance_profile(self):
+        return self._performance_profile
+
+    @performance_profile.setter
+    def performance_profile(self, value):
+        with self._lock:
+            self._performance_profile = value
+
+            # Loaded models were set up with the old profile, so reload them on next use
+            for model_type in list(self._models):
+                self._unload(model_type)
+
+    def _unload(self, model_type):
+        model = self._models.pop(model_type, None)
+
+        if model is None:
+            return False
+
+        del model
+        gc.collect()
+
+        # A model was loaded, so torch has already been imported
+        import torch
+
+        # Release cached GPU memory if the model was on the GPU
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        print(f"Unloaded TTS model: {model_type}")
+        return True
+
+    def __str__(self):
+        loaded = ", ".join(f"{model_type} ({self._load_times[model_type]:.2f}s)" for model_type in self._models)
+        return f"TtsModelRegistry(loaded=[{loaded}], max_loaded_models={self._max_loaded_models})"
@@ -4,6 +4,7 @@ from ui_single_speaker_page import UiSingleSpeakerPage
 from ui_model_page import UiModelPage
 from ui_line_identifier_page import UiLineIdentifierPage
 from ui_multi_speaker_page import UiMultiSpeakerPage
+from ui_jobs_page import UiJobsPage
 
 LOCAL_HOST = "127.0.0.1"
 DEFAULT_PORT = "7860"
@@ -17,6 +18,7 @@ class Ui:
         ui_model_page = UiModelPage(self._session)
         ui_line_identifier_page = UiLineIdentifierPage(self._session)
         ui_multi_speaker_page = UiMultiSpeakerPage(self._session)
+        ui_jobs_page = UiJobsPage(self._session)
         
         # Wrap them into a tabbed interface
         main_ui = gr.TabbedInterface(
@@ -24,13 +26,15 @@ class Ui:
                 ui_single_speaker_page.single_speaker_page,
                 ui_model_page.model_page,
                 ui_line_identifier_page.line_identifier_page,
-                ui_multi_speaker_page.multi_speaker_page
+                ui_multi_speaker_page.multi_speaker_page,
+                ui_jobs_page.jobs_page
             ],
             [
                 "Single Speaker",
                 "Load Model",
                 "Line Identifier",
-                "Multi Speaker"
+                "Multi Speaker",
+                "Jobs"
             ]
         )
         
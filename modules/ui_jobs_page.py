@@ -0,0 +1,115 @@
+import os
+import gradio as gr
+from job_scheduler import format_duration, JOB_COMPLETED
+from audio_encoder import AUDIO_FORMATS
+
+# Seconds between automatic refreshes of the job table
+JOB_TABLE_REFRESH_INTERVAL = 2
+
+JOB_TABLE_HEADERS = ["ID", "Job", "Status", "Progress", "Elapsed", "ETA", "Details"]
+
+class UiJobsPage:
+    def __init__(self, session):
+        self._session = session
+        self.jobs_page = self.get_gradio_page()  # Build the UI
+
+    def get_job_table(self):
+        rows = []
+
+        # Newest jobs first
+        for job in reversed(self._session.get_jobs()):
+            status = job.get_status()
+
+            if status["error"] is not None:
+                details = status["error"]
+            elif status["status"] == JOB_COMPLETED:
+                details = str(status["result"])
+            else:
+                details = status["message"]
+
+            rows.append([
+                status["id"],
+                status["name"],
+                status["status"],
+                f"{status['progress']:.0%}",
+                format_duration(status["elapsed_seconds"]),
+                format_duration(status["eta_seconds"]) if status["eta_seconds"] is not None else "",
+                details
+            ])
+
+        return rows
+
+    def get_job_choices(self):
+        return [f"{job.id}: {job.name}" for job in reversed(self._session.get_jobs())]
+
+    def refresh_job_choices(self):
+        return gr.update(choices=self.get_job_choices())
+
+    def get_selected_job(self, job_choice):
+        if not job_choice:
+            return None
+
+        return self._session.get_job(int(job_choice.split(":")[0]))
+
+    def show_job(self, job_choice):
+        job = self.get_selected_job(job_choice)
+
+        if job is None:
+            return "Please select a job.", None
+
+        # Play the result if the job produced a single audio file
+        audio_path = None
+        if job.status == JOB_COMPLETED and job.result is not None and os.path.splitext(str(job.result))[1].lower() in AUDIO_FORMATS:
+            audio_path = str(job.result)
+
+        return str(job), audio_path
+
+    def cancel_job(self, job_choice):
+        job = self.get_selected_job(job_choice)
+
+        if job is None:
+            return "Please select a job."
+
+        if not self._session.cancel_job(job.id):
+            return f"Job {job.id} has already finished."
+
+        return f"Cancelling job {job.id}: {job.name}. A running job stops once its current line or chunk is done."
+
+    def get_gradio_page(self):
+        with gr.Blocks() as demo:
+            gr.Markdown("## Jobs")
+
+            # Table of every job, refreshed automatically
+            job_table = gr.Dataframe(headers=JOB_TABLE_HEADERS, value=self.get_job_table, label="Jobs", interactive=False)
+            timer = gr.Timer(JOB_TABLE_REFRESH_INTERVAL)
+            timer.tick(self.get_job_table, outputs=[job_table])
+
+            # Choose a job to view or cancel
+            job_choice = gr.Dropdown(choices=self.get_job_choices(), label="Select Job")
+            refresh_button = gr.Button("🔄 Refresh Job List")
+
+            with gr.Row():
+                show_button = gr.Button("Show Job")
+                cancel_button = gr.Button("Cancel Job")
+
+            status = gr.Textbox(label="Status")
+            output_audio = gr.Audio(label="Generated Audio")
+
+            refresh_button.click(
+                self.refresh_job_choices,
+                outputs=[job_choice]
+            )
+
+            show_button.click(
+                self.show_job,
+                inputs=[job_choice],
+                outputs=[status, output_audio]
+            )
+
+            cancel_button.click(
+                self.cancel_job,
+                inputs=[job_choice],
+                outputs=[status]
+            )
+
+        return demo
@@ -15,7 +15,7 @@ class UiLineIdentifierPage:
         self, input_type, input_text, input_file,
         start_section, end_section,
         output_type, new_book_folder_path, existing_output_folder,
-        max_retries
+        max_retries, line_output_format
     ):
         # Handle user input source
         if input_type == "Text":
@@ -59,19 +59,20 @@ class UiLineIdentifierPage:
         except ValueError:
             return "Max retries must be an integer."
 
-        # Call session to process lines
-        result = self._session.indentify_character_lines(
+        if self._session.llm is None:
+            return "No model loaded"
+
+        # Queue the line identification, it runs in the background and its progress is shown on the Jobs tab
+        job = self._session.submit_identify_character_lines(
             user_input, is_file,
             str(book_folder_path),
             start if is_file else 0,
             end if is_file else -1,
-            retries
+            retries,
+            line_output_format
         )
 
-        if result and ("no model" in result.lower() or "error" in result.lower()):
-            return result
-
-        return f"Lines identified and saved in: {book_folder_path or 'timestamped folder (auto-named)'}\n\n{result}"
+        return f"Submitted job {job.id}: {job.name}\nLines will be saved in: {book_folder_path or 'timestamped folder (auto-named)'}\nFollow its progress on the Jobs tab."
 
     def refresh_folder_choices(self):
         updated_folders = get_folders_in_directory(str(outputs_path))
@@ -135,6 +136,13 @@ class UiLineIdentifierPage:
                 info="Number of times to retry if there is no narrator in the output. May not want to be too high, as while no narrator in the output is usually a mistake, this is not always the case. Small chunk sizes have a higher chance of having no narrator and without it being a mistake"
             )
 
+            line_output_format = gr.Radio(
+                ["text", "sentence_index"],
+                value="text",
+                label="LLM Output Format",
+                info="text: the model copies every line with its speaker. sentence_index: the model only returns the speakers of numbered sentences and quotes, generating far fewer tokens, and the lines are rebuilt from the book's text"
+            )
+
             run_button = gr.Button("Identify Character Lines")
             result_text = gr.Textbox(label="Status")
 
@@ -144,7 +152,7 @@ class UiLineIdentifierPage:
                     input_type, input_text, input_file,
                     start_section, end_section,
                     output_type, new_output, existing_output,
-                    max_retries
+                    max_retries, line_output_format
                 ],
                 outputs=[result_text]
             )
@@ -2,6 +2,7 @@ import gradio as gr
 from pathlib import Path
 from utils import get_files_in_directory
 from llm_model_loader import Model_Type
+from llm_runtime_profile import get_runtime_presets, get_runtime_profile, get_cpu_counts, KV_CACHE_TYPES
 
 # Define the path to the models folder
 script_dir = Path(__file__).resolve().parent
@@ -12,7 +13,8 @@ class UiModelPage:
         self._session = session
         self.model_page = self.get_gradio_page()  # Initialize the Gradio UI
 
-    def load_model(self, model_source, model_dropdown, model_path_str, repo_id, context_length, gpu_layers, temperature, seed):
+    def load_model(self, model_source, model_dropdown, model_path_str, repo_id, context_length, gpu_layers, temperature, seed, llm_workers, use_response_cache, speculative_mode, draft_model_path, speculative_tokens,
+                   runtime_preset, n_threads, n_threads_batch, n_batch, n_ubatch, use_mmap, use_mlock, flash_attn, kv_cache_type):
         # Determine model path and type based on selected input method
         model_path = None
         model_type = None
@@ -46,18 +48,53 @@ class UiModelPage:
         except ValueError:
             seed = -1
 
+        if speculative_mode == "draft_model" and not draft_model_path.strip():
+            return "Error: A draft model path is required for draft model speculative decoding."
+
+        # The preset's settings as shown in the fields, changed or not. 0 threads keeps the llama.cpp default
+        try:
+            runtime_profile = get_runtime_profile(
+                runtime_preset,
+                n_threads=int(n_threads) or None,
+                n_threads_batch=int(n_threads_batch) or None,
+                n_batch=int(n_batch),
+                n_ubatch=int(n_ubatch),
+                use_mmap=use_mmap,
+                use_mlock=use_mlock,
+                flash_attn=flash_attn,
+                kv_cache_type=kv_cache_type
+            )
+        except ValueError as e:
+            return f"Error: {e}"
+
         # Load model using session handler
         llm = self._session.set_and_load_llm(
-            model_path, model_type, repo_id, context_length, gpu_layers, temperature, seed
+            model_path, model_type, repo_id, context_length, gpu_layers, temperature, seed, int(llm_workers), use_response_cache,
+            speculative_mode, draft_model_path.strip() or None, int(speculative_tokens), runtime_profile
         )
 
-        return f"Loaded model: {llm}"
+        return f"Loaded model: {llm}\n{self._session.llm_model_manager.format_load_report()}"
 
     def refresh_model_list(self):
         updated_models = get_files_in_directory(str(models_path), [".txt"])
         updated_models.insert(0, "--- Select a model ---")
         return gr.update(choices=updated_models)
 
+    # Show a preset's runtime settings in their fields
+    def apply_runtime_preset(self, runtime_preset):
+        profile = get_runtime_profile(runtime_preset)
+
+        return (
+            profile['n_threads'] or 0,
+            profile['n_threads_batch'] or 0,
+            profile['n_batch'],
+            profile['n_ubatch'],
+            profile['use_mmap'],
+            profile['use_mlock'],
+            profile['flash_attn'],
+            profile['kv_cache_type']
+        )
+
     def get_gradio_page(self):
         # Get list of available model files
         available_models = get_files_in_directory(str(models_path), [".txt"])
@@ -102,6 +139,39 @@ class UiModelPage:
             gpu_layers = gr.Slider(0, 100, value=0, label="GPU layers to offload")
             temperature = gr.Slider(0, 2, value=0.7, label="Temperature")
             seed = gr.Textbox(value="-1", label="Seed")
+            llm_workers = gr.Slider(1, 8, value=1, step=1, label="Parallel workers (one model instance each, for line identification)")
+            speculative_mode = gr.Radio(
+                ["none", "prompt_lookup", "draft_model"],
+                value="none",
+                label="Speculative decoding",
+                info="prompt_lookup drafts tokens by copying from the prompt, which suits line identification as its output is mostly copied text. draft_model drafts with a small model of the same family"
+            )
+            draft_model_path = gr.Textbox(label="Draft model path (for draft_model)")
+            speculative_tokens = gr.Slider(1, 32, value=10, step=1, label="Tokens drafted at a time")
+            use_response_cache = gr.Checkbox(value=True, label="Reuse cached responses for text already identified with this model and settings")
+
+            # llama.cpp runtime performance settings, filled in from the chosen preset
+            logical_cpus, _ = get_cpu_counts()
+            default_profile = get_runtime_profile()
+
+            with gr.Accordion("Runtime performance", open=False):
+                runtime_preset = gr.Dropdown(
+                    list(get_runtime_presets()),
+                    value="default",
+                    label="Preset",
+                    info="autotuned is the profile saved by the llm_autotune benchmark, once it has been run"
+                )
+                n_threads = gr.Slider(0, logical_cpus, value=0, step=1, label="Generation threads (0 for the llama.cpp default)")
+                n_threads_batch = gr.Slider(0, logical_cpus, value=0, step=1, label="Prompt processing threads (0 for the llama.cpp default)")
+                n_batch = gr.Slider(32, 4096, value=default_profile['n_batch'], step=32, label="Batch size (prompt tokens submitted at a time)")
+                n_ubatch = gr.Slider(32, 4096, value=default_profile['n_ubatch'], step=32, label="Micro-batch size (prompt tokens computed at a time, at most the batch size)")
+                use_mmap = gr.Checkbox(value=default_profile['use_mmap'], label="Memory map the model file")
+                use_mlock = gr.Checkbox(value=default_profile['use_mlock'], label="Lock the model in RAM")
+                flash_attn = gr.Checkbox(value=default_profile['flash_attn'], label="Flash attention (needed for a quantized KV cache)")
+                kv_cache_type = gr.Dropdown(list(KV_CACHE_TYPES), value=default_profile['kv_cache_type'], label="KV cache type")
+
+            runtime_settings = [n_threads, n_threads_batch, n_batch, n_ubatch, use_mmap, use_mlock, flash_attn, kv_cache_type]
+            runtime_preset.change(self.apply_runtime_preset, inputs=runtime_preset, outputs=runtime_settings)
 
             # Load model button and result
             load_button = gr.Button("Load Model")
@@ -109,7 +179,7 @@ class UiModelPage:
 
             load_button.click(
                 self.load_model,
-                inputs=[model_source, model_dropdown, model_path_str, repo_id, context_length, gpu_layers, temperature, seed],
+                inputs=[model_source, model_dropdown, model_path_str, repo_id, context_length, gpu_layers, temperature, seed, llm_workers, use_response_cache, speculative_mode, draft_model_path, speculative_tokens, runtime_preset] + runtime_settings,
                 outputs=[result]
             )
 
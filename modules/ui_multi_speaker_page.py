@@ -1,6 +1,6 @@
 import gradio as gr
 from pathlib import Path
-from utils import get_folders_in_directory
+from utils import get_folders_in_directory, get_output_sample_rate_choice, OUTPUT_FORMAT_CHOICES, OUTPUT_SAMPLE_RATE_CHOICES, MODEL_SAMPLE_RATE_CHOICE
 
 # Set path to where multi-speaker outputs are stored
 script_dir = Path(__file__).resolve().parent
@@ -11,27 +11,33 @@ class UiMultiSpeakerPage:
         self._session = session
         self.multi_speaker_page = self.get_gradio_page()  # Build the UI
 
-    def generate_multi_speaker_audio(self, folder_choice_type, existing_output_folder, absolute_folder_path):
+    def generate_multi_speaker_audio(self, folder_choice_type, existing_output_folder, absolute_folder_path, resume, output_format, output_sample_rate):
         # Determine which folder path to use
         if folder_choice_type == "From Project Outputs":
             if not existing_output_folder:
-                return "Please select a folder from the outputs list.", None
+                return "Please select a folder from the outputs list."
             book_folder_path = Path(existing_output_folder)
         elif folder_choice_type == "Use Absolute Path":
             if not absolute_folder_path.strip():
-                return "Please enter a valid absolute folder path.", None
+                return "Please enter a valid absolute folder path."
             book_folder_path = Path(absolute_folder_path)
         else:
-            return "Invalid folder selection type.", None
+            return "Invalid folder selection type."
 
         # Make sure the folder actually exists
         if not book_folder_path.exists():
-            return f"Folder does not exist: {book_folder_path}", None
+            return f"Folder does not exist: {book_folder_path}"
 
+        # Queue the book, it runs in the background alongside other books and its progress is shown on the Jobs tab
         print(f"Generating audio from: {book_folder_path}")
-        audio_path = self._session.generate_multi_speaker_audio(str(book_folder_path))  # Trigger session method
+        job = self._session.submit_generate_multi_speaker_audio(
+            str(book_folder_path),
+            resume=resume,
+            output_file_type="." + output_format,
+            output_sample_rate=get_output_sample_rate_choice(output_sample_rate)
+        )  # Trigger session method
 
-        return f"Multi-speaker audio generated from: {book_folder_path}", audio_path
+        return f"Submitted job {job.id}: {job.name}\nFollow its progress on the Jobs tab."
 
     def refresh_folder_choices(self):
         # Return updated dropdown list of folders
@@ -81,12 +87,31 @@ class UiMultiSpeakerPage:
                 outputs=[existing_folder]
             )
 
+            resume = gr.Checkbox(
+                value=True,
+                label="Resume",
+                info="Skip chapters and lines that were already generated for this folder by a previous run."
+            )
+
+            output_format = gr.Dropdown(
+                choices=OUTPUT_FORMAT_CHOICES,
+                value="wav",
+                label="Output Format",
+                info="FLAC, Opus and MP3 are much smaller than WAV. Only WAV chapters can be resumed part way through."
+            )
+
+            output_sample_rate = gr.Dropdown(
+                choices=OUTPUT_SAMPLE_RATE_CHOICES,
+                value=MODEL_SAMPLE_RATE_CHOICE,
+                label="Output Sample Rate"
+            )
+
             generate_button = gr.Button("Generate Multi-Speaker Audio")
             status_text = gr.Textbox(label="Status")
 
             generate_button.click(
                 self.generate_multi_speaker_audio,
-                inputs=[folder_source, existing_folder, absolute_path],
+                inputs=[folder_source, existing_folder, absolute_path, resume, output_format, output_sample_rate],
                 outputs=[status_text]
             )
 
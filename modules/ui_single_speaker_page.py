@@ -1,6 +1,6 @@
 import gradio as gr
 from pathlib import Path
-from utils import get_files_in_directory, get_folders_in_directory
+from utils import get_files_in_directory, get_folders_in_directory, get_output_sample_rate_choice, OUTPUT_FORMAT_CHOICES, OUTPUT_SAMPLE_RATE_CHOICES, MODEL_SAMPLE_RATE_CHOICE
 
 # Paths to voice options and single-speaker outputs
 script_dir = Path(__file__).resolve().parent
@@ -12,12 +12,12 @@ class UiSingleSpeakerPage:
         self._session = session
         self.single_speaker_page = self.get_gradio_page()  # Initialize UI
 
-    def gradio_generate_audio(self, input_text, input_file, voice, new_output_folder, existing_output_folder):
+    def gradio_generate_audio(self, input_text, input_file, voice, new_output_folder, existing_output_folder, output_format, output_sample_rate):
         output_folder = None
 
         # Make sure a voice is selected
         if not voice:
-            return "Please select a voice.", None
+            return "Please select a voice."
 
         # Determine output folder (existing or new)
         if new_output_folder:
@@ -37,17 +37,24 @@ class UiSingleSpeakerPage:
             user_input = input_file.name
             is_file = True
         else:
-            return "Please provide either text or a file.", None
-
-        # Generate audio via session
-        audio_path = self._session.generate_audio(user_input, voice, is_file, str(output_folder) if output_folder else None)
+            return "Please provide either text or a file."
+
+        # Queue the audio generation, it runs in the background and its progress is shown on the Jobs tab
+        job = self._session.submit_generate_audio(
+            user_input,
+            voice,
+            is_file,
+            str(output_folder) if output_folder else None,
+            output_file_type="." + output_format,
+            output_sample_rate=get_output_sample_rate_choice(output_sample_rate)
+        )
 
         # Return result status
         if output_folder:
-            status_msg = f"Audio saved in folder: {output_folder}"
+            status_msg = f"Submitted job {job.id}: {job.name}\nAudio will be saved in folder: {output_folder}"
         else:
-            status_msg = "Audio generated from text input (no folder used)."
-        return status_msg, audio_path
+            status_msg = f"Submitted job {job.id}: {job.name}\nThe generated audio can be played on the Jobs tab."
+        return status_msg
 
     def refresh_folder_choices(self):
         updated_folders = get_folders_in_directory(str(outputs_path))
@@ -122,15 +129,18 @@ class UiSingleSpeakerPage:
                 outputs=[existing_output]
             )
 
+            # Output file format
+            output_format = gr.Dropdown(choices=OUTPUT_FORMAT_CHOICES, value="wav", label="Output Format")
+            output_sample_rate = gr.Dropdown(choices=OUTPUT_SAMPLE_RATE_CHOICES, value=MODEL_SAMPLE_RATE_CHOICE, label="Output Sample Rate")
+
             # Output components
             generate_button = gr.Button("Generate Audio")
             status = gr.Textbox(label="Status")
-            output_audio = gr.Audio(label="Generated Audio")
 
             generate_button.click(
                 self.gradio_generate_audio,
-                inputs=[input_text, input_file, voice, new_output, existing_output],
-                outputs=[status, output_audio]
+                inputs=[input_text, input_file, voice, new_output, existing_output, output_format, output_sample_rate],
+                outputs=[status]
             )
 
         return demo
@@ -4,6 +4,11 @@ import os
 import json
 from pathlib import Path
 
+# Output audio formats and sample rates offered in the UI
+OUTPUT_FORMAT_CHOICES = ["wav", "flac", "opus", "mp3"]
+MODEL_SAMPLE_RATE_CHOICE = "Model default"
+OUTPUT_SAMPLE_RATE_CHOICES = [MODEL_SAMPLE_RATE_CHOICE, "16000", "22050", "24000", "44100", "48000"]
+
 # List all valid files in a directory that don't match ignored extensions
 def get_files_in_directory(directory_path, files_to_ignore):
     file_paths = []
@@ -42,3 +47,11 @@ def save_file_to_directory(directory_path, file_name, content):
 # Count files in a given directory
 def count_files_in_directory(directory):
     return len([f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))])
+
+
+# Convert a sample rate chosen in the UI to the value passed on, None keeps the model's sample rate
+def get_output_sample_rate_choice(choice):
+    if not choice or choice == MODEL_SAMPLE_RATE_CHOICE:
+        return None
+
+    return int(choice)
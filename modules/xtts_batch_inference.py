@@ -0,0 +1,115 @@
+import torch
+import torch.nn.functional as F
+import numpy as np
+
+
+# Synthesize several texts in one voice with the XTTS model, running the GPT's token generation for all of them in one batch
+# and the decoder over all of them in one pass. Returns the float samples of each text, in the order of texts.
+# Texts should be of similar lengths, as every text in the batch is padded to the longest. Sampling settings are the
+# keyword arguments Xtts.inference takes
+@torch.inference_mode()
+def xtts_inference_batch(xtts_model, texts, language, gpt_cond_latent, speaker_embedding, temperature=0.75, length_penalty=1.0,
+                         repetition_penalty=10.0, top_k=50, top_p=0.85):
+    gpt = xtts_model.gpt
+    device = xtts_model.device
+    gpt_cond_latent = gpt_cond_latent.to(device)
+    speaker_embedding = speaker_embedding.to(device)
+
+    # Tokenized the same way Xtts.inference does
+    text_tokens = []
+
+    for text in texts:
+        tokens = torch.IntTensor(xtts_model.tokenizer.encode(text.strip().lower(), lang=language)).unsqueeze(0).to(device)
+
+        if tokens.shape[-1] >= xtts_model.args.gpt_max_text_tokens:
+            raise ValueError(f"Text is {tokens.shape[-1]} tokens, XTTS can only take fewer than {xtts_model.args.gpt_max_text_tokens}: {text}")
+
+        text_tokens.append(tokens)
+
+    gpt_codes = generate_gpt_codes_batch(
+        gpt, gpt_cond_latent, text_tokens,
+        do_sample=True, num_beams=1, num_return_sequences=1, output_attentions=False,
+        temperature=temperature, length_penalty=length_penalty, repetition_penalty=repetition_penalty, top_k=top_k, top_p=top_p
+    )
+
+    # The latents are a single pass over each text and its codes. The GPT attends to every position in this pass,
+    # so padding would change them, and they are computed one text at a time
+    gpt_latents = []
+
+    for tokens, codes in zip(text_tokens, gpt_codes):
+        codes = codes.unsqueeze(0)
+        gpt_latents.append(gpt(
+            tokens,
+            torch.tensor([tokens.shape[-1]], device=device),
+            codes,
+            torch.tensor([codes.shape[-1] * gpt.code_stride_len], device=device),
+            cond_latents=gpt_cond_latent,
+            return_attentions=False,
+            return_latent=True
+        ))
+
+    return decode_latents_batch(xtts_model.hifigan_decoder, gpt_latents, speaker_embedding)
+
+
+# Generate the audio codes of several texts with one call to the GPT's generate, returning the codes of each text up to
+# and including its stop token, as GPT.generate returns them for a single text. Each text's prompt of conditioning latents
+# and text embeddings is left padded to the longest, with the padding masked out of attention. The audio codes are
+# then generated at the same positions for every text, so their position embeddings are the same as without padding
+def generate_gpt_codes_batch(gpt, gpt_cond_latent, text_tokens, **hf_generate_kwargs):
+    prompts = []
+
+    for tokens in text_tokens:
+        tokens = F.pad(tokens, (0, 1), value=gpt.stop_text_token)
+        tokens = F.pad(tokens, (1, 0), value=gpt.start_text_token)
+        text_emb = gpt.text_embedding(tokens) + gpt.text_pos_embedding(tokens)
+        prompts.append(torch.cat([gpt_cond_latent, text_emb], dim=1))
+
+    prompt_length = max(prompt.shape[1] for prompt in prompts)
+    prefix_emb = prompts[0].new_zeros((len(prompts), prompt_length, prompts[0].shape[2]))
+    attention_mask = torch.zeros((len(prompts), prompt_length + 1), dtype=torch.long, device=prefix_emb.device)
+
+    for i, prompt in enumerate(prompts):
+        prefix_emb[i, prompt_length - prompt.shape[1]:] = prompt[0]
+        attention_mask[i, prompt_length - prompt.shape[1]:] = 1
+
+    gpt.gpt_inference.store_prefix_emb(prefix_emb)
+
+    # The prompt positions are placeholders for the stored embeddings, followed by the token that starts the audio
+    gpt_inputs = torch.full((len(prompts), prompt_length + 1), fill_value=1, dtype=torch.long, device=prefix_emb.device)
+    gpt_inputs[:, -1] = gpt.start_audio_token
+
+    codes = gpt.gpt_inference.generate(
+        gpt_inputs,
+        attention_mask=attention_mask,
+        bos_token_id=gpt.start_audio_token,
+        pad_token_id=gpt.stop_audio_token,
+        eos_token_id=gpt.stop_audio_token,
+        max_length=gpt.max_gen_mel_tokens + gpt_inputs.shape[-1],
+        **hf_generate_kwargs
+    )[:, gpt_inputs.shape[-1]:]
+
+    # Texts that finished early are padded with stop tokens up to the longest
+    text_codes = []
+
+    for row in codes:
+        stop_positions = (row == gpt.stop_audio_token).nonzero()
+        text_codes.append(row[:stop_positions[0, 0] + 1] if len(stop_positions) > 0 else row)
+
+    return text_codes
+
+
+# Run the decoder once over the GPT latents of several texts, padded with zeros to the longest, and cut each text's samples
+# back to its own length. Only the last samples of the shorter texts are near the padding, and they are the pause at its end
+def decode_latents_batch(hifigan_decoder, gpt_latents, speaker_embedding):
+    latent_lengths = [latents.shape[1] for latents in gpt_latents]
+    max_latent_length = max(latent_lengths)
+
+    padded_latents = torch.cat([F.pad(latents, (0, 0, 0, max_latent_length - latents.shape[1])) for latents in gpt_latents], dim=0)
+    wavs = hifigan_decoder(padded_latents, g=speaker_embedding.expand(len(gpt_latents), -1, -1)).cpu()
+
+    samples_per_latent = wavs.shape[-1] // max_latent_length
+
+    return [
+        np.asarray(wav.reshape(-1)[:latent_length * samples_per_latent], dtype=np.float32)
+        for wav, latent_length in zip(wavs, latent_lengths)
+    ]